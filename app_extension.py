@@ -5,6 +5,7 @@ from dotenv import load_dotenv
 from openai import OpenAI
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfgen import canvas
+from text_layout import TextLayout
 import tkinter as tk
 from tkinter import filedialog
 
@@ -456,9 +457,10 @@ def generate_pdf(lesson_plan, filename="lesson_plan.pdf", save_to_desktop=False)
         pdf.drawString(x_margin, y_position, "Mathematics Lesson Plan")
         y_position -= 30
 
-        # Add content line by line
+        # Add content line by line, wrapped at word boundaries to the margins
         pdf.setFont("Helvetica", 12)
-        for line in lesson_plan.split("\n"):
+        layout = TextLayout("Helvetica", 12, width - 2 * x_margin)
+        for line in layout.wrap(lesson_plan):
             if y_position < 50:  # Start a new page if the content exceeds the page height
                 pdf.showPage()
                 pdf.setFont("Helvetica", 12)
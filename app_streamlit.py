@@ -1,9 +1,7 @@
 import os
 import streamlit as st
 from dotenv import load_dotenv
-import tempfile
-import base64
-import time
+import hashlib
 import re
 
 # Load environment variables and set up page
@@ -17,16 +15,36 @@ st.set_page_config(
 
 # Import controller with error handling
 try:
-    from content_generator import LessonPlanController, DocumentManager
+    from content_generator import (
+        LessonPlanController, ConfigManager, DocumentManager,
+        SharedDocumentLibrary, DocumentLibraryView, PDFRenderCache
+    )
+    
+    @st.cache_resource
+    def get_shared_library():
+        """One document library per server process, shared by all sessions."""
+        # Cold documents beyond the budget are spilled to disk
+        budget_mb = int(os.getenv("DOCUMENT_MEMORY_BUDGET_MB", "512"))
+        return SharedDocumentLibrary(DocumentManager(ConfigManager(), memory_budget=budget_mb * 1024 * 1024))
+    
+    @st.cache_resource
+    def get_pdf_cache():
+        """One PDF render cache per server process, shared by all sessions."""
+        return PDFRenderCache()
     
     # Initialize controller in session state
     if 'controller' not in st.session_state:
         api_key = st.session_state.get('api_key', os.getenv("OPENAI_API_KEY"))
-        st.session_state.controller = LessonPlanController(api_key=api_key)
+        # Each session gets a lightweight view; documents live in the shared library
+        st.session_state.controller = LessonPlanController(
+            api_key=api_key,
+            document_manager=DocumentLibraryView(get_shared_library()),
+            pdf_cache=get_pdf_cache()
+        )
         
         # Ensure document_manager exists
         if not hasattr(st.session_state.controller, 'document_manager'):
-            st.session_state.controller.document_manager = DocumentManager(st.session_state.controller.config)
+            st.session_state.controller.document_manager = DocumentLibraryView(get_shared_library())
 except ImportError as e:
     st.error(f"Failed to import required modules: {str(e)}")
     st.stop()
@@ -169,25 +187,35 @@ def extract_grade_level(text):
             return int(match[1])
     return None
 
-def create_download_link(content, filename, button_text):
-    """Create a downloadable PDF button."""
+def pdf_download(content, filename, button_text):
+    """
+    Offer a PDF download that is only rendered when the user asks for it.
+    
+    A prepare button renders the PDF (through the shared render cache) and
+    swaps in a download button that streams the bytes as a file, rather
+    than inlining a base64 data URI in the page on every rerun.
+    """
+    state_key = f"pdf_ready_{filename}"
+    content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    
+    # Prepared earlier for this exact content, or requested on this run
+    if st.session_state.get(state_key) != content_hash:
+        if not st.button(f"📄 Prepare {filename}", key=f"prepare_{filename}"):
+            return
+        st.session_state[state_key] = content_hash
+    
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-            # Generate PDF
-            st.session_state.controller._generate_pdf(content, tmp_file.name)
-            
-            # Create download link
-            with open(tmp_file.name, "rb") as pdf_file:
-                pdf_bytes = pdf_file.read()
-                encoded = base64.b64encode(pdf_bytes).decode()
-            
-            # Remove temp file
-            os.unlink(tmp_file.name)
-            
-            # Return HTML link
-            return f'<a href="data:application/pdf;base64,{encoded}" download="{filename}" class="action-button">{button_text}</a>'
+        pdf_bytes = st.session_state.controller.render_pdf_bytes(content)
     except Exception as e:
-        return f"Error creating download link: {str(e)}"
+        st.error(f"Error creating PDF: {str(e)}")
+        return
+    st.download_button(
+        button_text,
+        data=pdf_bytes,
+        file_name=filename,
+        mime="application/pdf",
+        key=f"download_{filename}"
+    )
 
 def process_user_message(message):
     """Process user message and determine action to take."""
@@ -360,14 +388,14 @@ with col2:
         st.markdown(content)
         
         # Add download button
-        st.markdown(create_download_link(content, "lesson_plan.pdf", "📥 Download Lesson Plan"), unsafe_allow_html=True)
+        pdf_download(content, "lesson_plan.pdf", "📥 Download Lesson Plan")
     
     elif content_type == "worksheet":
         st.markdown("### Worksheet")
         st.markdown(content)
         
         # Add download button
-        st.markdown(create_download_link(content, "worksheet.pdf", "📥 Download Worksheet"), unsafe_allow_html=True)
+        pdf_download(content, "worksheet.pdf", "📥 Download Worksheet")
     
     st.markdown('</div>', unsafe_allow_html=True)
     
@@ -384,11 +412,10 @@ with st.sidebar:
     
     if uploaded_file:
         with st.spinner("Processing document..."):
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f".{uploaded_file.name.split('.')[-1]}") as tmp_file:
-                tmp_file.write(uploaded_file.getbuffer())
-                file_path = tmp_file.name
-            
-            doc_id = st.session_state.controller.document_manager.import_document(file_path)
+            # Parse straight from the upload buffer; no temp file round trip
+            doc_id = st.session_state.controller.document_manager.import_bytes(
+                uploaded_file.getbuffer(), uploaded_file.name
+            )
             
             if not doc_id.startswith("Error"):
                 st.success(f"Document uploaded: {uploaded_file.name}")
@@ -396,7 +423,9 @@ with st.sidebar:
                 if 'documents' not in st.session_state:
                     st.session_state.documents = []
                 
-                st.session_state.documents.append({"id": doc_id, "name": uploaded_file.name})
+                # The uploader keeps its file across reruns, so only list it once
+                if not any(doc["id"] == doc_id for doc in st.session_state.documents):
+                    st.session_state.documents.append({"id": doc_id, "name": uploaded_file.name})
             else:
                 st.error(f"Failed to upload: {doc_id}")
     
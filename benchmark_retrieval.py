@@ -0,0 +1,327 @@
+"""
+Benchmarks for DocumentManager retrieval at scale.
+
+Generates a synthetic corpus of math-pedagogy documents across grades and
+curricula, imports it into each storage backend, and measures import
+throughput, index build time, memory footprint and query latency
+percentiles for every retrieval mode. Results are written as JSON so runs
+can be compared.
+
+Usage:
+    python benchmark_retrieval.py --docs 1000 --queries 200 --output results.json
+    python benchmark_retrieval.py --docs 100000 --backends sqlite --modes lexical
+"""
+
+import os
+import gc
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from content_generator import ConfigManager, DocumentManager, SQLiteDocumentBackend
+
+GRADES = [1, 2, 3, 4, 5]
+CURRICULA = ["Common Core", "UK NCETM", "Indian NCERT"]
+CATEGORIES = ["teaching_strategies", "curriculum_standards", "lesson_plans", "research"]
+
+# Topics by grade, with vocabulary used in their documents
+TOPICS = {
+    1: {
+        "counting to 100": ["counting", "tens", "ones", "number", "line", "sequence"],
+        "addition within 20": ["addition", "bonds", "partitioning", "counters", "doubles"],
+        "2D shapes": ["shapes", "sides", "corners", "circle", "triangle", "sorting"]
+    },
+    2: {
+        "place value": ["place", "value", "tens", "ones", "regrouping", "dienes"],
+        "subtraction with regrouping": ["subtraction", "regrouping", "exchange", "column", "difference"],
+        "measuring length": ["measurement", "length", "centimetres", "rulers", "estimation"]
+    },
+    3: {
+        "multiplication facts": ["multiplication", "arrays", "groups", "times", "tables", "fluency"],
+        "fractions": ["fractions", "numerator", "denominator", "equal", "parts", "bar", "model"],
+        "perimeter": ["perimeter", "length", "sides", "rectilinear", "shapes"]
+    },
+    4: {
+        "long multiplication": ["multiplication", "column", "method", "partial", "products", "estimation"],
+        "equivalent fractions": ["fractions", "equivalent", "simplify", "numerator", "denominator"],
+        "area": ["area", "squares", "rectangles", "units", "arrays"]
+    },
+    5: {
+        "decimals": ["decimals", "tenths", "hundredths", "place", "value", "rounding"],
+        "percentages": ["percentages", "fractions", "decimals", "hundred", "proportion"],
+        "volume": ["volume", "cubes", "cuboids", "capacity", "units"]
+    }
+}
+
+PEDAGOGY = [
+    "concrete", "pictorial", "abstract", "manipulatives", "reasoning", "misconception",
+    "questioning", "modelling", "practice", "assessment", "differentiation", "scaffolding",
+    "talk", "partners", "explain", "justify", "representation", "variation", "fluency"
+]
+
+SECTIONS = ["Learning objectives", "Key vocabulary", "Teaching sequence", "Common misconceptions",
+            "Assessment", "Differentiation"]
+
+# Shared across documents, as in real schemes of work
+BOILERPLATE = (
+    "All pupils, including those with SEND, should access fluency, reasoning and problem "
+    "solving activities, with adult support and manipulatives available where required."
+)
+
+def generate_document(rng, doc_no):
+    """
+    Generate one synthetic math-pedagogy document.
+
+    Args:
+        rng (random.Random): Random source
+        doc_no (int): Document number, used in the title
+
+    Returns:
+        tuple: (text, metadata dict)
+    """
+    grade = rng.choice(GRADES)
+    curriculum = rng.choice(CURRICULA)
+    topic = rng.choice(list(TOPICS[grade]))
+    vocabulary = TOPICS[grade][topic]
+
+    def sentence(length):
+        words = [rng.choice(vocabulary) if rng.random() < 0.4 else rng.choice(PEDAGOGY) for _ in range(length)]
+        return " ".join(words).capitalize() + "."
+
+    paragraphs = [f"Grade {grade} {topic} ({curriculum}) - unit {doc_no}"]
+    for section in rng.sample(SECTIONS, rng.randint(3, len(SECTIONS))):
+        paragraphs.append(f"{section}:")
+        if rng.random() < 0.4:
+            paragraphs.append("\n".join(f"- {sentence(rng.randint(5, 10))}" for _ in range(rng.randint(2, 5))))
+        for _ in range(rng.randint(1, 3)):
+            paragraphs.append(" ".join(sentence(rng.randint(8, 18)) for _ in range(rng.randint(2, 5))))
+    paragraphs.append(BOILERPLATE)
+
+    metadata = {
+        "category": rng.choice(CATEGORIES),
+        "grade": grade,
+        "curriculum": curriculum,
+        "topic": topic
+    }
+    return "\n\n".join(paragraphs), metadata
+
+def write_corpus(directory, num_docs, seed=0):
+    """
+    Write a synthetic curriculum corpus to text files.
+
+    Args:
+        directory (str): Directory to write the files to
+        num_docs (int): Number of documents
+        seed (int): Random seed
+
+    Returns:
+        list: (path, metadata) for each written file
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for doc_no in range(num_docs):
+        text, metadata = generate_document(rng, doc_no)
+        path = os.path.join(directory, f"doc_{doc_no}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        corpus.append((path, metadata))
+    return corpus
+
+def generate_queries(num_queries, seed=0):
+    """
+    Generate teacher-style retrieval queries with optional facet filters.
+
+    Returns:
+        list: (query, filters or None)
+    """
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(num_queries):
+        grade = rng.choice(GRADES)
+        topic = rng.choice(list(TOPICS[grade]))
+        query = f"how to teach {topic} using {rng.choice(PEDAGOGY)} and {rng.choice(PEDAGOGY)}"
+        filters = {"grade": grade, "curriculum": rng.choice(CURRICULA)} if rng.random() < 0.5 else None
+        queries.append((query, filters))
+    return queries
+
+def percentile(samples, fraction):
+    """Get a percentile from a list of samples."""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def resident_memory_mb():
+    """Get the current resident set size of this process in MB."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        import resource
+        # Peak rather than current usage where /proc is unavailable
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def import_corpus(manager, corpus, batch_size):
+    """
+    Import a corpus in batches, timing backend index writes separately.
+
+    import_documents applies one set of facets to a whole call, so documents
+    are grouped by facets and each group is imported in batches. Within a
+    batch every document is parsed, chunked and embedded before the backend
+    indexes the batch, so the time from the last "embedded" event to the
+    first "indexed" event is the batch's index build time.
+
+    Returns:
+        tuple: (total seconds, index build seconds)
+    """
+    groups = {}
+    for path, metadata in corpus:
+        groups.setdefault(tuple(sorted(metadata.items())), []).append(path)
+
+    index_seconds = 0.0
+    marks = {}
+
+    def progress(position, stage):
+        now = time.perf_counter()
+        if stage == "embedded":
+            marks["embedded"] = now
+        elif stage == "indexed":
+            marks.setdefault("indexed", now)
+
+    start = time.perf_counter()
+    for facets, paths in groups.items():
+        for batch_start in range(0, len(paths), batch_size):
+            marks.clear()
+            manager.import_documents(paths[batch_start:batch_start + batch_size], dict(facets), progress)
+            if "embedded" in marks and "indexed" in marks:
+                index_seconds += marks["indexed"] - marks["embedded"]
+    return time.perf_counter() - start, index_seconds
+
+def benchmark_backend(name, manager, corpus, queries, modes, batch_size=500):
+    """
+    Measure import, index build, memory and query latency for one manager.
+
+    Args:
+        name (str): Backend name for the results
+        manager: DocumentManager to benchmark
+        corpus (list): (path, metadata) for each document
+        queries (list): (query, filters) pairs
+        modes (list): Retrieval modes to time
+        batch_size (int): Documents per import batch
+
+    Returns:
+        dict: Benchmark results
+    """
+    gc.collect()
+    memory_before = resident_memory_mb()
+    import_seconds, index_seconds = import_corpus(manager, corpus, batch_size)
+    gc.collect()
+    memory_after = resident_memory_mb()
+
+    result = {
+        "backend": name,
+        "documents": len(corpus),
+        "import_seconds": import_seconds,
+        "import_docs_per_second": len(corpus) / import_seconds if import_seconds else None,
+        "index_build_seconds": index_seconds,
+        "memory_mb": memory_after - memory_before,
+        "modes": {}
+    }
+    content_store = getattr(manager.backend, "content_store", None)
+    if content_store is not None:
+        result["content_store"] = content_store.get_stats()
+
+    for mode in modes:
+        latencies = []
+        empty = 0
+        for query_no, (query, filters) in enumerate(queries):
+            # Distinct budgets keep every query out of the result cache
+            max_tokens = 1000 + query_no
+            start = time.perf_counter()
+            context = manager.get_relevant_context(query, max_tokens=max_tokens, filters=filters, mode=mode)
+            latencies.append(time.perf_counter() - start)
+            empty += not context
+        result["modes"][mode] = {
+            "queries": len(latencies),
+            "empty_results": empty,
+            "p50_ms": percentile(latencies, 0.5) * 1000,
+            "p95_ms": percentile(latencies, 0.95) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "mean_ms": sum(latencies) / len(latencies) * 1000
+        }
+
+    duplicate_stats = manager.get_duplicate_stats()
+    if duplicate_stats is not None:
+        result["near_duplicates"] = duplicate_stats
+    return result
+
+def run_backend(name, db_path, corpus, queries, modes, batch_size):
+    """
+    Build a manager for one backend and benchmark it.
+
+    Runs in its own worker process so each backend's memory footprint is
+    measured from a clean heap.
+    """
+    backend = SQLiteDocumentBackend(db_path) if name == "sqlite" else None
+    manager = DocumentManager(ConfigManager(), backend=backend)
+    try:
+        return benchmark_backend(name, manager, corpus, queries, modes, batch_size)
+    finally:
+        manager.backend.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark DocumentManager retrieval on a synthetic corpus.")
+    parser.add_argument("--docs", type=int, default=1000, help="Number of documents to generate and import")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries to time per mode")
+    parser.add_argument("--backends", nargs="+", default=["memory", "sqlite"], choices=["memory", "sqlite"],
+                        help="Storage backends to benchmark")
+    parser.add_argument("--modes", nargs="+", default=list(DocumentManager.RETRIEVAL_MODES),
+                        choices=list(DocumentManager.RETRIEVAL_MODES), help="Retrieval modes to time")
+    parser.add_argument("--batch-size", type=int, default=500, help="Documents per import batch")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for corpus and queries")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    queries = generate_queries(args.queries, args.seed)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start = time.perf_counter()
+        corpus = write_corpus(tmp_dir, args.docs, args.seed)
+        print(f"Generated {len(corpus)} documents in {time.perf_counter() - start:.1f} s")
+
+        for name in args.backends:
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                results.append(pool.submit(
+                    run_backend, name, os.path.join(tmp_dir, "documents.db"),
+                    corpus, queries, args.modes, args.batch_size
+                ).result())
+
+    for result in results:
+        print(f"{result['backend']:>8}: {result['import_docs_per_second']:.1f} docs/s import, "
+              f"index build {result['index_build_seconds']:.2f} s, memory {result['memory_mb']:.1f} MB")
+        for mode, stats in result["modes"].items():
+            print(f"{'':>10}{mode:>8}: p50 {stats['p50_ms']:.2f} ms, p95 {stats['p95_ms']:.2f} ms, "
+                  f"p99 {stats['p99_ms']:.2f} ms")
+
+    if args.output:
+        report = {
+            "run": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "documents": args.docs,
+                "queries": args.queries,
+                "seed": args.seed
+            },
+            "results": results
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,82 @@
 import os
+import io
 import json
 import re
+import hashlib
+import sqlite3
+import struct
+import zipfile
+import zlib
+import math
+import queue
+import bisect
+import heapq
+import threading
+import time
+import weakref
+import pickle
+import shutil
+import itertools
+import tempfile
+import http.client
+from array import array
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import (
+    Future, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait, FIRST_COMPLETED
+)
+from html.parser import HTMLParser
+from urllib.parse import urlsplit, urljoin
+from xml.etree import ElementTree
 from dotenv import load_dotenv
 from openai import OpenAI
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfgen import canvas
+from text_layout import TextLayout
 import tkinter as tk
 from tkinter import filedialog
 
+try:
+    import tiktoken  # Optional: exact token counts for context packing
+except ImportError:
+    tiktoken = None
+
+try:
+    from pypdf import PdfReader  # Optional: PDF text extraction
+except ImportError:
+    PdfReader = None
+
+try:
+    import fcntl  # Optional: cross-process locking of shared cache files (POSIX only)
+except ImportError:
+    fcntl = None
+
 # Load environment variables from .env file (e.g., API keys)
 load_dotenv()
 
+# XML namespace of WordprocessingML elements in .docx files
+WORD_NAMESPACE = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+
 #########################
 # CONFIG MODULE
 #########################
 
+def app_data_path(filename):
+    """
+    Get the path of a file in the application data directory.
+    
+    The directory is LESSON_PLANNER_DATA_DIR if set, otherwise
+    ~/.lesson_plan_generator, and is created on first use.
+    
+    Args:
+        filename (str): File name within the directory
+        
+    Returns:
+        str: Absolute path of the file
+    """
+    data_dir = os.getenv("LESSON_PLANNER_DATA_DIR") or os.path.join(os.path.expanduser("~"), ".lesson_plan_generator")
+    os.makedirs(data_dir, exist_ok=True)
+    return os.path.join(data_dir, filename)
+
 class ConfigManager:
     """Handles application configuration, API keys and model selection."""
     def __init__(self, api_key=None):
@@ -216,6 +278,33 @@ class ResearchModule:
 # WORKSHEET GENERATION MODULE
 #########################
 
+def _reference_section(reference_context, timeout=2.0):
+    """
+    Build the prompt section for context retrieved from uploaded documents.
+    
+    Args:
+        reference_context (str or Future): Retrieved context, or a Future
+            still retrieving it; a Future is only waited on here, after the
+            rest of the prompt has been built
+        timeout (float): Seconds to wait for a pending retrieval
+        
+    Returns:
+        str: Prompt section, or an empty string if there is no context
+    """
+    if reference_context is not None and not isinstance(reference_context, str):
+        try:
+            reference_context = reference_context.result(timeout=timeout)
+        except Exception as e:
+            print(f"Warning: Reference context unavailable: {e}")
+            reference_context = None
+    if not reference_context:
+        return ""
+    return f"""
+        REFERENCE MATERIAL (excerpts from the teacher's uploaded documents; follow their
+        terminology, methods and examples where relevant):
+        {reference_context}
+        """
+
 class WorksheetGenerator:
     """
     Responsible for generating educational worksheets aligned with lesson plans.
@@ -234,7 +323,8 @@ class WorksheetGenerator:
         """
         self.config = config_manager
     
-    def generate_worksheet(self, learning_outcome, context, lesson_plan=None, difficulty="mixed", model="gpt-3.5-turbo"):
+    def generate_worksheet(self, learning_outcome, context, lesson_plan=None, difficulty="mixed", model="gpt-3.5-turbo",
+                           reference_context=None):
         """
         Generate a worksheet based on learning outcomes and lesson context.
         Creates a worksheet with practice problems that align with the specified
@@ -247,6 +337,8 @@ class WorksheetGenerator:
             lesson_plan (str, optional): The full lesson plan to align with
             difficulty (str): Difficulty level - "easy", "medium", "hard", or "mixed"
             model (str): OpenAI model to use
+            reference_context (str or Future, optional): Context retrieved
+                from uploaded documents
             
         Returns:
             str: Generated worksheet content
@@ -299,6 +391,7 @@ class WorksheetGenerator:
         
         Format the worksheet as plain text.
         """
+        prompt += _reference_section(reference_context)
         
         try:
             # Call the OpenAI API to generate the worksheet
@@ -383,7 +476,8 @@ class LessonPlanGenerator:
         """
         self.config = config_manager
     
-    def generate_plan(self, learning_outcome, grade, curriculum, duration, context, model="gpt-3.5-turbo"):
+    def generate_plan(self, learning_outcome, grade, curriculum, duration, context, model="gpt-3.5-turbo",
+                      reference_context=None):
         """
         Generate a comprehensive lesson plan based on provided parameters.
         
@@ -398,6 +492,8 @@ class LessonPlanGenerator:
             duration (str): Lesson duration (e.g., "45 minutes")
             context (str): Contextual information about the topic
             model (str): OpenAI model to use
+            reference_context (str or Future, optional): Context retrieved
+                from uploaded documents
             
         Returns:
             str: Generated lesson plan content
@@ -427,6 +523,7 @@ class LessonPlanGenerator:
         
         Format the lesson plan as plain text with clear section headings.
         """
+        prompt += _reference_section(reference_context)
         
         try:
             # Call the OpenAI API to generate the lesson plan
@@ -494,282 +591,5167 @@ class LessonPlanGenerator:
 # DOCUMENT MANAGEMENT MODULE
 #########################
 
-class DocumentManager:
+class ContentStore:
     """
-    Manages document importing, parsing, and embedding for reference during content generation.
+    Content-addressed store for document text blocks.
+    
+    Blocks are keyed by their SHA-256 hash and reference counted, so text that
+    is shared between documents (for example two versions of the same scheme
+    of work) is held in memory only once. Blocks are kept zlib-compressed with
+    their sizes cached; reading a chunk decompresses only the blocks it spans,
+    and a small LRU keeps recently read blocks decompressed. All state is
+    guarded by one lock, held for dictionary updates but not while
+    compressing or decompressing.
     """
     
-    def __init__(self, config_manager):
-        """Initialize with configuration."""
-        self.config = config_manager
-        self.documents = {}  # Dictionary to store document content by ID
-        self.document_embeddings = {}  # Dictionary to store embeddings for RAG
+    COMPRESSION_LEVEL = 6
     
-    def import_document(self, file_path):
+    def __init__(self, cache_blocks=64):
         """
-        Import a document from file path and prepare it for reference.
+        Initialize an empty block store.
         
         Args:
-            file_path (str): Path to the document file
+            cache_blocks (int): Number of decompressed blocks to keep cached
+        """
+        self.blocks = {}  # Block hash -> compressed UTF-8 block text
+        self.sizes = {}  # Block hash -> block length in characters
+        self.refcounts = {}  # Block hash -> number of documents using it
+        self.cache_blocks = cache_blocks
+        self._cache = OrderedDict()  # Block hash -> decompressed text, oldest first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def put(self, text):
+        """
+        Store a block of text, or add a reference if it is already stored.
+        
+        Args:
+            text (str): Block text
             
         Returns:
-            str: Document ID for future reference or error message
+            str: Hash of the block
         """
-        try:
-            doc_id = f"doc_{len(self.documents) + 1}"
-            
-            file_ext = os.path.splitext(file_path)[1].lower()
-            
-            if file_ext == '.txt':
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-            elif file_ext == '.pdf':
-                content = self._extract_text_from_pdf(file_path)
-            elif file_ext in ['.docx', '.doc']:
-                content = self._extract_text_from_docx(file_path)
+        data = text.encode("utf-8")
+        block_hash = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            if block_hash in self.blocks:
+                self.refcounts[block_hash] += 1
+                return block_hash
+        compressed = zlib.compress(data, self.COMPRESSION_LEVEL)
+        self.put_compressed(block_hash, compressed, len(text))
+        return block_hash
+    
+    def get(self, block_hash, cache=True):
+        """
+        Get block text by hash.
+        
+        Args:
+            block_hash (str): Hash of the block
+            cache (bool): Whether to keep the decompressed block in the LRU;
+                whole-document reads pass False so they don't evict hot blocks
+        """
+        with self._lock:
+            text = self._cache.get(block_hash)
+            if text is not None:
+                self._cache.move_to_end(block_hash)
+                self.hits += 1
+                return text
+            self.misses += 1
+            data = self.blocks.get(block_hash)
+        if data is None:
+            return ""
+        text = zlib.decompress(data).decode("utf-8")
+        
+        if cache and self.cache_blocks > 0:
+            with self._lock:
+                # The block may have been released while it was decompressed
+                if block_hash in self.blocks:
+                    self._cache[block_hash] = text
+                    while len(self._cache) > self.cache_blocks:
+                        self._cache.popitem(last=False)
+        return text
+    
+    def get_compressed(self, block_hash):
+        """Get a block's compressed bytes and size in characters."""
+        with self._lock:
+            return self.blocks[block_hash], self.sizes[block_hash]
+    
+    def put_compressed(self, block_hash, data, size):
+        """Store an already compressed block, or add a reference if it is stored."""
+        with self._lock:
+            if block_hash in self.blocks:
+                self.refcounts[block_hash] += 1
             else:
-                return f"Error: Unsupported file format {file_ext}"
-            
-            self.documents[doc_id] = {
-                "content": content,
-                "path": file_path,
-                "name": os.path.basename(file_path),
-                "type": file_ext[1:]
+                self.blocks[block_hash] = data
+                self.sizes[block_hash] = size
+                self.refcounts[block_hash] = 1
+    
+    def release(self, block_hash):
+        """Drop one reference to a block, deleting it when no longer used."""
+        with self._lock:
+            if block_hash not in self.refcounts:
+                return
+            self.refcounts[block_hash] -= 1
+            if self.refcounts[block_hash] <= 0:
+                del self.refcounts[block_hash]
+                del self.blocks[block_hash]
+                del self.sizes[block_hash]
+                self._cache.pop(block_hash, None)
+    
+    def stored_bytes(self):
+        """Get the total size of all unique blocks in characters."""
+        with self._lock:
+            return sum(self.sizes.values())
+    
+    def get_stats(self):
+        """
+        Get storage and block cache statistics.
+        
+        Returns:
+            dict: Uncompressed characters, compressed bytes, compression
+                ratio and decompressed block cache hit rate
+        """
+        with self._lock:
+            compressed = sum(len(data) for data in self.blocks.values())
+            stored = sum(self.sizes.values())
+            lookups = self.hits + self.misses
+            return {
+                "blocks": len(self.blocks),
+                "stored_chars": stored,
+                "compressed_bytes": compressed,
+                "compression_ratio": stored / compressed if compressed else 0.0,
+                "cached_blocks": len(self._cache),
+                "cache_hit_rate": self.hits / lookups if lookups else 0.0
             }
-            
-            return doc_id
-        except Exception as e:
-            return f"Error importing document: {str(e)}"
+
+class SegmentedIndex:
+    """
+    Inverted index over document chunks, maintained incrementally.
     
-    def get_document_content(self, doc_id):
-        """Get document content by ID."""
-        return self.documents.get(doc_id, {}).get("content", "")
+    Each added document is written as a new immutable segment. Removing a
+    document only records a tombstone, which queries use to filter out its
+    postings. Once tombstoned postings pass a ratio of the index, or too many
+    small segments pile up, a background thread merges the segments. Queries
+    keep reading the old segments until the merged one is swapped in.
     
-    def get_relevant_context(self, query, doc_ids=None, max_tokens=1000):
-        """Use RAG to retrieve the most relevant portions of imported documents."""
-        if not self.documents:
-            return ""
-            
-        doc_ids = doc_ids or list(self.documents.keys())
-        relevant_sections = []
+    Running totals of indexed and tombstoned chunks are kept as segments
+    are added, removed and merged, so neither queries nor the compaction
+    check walk the segments to count them.
+    """
+    
+    def __init__(self, compaction_threshold=0.25, max_segments=32, background=True):
+        """
+        Initialize an empty index.
         
-        keywords = [k.lower() for k in query.split() if len(k) > 3]
+        Args:
+            compaction_threshold (float): Tombstoned posting ratio that triggers compaction
+            max_segments (int): Segment count that triggers compaction
+            background (bool): Run compaction in a background thread
+        """
+        self.compaction_threshold = compaction_threshold
+        self.max_segments = max_segments
+        self.background = background
+        self.segments = []  # Immutable segments, oldest first
+        self.tombstones = {}  # Doc ID -> last segment sequence number it covers
+        self.total_chunks = 0  # Chunks in all segments, including tombstoned ones
+        self.dead_chunks = 0  # Tombstoned chunks not yet dropped by compaction
+        self._live_chunks = {}  # Doc ID -> chunks in segments not tombstoned
+        self._next_seq = 0
+        self._lock = threading.Lock()
+        self._compacting = False
+    
+    @staticmethod
+    def tokenize(text):
+        """Split text into lowercase alphanumeric terms."""
+        return re.findall(r"[a-z0-9]+", text.lower())
+    
+    def add_document(self, doc_id, chunks):
+        """
+        Index a document's chunks as a new segment.
         
-        for doc_id in doc_ids:
-            if doc_id not in self.documents:
-                continue
-                
-            doc = self.documents[doc_id]
-            content = doc["content"]
-            paragraphs = content.split('\n\n')
-            
-            for paragraph in paragraphs:
-                if any(keyword in paragraph.lower() for keyword in keywords):
-                    relevant_sections.append(f"From {doc['name']}:\n{paragraph}")
-                    
-        context = "\n\n".join(relevant_sections)
+        Args:
+            doc_id (str): Document ID
+            chunks (list): Chunk texts, indexed by position
+        """
+        postings = {}
+        self.collect_postings(postings, doc_id, 0, chunks)
+        self.add_segment(doc_id, postings, len(chunks))
+    
+    @classmethod
+    def collect_postings(cls, postings, doc_id, first_idx, chunks):
+        """
+        Add the term postings of consecutive chunks of a document.
         
-        if len(context.split()) > max_tokens * 0.75:
-            context = "\n\n".join(context.split('\n\n')[:5])
-            
-        return context
+        Lets a document's segment be built batch by batch as its chunks
+        stream in, without keeping the chunk texts.
+        
+        Args:
+            postings (dict): Term -> postings list being built
+            doc_id (str): Document ID
+            first_idx (int): Index of the first chunk in the batch
+            chunks (list): Chunk texts
+        """
+        for chunk_idx, text in enumerate(chunks, start=first_idx):
+            counts = {}
+            for term in cls.tokenize(text):
+                counts[term] = counts.get(term, 0) + 1
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((doc_id, chunk_idx, tf))
     
-    def get_document_list(self):
-        """Get a list of all imported documents."""
-        return [
-            {
-                "doc_id": doc_id,
-                "name": doc_info["name"],
-                "type": doc_info.get("type", "unknown"),
-                "size": len(doc_info["content"])
+    def add_segment(self, doc_id, postings, chunk_count):
+        """
+        Add a document's collected postings as a new segment.
+        
+        Args:
+            doc_id (str): Document ID
+            postings (dict): Term -> postings from collect_postings
+            chunk_count (int): Number of chunks in the document
+        """
+        with self._lock:
+            segment = {
+                "seq": self._next_seq,
+                "postings": postings,
+                "doc_chunks": {doc_id: chunk_count}
             }
-            for doc_id, doc_info in self.documents.items()
-        ]
+            self._next_seq += 1
+            self.segments.append(segment)
+            self.total_chunks += chunk_count
+            self._live_chunks[doc_id] = self._live_chunks.get(doc_id, 0) + chunk_count
+        self._maybe_compact()
     
     def remove_document(self, doc_id):
-        """Remove a document by ID."""
-        if doc_id in self.documents:
-            del self.documents
-            if doc_id in self.document_embeddings:
-                del self.document_embeddings[doc_id]
-            return True
-        return False
-    
-    def _extract_text_from_pdf(self, file_path):
-        """Extract text from PDF files (placeholder)."""
-        return f"PDF text extraction placeholder for {file_path}"
+        """Tombstone every posting of a document currently in the index."""
+        with self._lock:
+            self.tombstones[doc_id] = self._next_seq - 1
+            self.dead_chunks += self._live_chunks.pop(doc_id, 0)
+        self._maybe_compact()
     
-    def _extract_text_from_docx(self, file_path):
-        """Extract text from Word documents (placeholder)."""
-        return f"DOCX text extraction placeholder for {file_path}"
-
-#########################
-# APPLICATION CONTROLLER
-#########################
-
-class LessonPlanController:
-    """Central controller to coordinate operations and provide an API for UI layers."""
-    def __init__(self, api_key=None):
-        """Initialize the controller with optional API key."""
-        self.config = ConfigManager(api_key)
-        self.research = ResearchModule(self.config)
-        self.generator = LessonPlanGenerator(self.config)
-        self.worksheet_generator = WorksheetGenerator(self.config)
-        self.document_manager = DocumentManager(self.config)
-        
-        self.model = "gpt-3.5-turbo"
-
-    # CRITICAL BUG: Missing add_feedback method called in app_streamlit.py
-    def add_feedback(self, content_id, feedback, content_type="lesson_plan"):
+    def search(self, terms, doc_ids=None):
         """
-        Store user feedback for a specific content.
+        Score live chunks containing any of the query terms.
         
         Args:
-            content_id (str): Unique ID for the content
-            feedback (str): User feedback text  
-            content_type (str): Type of content ("lesson_plan" or "worksheet")
+            terms (list): Query terms
+            doc_ids (set, optional): Restrict results to these documents
             
         Returns:
-            bool: True if feedback was stored successfully
+            dict: (doc_id, chunk_idx) -> TF-IDF score
         """
-        # In a full implementation this would store to a database
-        # For now we'll just log it
-        print(f"Feedback received for {content_type} {content_id}: {feedback[:50]}...")
-        return True
-
-    # CRITICAL BUG: _generate_pdf implementation doesn't match expected interface in app_streamlit.py
-    def _generate_pdf(self, content, filename="lesson_plan.pdf", save_to_desktop=False):
-        """Generate a PDF file from content."""
-        try:
-            # Determine the save location
-            if save_to_desktop:
-                desktop_path = os.path.join(os.path.expanduser("~"), "Desktop")
-                filename = os.path.join(desktop_path, filename)
-
-            # Create a canvas object for the PDF
-            c = canvas.Canvas(filename, pagesize=letter)
-            c.setTitle("Educational Content")
-
-            # Set font and starting position
-            c.setFont("Helvetica", 12)
-            width, height = letter
-            x_margin = 50
-            y_position = height - 50
-
-            # Add title
-            c.setFont("Helvetica-Bold", 16)
-            title_text = "Educational Content"
-            c.drawString(x_margin, y_position, title_text)
-            y_position -= 30
-
-            # Add content line by line with pagination
-            c.setFont("Helvetica", 12)
-            for line in content.split("\n"):
-                # Start a new page if we're near the bottom
-                if y_position < 50:
-                    c.showPage()
-                    c.setFont("Helvetica", 12)
-                    y_position = height - 50
-                    
-                # Handle long lines by wrapping - FIXED BUG: proper text wrapping
-                if len(line) > 100:
-                    chunks = [line[i:i+100] for i in range(0, len(line), 100)]
-                    for chunk in chunks:
-                        c.drawString(x_margin, y_position, chunk)
-                        y_position -= 15
+        with self._lock:
+            segments = list(self.segments)
+            tombstones = dict(self.tombstones)
+            live_chunks = max(1, self.total_chunks - self.dead_chunks)
+        
+        scores = {}
+        for term in set(terms):
+            matches = []
+            for segment in segments:
+                for doc_id, chunk_idx, tf in segment["postings"].get(term, ()):
+                    if self._is_dead(doc_id, segment["seq"], tombstones):
+                        continue
+                    matches.append((doc_id, chunk_idx, tf))
+            if not matches:
+                continue
+            
+            idf = math.log(1 + live_chunks / len(matches))
+            for doc_id, chunk_idx, tf in matches:
+                if doc_ids is not None and doc_id not in doc_ids:
+                    continue
+                key = (doc_id, chunk_idx)
+                scores[key] = scores.get(key, 0.0) + (1 + math.log(tf)) * idf
+        return scores
+    
+    def tombstone_ratio(self):
+        """Get the fraction of indexed chunks that belong to removed documents."""
+        with self._lock:
+            return self._tombstone_ratio()
+    
+    def _tombstone_ratio(self):
+        """tombstone_ratio for callers holding the lock."""
+        return self.dead_chunks / self.total_chunks if self.total_chunks else 0.0
+    
+    def compact(self):
+        """Merge all current segments into one, dropping tombstoned postings."""
+        with self._lock:
+            segments = list(self.segments)
+            tombstones = dict(self.tombstones)
+        
+        if not segments:
+            return
+        
+        postings = {}
+        doc_chunks = {}
+        dropped = 0
+        for segment in segments:
+            for doc_id, count in segment["doc_chunks"].items():
+                if self._is_dead(doc_id, segment["seq"], tombstones):
+                    dropped += count
                 else:
-                    c.drawString(x_margin, y_position, line)
-                    y_position -= 15
-
-            # Save the PDF
-            c.save()
-            return filename
-        except Exception as e:
-            print(f"Error generating PDF: {str(e)}")
-            return f"Error generating PDF: {str(e)}"
-
-    def set_api_key(self, api_key):
-        """Set or update the API key."""
-        return self.config.set_api_key(api_key)
-
-    def validate_api_key(self):
-        """Check if API key is valid and configured."""
-        return self.config.check_api_key()
-
-    def get_research_data(self, grade, curriculum):
-        """Get research data for a specific grade and curriculum."""
+                    doc_chunks[doc_id] = doc_chunks.get(doc_id, 0) + count
+            for term, entries in segment["postings"].items():
+                live = [entry for entry in entries if not self._is_dead(entry[0], segment["seq"], tombstones)]
+                if live:
+                    postings.setdefault(term, []).extend(live)
+        
+        merged = {
+            "seq": segments[-1]["seq"],
+            "postings": postings,
+            "doc_chunks": doc_chunks
+        }
+        
+        with self._lock:
+            # Segments appended while merging are kept after the merged one
+            self.segments = [merged] + self.segments[len(segments):]
+            self.total_chunks -= dropped
+            self.dead_chunks -= dropped
+            for doc_id, seq in tombstones.items():
+                if self.tombstones.get(doc_id) == seq:
+                    del self.tombstones[doc_id]
+    
+    def _maybe_compact(self):
+        """Start a compaction if tombstones or segment count passed their limits."""
+        with self._lock:
+            if self._compacting:
+                return
+            if len(self.segments) <= self.max_segments and self._tombstone_ratio() <= self.compaction_threshold:
+                return
+            self._compacting = True
+        
+        if self.background:
+            threading.Thread(target=self._run_compaction, daemon=True).start()
+        else:
+            self._run_compaction()
+    
+    def _run_compaction(self):
+        """Run a compaction and clear the in-progress flag."""
         try:
-            return self.research.conduct_research(grade, curriculum, model=self.model)
+            self.compact()
         except Exception as e:
-            return {"error": str(e)}
-
-    def get_topics_list(self, research_data):
-        """Extract topics list from research data."""
-        if "error" in research_data:
-            return []
-        topics = []
-        for idx, topic in enumerate(research_data.get("topics", [])):
-            topics.append({
-                "id": idx,
-                "title": topic.get("title", ""),
-                "description": topic.get("description", "")
-            })
-        return topics
-
-    def get_learning_outcome(self, research_data, topic_id):
-        """Get the learning outcome for a specific topic."""
-        if "error" in research_data or not research_data.get("topics"):
-            return {"error": "Invalid research data"}
-        if topic_id < 0 or topic_id >= len(research_data["topics"]):
-            return {"error": "Invalid topic ID"}
-        return research_data["topics"][topic_id]
+            print(f"Warning: Index compaction failed: {e}")
+        finally:
+            with self._lock:
+                self._compacting = False
+    
+    @staticmethod
+    def _is_dead(doc_id, seq, tombstones):
+        """Check whether a posting from segment `seq` was deleted."""
+        return doc_id in tombstones and seq <= tombstones[doc_id]
 
-    def create_topic_context(self, topic_data):
-        """Create a context string from topic data."""
-        if "error" in topic_data:
-            return ""
-        context = f"""
-        KEY CONCEPTS:
-        {', '.join(topic_data.get('context', {}).get('key_concepts', []))}
-        
-        COMMON MISCONCEPTIONS:
-        {', '.join(topic_data.get('context', {}).get('misconceptions', []))}
+class ContextPacker:
+    """
+    Packs ranked retrieval chunks into a prompt context within a token budget.
+    
+    Chunks are taken in score order, duplicates and chunks overlapping an
+    already selected range are skipped, and each chunk is prefixed with a
+    source header. Token counts use tiktoken when it is installed and a
+    words-per-token estimate otherwise. Chunks may be given by offsets with
+    a text loader instead of text: they are costed from their length until
+    they might fit, so text is only fetched for chunks that can be selected.
+    """
+    
+    WORDS_PER_TOKEN = 0.75
+    CHARS_PER_TOKEN = 4  # Estimate for chunks whose text isn't loaded yet
+    MIN_TRUNCATED_TOKENS = 50  # Smallest leftover budget worth filling with a partial chunk
+    
+    def __init__(self, encoding_name="cl100k_base"):
+        """
+        Initialize the packer.
         
-        PREREQUISITES:
-        {', '.join(topic_data.get('context', {}).get('prerequisites', []))}
+        Args:
+            encoding_name (str): tiktoken encoding used when tiktoken is available
+        """
+        self.encoding = None
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.get_encoding(encoding_name)
+            except Exception:
+                self.encoding = None
+    
+    def count_tokens(self, text):
+        """Count (or estimate) the number of tokens in text."""
+        if self.encoding is not None:
+            return len(self.encoding.encode(text))
+        return math.ceil(len(text.split()) / self.WORDS_PER_TOKEN)
+    
+    def pack(self, chunks, max_tokens):
+        """
+        Select and format chunks to fill a token budget.
         
-        TEACHING EXAMPLES:
-        {', '.join(topic_data.get('context', {}).get('examples', []))}
+        Args:
+            chunks (list): Dicts with "score" and "source" keys, plus optional
+                "doc_id", "start" and "end" offsets for overlap checks. The
+                text is either given as "text", or fetched on demand by a
+                "load_text" callable for chunks with offsets
+            max_tokens (int): Token budget for the packed context
+            
+        Returns:
+            str: Packed context with a source header before each chunk
         """
-        return context
-
-    def generate_lesson_plan(self, learning_outcome, grade, curriculum, duration, topic_context):
-        """Generate a lesson plan with the specified parameters."""
-        if not self.validate_api_key():
-            return "Error: API key is missing or invalid"
-        try:
-            lesson_plan = self.generator.generate_plan(
-                learning_outcome, grade, curriculum, duration, topic_context, model=self.model
-            )
-            return lesson_plan
-        except Exception as e:
-            return f"Error generating lesson plan: {str(e)}"
+        separator_tokens = self.count_tokens("\n\n")
+        remaining = max_tokens
+        selected = []
+        seen_texts = set()
+        selected_ranges = {}  # Doc ID -> list of (start, end) already selected
+        
+        for chunk in sorted(chunks, key=lambda c: c["score"], reverse=True):
+            if self._overlaps(chunk, selected_ranges):
+                continue
+            header = f"From {chunk['source']}:\n"
+            
+            text = chunk.get("text")
+            if text is None:
+                # Too big by estimate and no room left for a truncated chunk
+                estimate = (chunk["end"] - chunk["start"]) / self.CHARS_PER_TOKEN
+                header_tokens = self.count_tokens(header)
+                if estimate + header_tokens > remaining and remaining - header_tokens < self.MIN_TRUNCATED_TOKENS:
+                    continue
+                text = chunk["load_text"]() or ""
+            text = text.strip()
+            normalized = " ".join(text.lower().split())
+            if not normalized or normalized in seen_texts:
+                continue
+            
+            cost = self.count_tokens(header + text) + (separator_tokens if selected else 0)
+            if cost > remaining:
+                if remaining - self.count_tokens(header) < self.MIN_TRUNCATED_TOKENS:
+                    continue
+                text = self._truncate(text, remaining - self.count_tokens(header) - separator_tokens)
+                if not text:
+                    continue
+                cost = self.count_tokens(header + text) + (separator_tokens if selected else 0)
+                if cost > remaining:
+                    continue
+            
+            selected.append(header + text)
+            seen_texts.add(normalized)
+            if "doc_id" in chunk and "start" in chunk:
+                selected_ranges.setdefault(chunk["doc_id"], []).append((chunk["start"], chunk["end"]))
+            remaining -= cost
+            if remaining <= 0:
+                break
+        
+        return "\n\n".join(selected)
+    
+    def _overlaps(self, chunk, selected_ranges):
+        """Check whether most of a chunk is already covered by selected chunks."""
+        if "doc_id" not in chunk or "start" not in chunk:
+            return False
+        start, end = chunk["start"], chunk["end"]
+        length = max(1, end - start)
+        for other_start, other_end in selected_ranges.get(chunk["doc_id"], ()):
+            covered = min(end, other_end) - max(start, other_start)
+            if covered > length / 2:
+                return True
+        return False
+    
+    def _truncate(self, text, max_tokens):
+        """Cut text at a word boundary so it fits within max_tokens."""
+        words = text.split()
+        low, high = 0, len(words)
+        while low < high:
+            mid = (low + high + 1) // 2
+            if self.count_tokens(" ".join(words[:mid]) + " ...") <= max_tokens:
+                low = mid
+            else:
+                high = mid - 1
+        return " ".join(words[:low]) + " ..." if low else ""
 
-    def generate_worksheet(self, learning_outcome, topic_context, lesson_plan, difficulty="mixed"):
-        """Generate a worksheet based on a lesson plan."""
-        if not self.validate_api_key():
+class QueryCache:
+    """
+    Bounded LRU cache for retrieval results.
+    
+    Each entry records the index generation it was computed at; a lookup made
+    at a newer generation treats the entry as stale and drops it. The cache is
+    bounded both by entry count and by the total size of cached results.
+    """
+    
+    def __init__(self, max_entries=256, max_bytes=8 * 1024 * 1024):
+        """
+        Initialize an empty cache.
+        
+        Args:
+            max_entries (int): Maximum number of cached results
+            max_bytes (int): Maximum total size of cached results in characters
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # Key -> (generation, value)
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+    
+    def get(self, key, generation):
+        """
+        Look up a cached result.
+        
+        Args:
+            key (tuple): Cache key
+            generation (int): Current index generation
+            
+        Returns:
+            str or None: Cached value, or None on a miss
+        """
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != generation:
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+    
+    def put(self, key, generation, value):
+        """Store a result computed at the given index generation."""
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = (generation, value)
+            self.current_bytes += size
+            while len(self.entries) > self.max_entries or self.current_bytes > self.max_bytes:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+    
+    def clear(self):
+        """Remove all cached results."""
+        with self._lock:
+            self.entries.clear()
+            self.current_bytes = 0
+    
+    def get_stats(self):
+        """Get hit, miss and size statistics for the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.current_bytes
+            }
+    
+    def _drop(self, key):
+        """Remove an entry and release its size. Caller must hold the lock."""
+        _, value = self.entries.pop(key)
+        self.current_bytes -= len(value)
+
+class FacetIndex:
+    """
+    Posting bitmaps for document metadata facets.
+    
+    Each document gets a small integer ordinal, and every (facet, value) pair
+    keeps a Python int used as a bitmap of the ordinals that carry it.
+    Filtering ORs the bitmaps of the requested values within a facet and ANDs
+    the results across facets. A facet may hold a list of values, as it does
+    once later uploads of the same document have added their own.
+    """
+    
+    FACETS = ("category", "grade", "curriculum", "topic")
+    
+    def __init__(self):
+        """Initialize an empty facet index."""
+        self.bitmaps = {}  # (facet, value) -> bitmap of document ordinals
+        self.ordinals = {}  # Doc ID -> ordinal
+        self.doc_ids = []  # Ordinal -> doc ID (None for free slots)
+        self.free_ordinals = []
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def normalize(value):
+        """Normalize a facet value for matching."""
+        return " ".join(str(value).lower().split())
+    
+    @classmethod
+    def values(cls, metadata, facet):
+        """Get the normalized, distinct non-empty values of a facet, in order."""
+        value = metadata.get(facet)
+        values = value if isinstance(value, list) else [value]
+        normalized = []
+        for value in values:
+            if value not in (None, "") and cls.normalize(value) not in normalized:
+                normalized.append(cls.normalize(value))
+        return normalized
+    
+    @classmethod
+    def merge_metadata(cls, metadata, extra):
+        """
+        Combine a document's metadata with metadata from a later upload.
+        
+        Keys the document lacks are copied over. A facet given a value the
+        document doesn't have yet becomes a list of every value, so the
+        document matches a filter on any of them.
+        
+        Args:
+            metadata (dict): The document's current metadata
+            extra (dict): Metadata supplied with the later upload
+            
+        Returns:
+            tuple: (merged metadata, list of (facet, normalized value) pairs added)
+        """
+        merged = dict(metadata)
+        added = []
+        for key, value in extra.items():
+            if value in (None, ""):
+                continue
+            if key not in cls.FACETS:
+                merged.setdefault(key, value)
+                continue
+            current = merged.get(key)
+            current = [] if current in (None, "") else current if isinstance(current, list) else [current]
+            known = {cls.normalize(v) for v in current}
+            additions = []
+            for v in value if isinstance(value, list) else [value]:
+                if v not in (None, "") and cls.normalize(v) not in known:
+                    known.add(cls.normalize(v))
+                    additions.append(v)
+                    added.append((key, cls.normalize(v)))
+            if additions:
+                values = current + additions
+                merged[key] = values[0] if len(values) == 1 else values
+        return merged, added
+    
+    def add_document(self, doc_id, metadata):
+        """
+        Record a document's facet values.
+        
+        Args:
+            doc_id (str): Document ID
+            metadata (dict): Facet name -> value; empty values are ignored
+        """
+        with self._lock:
+            if doc_id in self.ordinals:
+                return
+            ordinal = self.free_ordinals.pop() if self.free_ordinals else len(self.doc_ids)
+            if ordinal == len(self.doc_ids):
+                self.doc_ids.append(doc_id)
+            else:
+                self.doc_ids[ordinal] = doc_id
+            self.ordinals[doc_id] = ordinal
+            
+            bit = 1 << ordinal
+            for facet in self.FACETS:
+                for value in self.values(metadata, facet):
+                    self.bitmaps[(facet, value)] = self.bitmaps.get((facet, value), 0) | bit
+    
+    def add_values(self, doc_id, values):
+        """
+        Add facet values to an indexed document.
+        
+        Args:
+            doc_id (str): Document ID
+            values (list): (facet, normalized value) pairs
+        """
+        with self._lock:
+            ordinal = self.ordinals.get(doc_id)
+            if ordinal is None:
+                return
+            for key in values:
+                self.bitmaps[key] = self.bitmaps.get(key, 0) | (1 << ordinal)
+    
+    def remove_document(self, doc_id):
+        """Clear a document from every facet bitmap."""
+        with self._lock:
+            ordinal = self.ordinals.pop(doc_id, None)
+            if ordinal is None:
+                return
+            mask = ~(1 << ordinal)
+            for key in list(self.bitmaps):
+                self.bitmaps[key] &= mask
+                if not self.bitmaps[key]:
+                    del self.bitmaps[key]
+            self.doc_ids[ordinal] = None
+            self.free_ordinals.append(ordinal)
+    
+    def filter(self, filters):
+        """
+        Find documents matching all facet filters.
+        
+        Args:
+            filters (dict): Facet name -> value or list of accepted values
+            
+        Returns:
+            set: Matching document IDs
+        """
+        with self._lock:
+            result = None
+            for facet, values in filters.items():
+                if values in (None, ""):
+                    continue
+                if isinstance(values, (str, int)):
+                    values = [values]
+                facet_bitmap = 0
+                for value in values:
+                    facet_bitmap |= self.bitmaps.get((facet, self.normalize(value)), 0)
+                result = facet_bitmap if result is None else result & facet_bitmap
+            
+            if result is None:
+                return set(self.ordinals)
+            
+            matches = set()
+            while result:
+                low_bit = result & -result
+                matches.add(self.doc_ids[low_bit.bit_length() - 1])
+                result ^= low_bit
+            return matches
+
+class NearDuplicateIndex:
+    """
+    Clusters near-duplicate chunks with MinHash signatures and LSH banding.
+    
+    Each chunk gets a MinHash signature over its word shingles, built with
+    one-permutation hashing (every shingle is hashed once into one of
+    num_perm bins) and rotation densification for empty bins. Signatures are
+    split into bands whose row count is chosen so the LSH collision curve
+    rises near the similarity threshold; chunks sharing a band are compared
+    and joined to the first cluster whose representative is similar enough.
+    """
+    
+    HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+    HASH_MASK = (1 << 64) - 1
+    
+    def __init__(self, threshold=0.8, num_perm=64, shingle_size=3):
+        """
+        Initialize an empty index.
+        
+        Args:
+            threshold (float): Estimated Jaccard similarity above which
+                chunks count as near-duplicates
+            num_perm (int): Signature length
+            shingle_size (int): Words per shingle
+        """
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = self._choose_bands(num_perm, threshold)
+        self.buckets = {}  # (band, band hash) -> representative keys
+        self.signatures = {}  # (doc_id, chunk_idx) -> signature
+        self.lengths = {}  # (doc_id, chunk_idx) -> chunk length in characters
+        self.representative = {}  # (doc_id, chunk_idx) -> cluster representative
+        self.members = {}  # Representative -> keys in its cluster
+        self.doc_keys = {}  # Doc ID -> keys of its chunks
+        self._lock = threading.Lock()
+    
+    def signature(self, text):
+        """
+        Compute the MinHash signature of a text.
+        
+        Returns:
+            tuple or None: Signature, or None for text without words
+        """
+        words = text.lower().split()
+        if not words:
+            return None
+        
+        bins = [None] * self.num_perm
+        for i in range(max(1, len(words) - self.shingle_size + 1)):
+            shingle = " ".join(words[i:i + self.shingle_size]).encode("utf-8")
+            value = (zlib.crc32(shingle) * self.HASH_MULTIPLIER) & self.HASH_MASK
+            bin_idx = value % self.num_perm
+            value //= self.num_perm
+            if bins[bin_idx] is None or value < bins[bin_idx]:
+                bins[bin_idx] = value
+        
+        # Fill empty bins from the next non-empty bin, offset by the distance
+        # so the filled values don't collide with real ones
+        for i in range(self.num_perm):
+            if bins[i] is not None:
+                continue
+            distance = 1
+            while bins[(i + distance) % self.num_perm] is None:
+                distance += 1
+            bins[i] = bins[(i + distance) % self.num_perm] + (distance << 58)
+        return tuple(bins)
+    
+    def add_document(self, doc_id, chunks):
+        """
+        Add a document's chunks, clustering them with existing chunks.
+        
+        Args:
+            doc_id (str): Document ID
+            chunks (list): Chunk texts in order
+            
+        Returns:
+            int: Number of chunks that joined an existing cluster
+        """
+        signed = []
+        for chunk_idx, text in enumerate(chunks):
+            signature = self.signature(text)
+            if signature is not None:
+                signed.append((chunk_idx, signature, len(text)))
+        return self.add_signatures(doc_id, signed)
+    
+    def add_signatures(self, doc_id, signed):
+        """
+        Add a document's chunks by precomputed signature.
+        
+        Lets signatures be computed batch by batch while a document streams
+        in, without keeping the chunk texts.
+        
+        Args:
+            doc_id (str): Document ID
+            signed (list): (chunk_idx, signature, length in characters)
+                for each chunk with words
+            
+        Returns:
+            int: Number of chunks that joined an existing cluster
+        """
+        duplicates = 0
+        with self._lock:
+            if doc_id in self.doc_keys:
+                return 0
+            keys = []
+            for chunk_idx, signature, length in signed:
+                key = (doc_id, chunk_idx)
+                keys.append(key)
+                self.signatures[key] = signature
+                self.lengths[key] = length
+                
+                match = self._find_match(signature)
+                if match is None:
+                    self.representative[key] = key
+                    self.members[key] = {key}
+                    self._add_to_buckets(key, signature)
+                else:
+                    self.representative[key] = match
+                    self.members[match].add(key)
+                    duplicates += 1
+            self.doc_keys[doc_id] = keys
+        return duplicates
+    
+    def remove_document(self, doc_id):
+        """Remove a document's chunks, promoting new representatives as needed."""
+        with self._lock:
+            for key in self.doc_keys.pop(doc_id, ()):
+                representative = self.representative.pop(key)
+                del self.lengths[key]
+                signature = self.signatures.pop(key)
+                if representative != key:
+                    self.members[representative].discard(key)
+                    continue
+                
+                self._remove_from_buckets(key, signature)
+                remaining = self.members.pop(key)
+                remaining.discard(key)
+                if remaining:
+                    new_representative = min(remaining)
+                    self.members[new_representative] = remaining
+                    for member in remaining:
+                        self.representative[member] = new_representative
+                    self._add_to_buckets(new_representative, self.signatures[new_representative])
+    
+    def representative_of(self, key):
+        """Get the representative of a chunk's cluster (the chunk itself if unique)."""
+        return self.representative.get(key, key)
+    
+    def get_stats(self):
+        """
+        Get clustering statistics.
+        
+        Returns:
+            dict: Chunk and cluster counts, and how many chunks and characters
+                are near-duplicates of a cluster representative
+        """
+        with self._lock:
+            duplicate_keys = [key for key, rep in self.representative.items() if key != rep]
+            total_chars = sum(self.lengths.values())
+            duplicate_chars = sum(self.lengths[key] for key in duplicate_keys)
+            return {
+                "chunks": len(self.representative),
+                "clusters": len(self.members),
+                "duplicate_chunks": len(duplicate_keys),
+                "duplicate_chars": duplicate_chars,
+                "duplicate_fraction": duplicate_chars / total_chars if total_chars else 0.0,
+                "bands": self.bands,
+                "rows": self.rows
+            }
+    
+    def _find_match(self, signature):
+        """Find the most similar representative at or above the threshold."""
+        candidates = set()
+        for band_key in self._band_keys(signature):
+            candidates.update(self.buckets.get(band_key, ()))
+        
+        best, best_similarity = None, self.threshold
+        for candidate in candidates:
+            other = self.signatures[candidate]
+            similarity = sum(a == b for a, b in zip(signature, other)) / self.num_perm
+            if similarity >= best_similarity:
+                best, best_similarity = candidate, similarity
+        return best
+    
+    def _band_keys(self, signature):
+        """Yield the bucket key for each band of a signature."""
+        for band in range(self.bands):
+            yield band, hash(signature[band * self.rows:(band + 1) * self.rows])
+    
+    def _add_to_buckets(self, key, signature):
+        for band_key in self._band_keys(signature):
+            self.buckets.setdefault(band_key, set()).add(key)
+    
+    def _remove_from_buckets(self, key, signature):
+        for band_key in self._band_keys(signature):
+            bucket = self.buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self.buckets[band_key]
+    
+    @staticmethod
+    def _choose_bands(num_perm, threshold):
+        """
+        Pick (bands, rows) whose LSH threshold (1/bands)^(1/rows) is closest
+        to the similarity threshold.
+        """
+        options = [(num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm % rows == 0]
+        return min(options, key=lambda option: abs((1 / option[0]) ** (1 / option[1]) - threshold))
+
+class HashingEmbedder:
+    """
+    Local dense embedder based on feature hashing.
+    
+    Words and adjacent word pairs are hashed into a fixed number of signed
+    dimensions and the vector is L2-normalized. It needs no API access, so it
+    is the default embedder when no other is configured.
+    """
+    
+    def __init__(self, dimensions=256):
+        """
+        Initialize the embedder.
+        
+        Args:
+            dimensions (int): Length of the embedding vectors
+        """
+        self.dimensions = dimensions
+        self.embedder_id = f"hashing-{dimensions}"
+    
+    def embed(self, texts):
+        """
+        Embed a batch of texts.
+        
+        Args:
+            texts (list): Texts to embed
+            
+        Returns:
+            list: One array('f') vector per text
+        """
+        return [self._embed_one(text) for text in texts]
+    
+    def _embed_one(self, text):
+        """Embed a single text."""
+        vector = array('f', bytes(4 * self.dimensions))
+        words = SegmentedIndex.tokenize(text)
+        features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        for feature in features:
+            h = zlib.crc32(feature.encode("utf-8"))
+            vector[h % self.dimensions] += 1.0 if h & 0x80000000 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector))
+        if norm:
+            for i in range(self.dimensions):
+                vector[i] /= norm
+        return vector
+
+class OpenAIEmbedder:
+    """Dense embedder backed by the OpenAI embeddings API."""
+    
+    def __init__(self, config_manager, model="text-embedding-3-small", batch_size=256):
+        """
+        Initialize with configuration.
+        
+        Args:
+            config_manager: ConfigManager instance for API access
+            model (str): OpenAI embedding model
+            batch_size (int): Texts sent per API request
+        """
+        self.config = config_manager
+        self.model = model
+        self.batch_size = batch_size
+        self.embedder_id = f"openai-{model}"
+    
+    def embed(self, texts):
+        """
+        Embed a batch of texts.
+        
+        Args:
+            texts (list): Texts to embed
+            
+        Returns:
+            list: One array('f') vector per text
+        """
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = [text or " " for text in texts[start:start + self.batch_size]]
+            response = self.config.client.embeddings.create(model=self.model, input=batch)
+            vectors.extend(array('f', item.embedding) for item in response.data)
+        return vectors
+
+class EmbeddingCache:
+    """
+    Persistent cache of chunk embeddings keyed by (embedder ID, chunk hash).
+    
+    Vectors are appended to a single binary file as fixed-layout records: a
+    16-byte key (a BLAKE2b digest of the embedder ID and the chunk's SHA-256),
+    the vector length as a uint32, then the float32 values. An in-memory
+    index maps keys to file offsets in least-recently-used order; when the
+    file outgrows max_bytes it is rewritten keeping only the most recently
+    used vectors. Decoded vectors for hot keys stay in a small memory LRU.
+    
+    Several processes can share a file. Scanning, appending and compaction
+    hold an exclusive flock on a sidecar "<path>.lock" file (locking is
+    skipped where fcntl is unavailable), and before touching the file a
+    process reopens it if another process compacted it into a new inode,
+    then indexes records appended since its last scan. refresh() does the
+    same on demand, and warm_up() lets a new worker preload the hottest
+    vectors.
+    """
+    
+    RECORD_HEADER = struct.Struct("<16sI")
+    COMPACT_TO = 0.75  # Fraction of max_bytes kept after eviction
+    
+    def __init__(self, path=None, max_bytes=256 * 1024 * 1024, memory_vectors=4096):
+        """
+        Open or create a cache file.
+        
+        Args:
+            path (str, optional): Cache file path; defaults to
+                embeddings.cache in the application data directory
+            max_bytes (int): File size above which least recently used
+                vectors are evicted
+            memory_vectors (int): Decoded vectors kept in memory
+        """
+        self.path = path or app_data_path("embeddings.cache")
+        self.max_bytes = max_bytes
+        self.memory_vectors = memory_vectors
+        self.index = OrderedDict()  # Key -> (offset, dimensions), least recently used first
+        self._memory = OrderedDict()  # Key -> decoded vector
+        self._lock = threading.RLock()
+        self._lock_file = open(f"{self.path}.lock", "a+b")
+        self._file = None
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        with self._lock:
+            self._acquire_file_lock()
+            try:
+                self._open()
+            finally:
+                self._release_file_lock()
+    
+    @staticmethod
+    def key(embedder_id, text):
+        """Build the cache key for a chunk embedded by an embedder."""
+        chunk_hash = hashlib.sha256(text.encode("utf-8")).digest()
+        return hashlib.blake2b(embedder_id.encode("utf-8") + b"\0" + chunk_hash, digest_size=16).digest()
+    
+    def embed(self, embedder, texts):
+        """
+        Embed texts, computing only those not already cached.
+        
+        Missing texts are deduplicated and sent to the embedder in one call,
+        which splits them into its own request batches.
+        
+        Args:
+            embedder: Embedder with `embedder_id` and `embed(texts)`
+            texts (list): Texts to embed
+            
+        Returns:
+            list: One array('f') vector per text
+        """
+        keys = [self.key(embedder.embedder_id, text) for text in texts]
+        vectors = self.get_many(keys)
+        
+        missing = {}  # Key -> text, in first-seen order
+        for key, text, vector in zip(keys, texts, vectors):
+            if vector is None:
+                missing.setdefault(key, text)
+        if missing:
+            computed = dict(zip(missing, embedder.embed(list(missing.values()))))
+            self.put_many(computed.items())
+            vectors = [vector if vector is not None else computed[key] for key, vector in zip(keys, vectors)]
+        return vectors
+    
+    def get_many(self, keys):
+        """
+        Look up cached vectors.
+        
+        Returns:
+            list: array('f') vector, or None if not cached, for each key
+        """
+        vectors = []
+        with self._lock:
+            if any(key not in self.index for key in keys):
+                # Other processes may have stored them since the last scan
+                self._acquire_file_lock()
+                try:
+                    self._sync()
+                finally:
+                    self._release_file_lock()
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    self.index.move_to_end(key)
+                elif key in self.index:
+                    vector = self._read(key)
+                if vector is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                vectors.append(vector)
+        return vectors
+    
+    def put_many(self, items):
+        """
+        Store vectors, appending them to the cache file in one write.
+        
+        Args:
+            items: (key, vector) pairs
+        """
+        with self._lock:
+            self._acquire_file_lock()
+            try:
+                # Append to the current file, after anything other processes wrote
+                self._sync()
+                records = []
+                offset = self._size
+                for key, vector in items:
+                    if key in self.index:
+                        continue
+                    vector = array('f', vector)
+                    records.append(self.RECORD_HEADER.pack(key, len(vector)))
+                    records.append(vector.tobytes())
+                    self.index[key] = (offset, len(vector))
+                    self._remember(key, vector)
+                    offset += self.RECORD_HEADER.size + 4 * len(vector)
+                if not records:
+                    return
+                self._file.write(b"".join(records))
+                self._file.flush()
+                self._size = offset
+                if self._size > self.max_bytes:
+                    self._compact()
+            finally:
+                self._release_file_lock()
+    
+    def refresh(self):
+        """Pick up records other processes appended or compacted since the last scan."""
+        with self._lock:
+            self._acquire_file_lock()
+            try:
+                self._sync()
+            finally:
+                self._release_file_lock()
+    
+    def warm_up(self, max_vectors=None):
+        """
+        Load the most recently used vectors into memory.
+        
+        Intended for new worker processes, so their first imports hit memory
+        rather than the file.
+        
+        Args:
+            max_vectors (int, optional): Vectors to load; defaults to the
+                memory LRU size
+            
+        Returns:
+            int: Number of vectors loaded
+        """
+        self.refresh()
+        with self._lock:
+            count = min(max_vectors or self.memory_vectors, self.memory_vectors, len(self.index))
+            hottest = list(self.index)[len(self.index) - count:]
+            for key in hottest:
+                if key not in self._memory:
+                    self._remember(key, self._read(key, touch=False))
+            return count
+    
+    def get_stats(self):
+        """Get hit rate, size and eviction statistics."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.index),
+                "file_bytes": self._size,
+                "memory_vectors": len(self._memory),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions
+            }
+    
+    def close(self):
+        """Close the cache file."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+    
+    def _acquire_file_lock(self):
+        """Take the cross-process lock; call with self._lock held."""
+        if fcntl is not None:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+    
+    def _release_file_lock(self):
+        """Release the cross-process lock."""
+        if fcntl is not None:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+    
+    def _sync(self):
+        """
+        Catch up with other processes; call with the file lock held.
+        
+        Reopens the file if it was replaced by a compaction, otherwise
+        indexes records appended after the last scan.
+        """
+        try:
+            replaced = os.stat(self.path).st_ino != os.fstat(self._file.fileno()).st_ino
+        except OSError:
+            replaced = True
+        if replaced:
+            # Offsets are stale, but decoded vectors are still valid for their keys
+            self._file.close()
+            self.index.clear()
+            self._open()
+            for key in [key for key in self._memory if key not in self.index]:
+                del self._memory[key]
+        else:
+            self._scan(self._size)
+    
+    def _open(self):
+        """Open the cache file and index its records; call with the file lock held."""
+        self._file = open(self.path, "a+b")
+        self._size = 0
+        self._scan(0)
+        # Drop a record left half-written by a crash so appends line up
+        self._file.seek(0, os.SEEK_END)
+        if self._file.tell() != self._size:
+            self._file.truncate(self._size)
+    
+    def _scan(self, offset):
+        """Index records from an offset, stopping at a truncated tail."""
+        self._file.seek(0, os.SEEK_END)
+        end = self._file.tell()
+        header_size = self.RECORD_HEADER.size
+        while offset + header_size <= end:
+            self._file.seek(offset)
+            key, dimensions = self.RECORD_HEADER.unpack(self._file.read(header_size))
+            if offset + header_size + 4 * dimensions > end:
+                break
+            self.index[key] = (offset, dimensions)
+            self.index.move_to_end(key)
+            offset += header_size + 4 * dimensions
+        self._size = offset
+    
+    def _read(self, key, touch=True):
+        """Read and decode one vector from the file."""
+        offset, dimensions = self.index[key]
+        self._file.seek(offset + self.RECORD_HEADER.size)
+        vector = array('f')
+        vector.frombytes(self._file.read(4 * dimensions))
+        if touch:
+            self.index.move_to_end(key)
+            self._remember(key, vector)
+        return vector
+    
+    def _remember(self, key, vector):
+        """Keep a decoded vector in the memory LRU."""
+        if self.memory_vectors <= 0:
+            return
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_vectors:
+            self._memory.popitem(last=False)
+    
+    def _compact(self):
+        """Rewrite the file with only the most recently used vectors; call with the file lock held."""
+        budget = int(self.max_bytes * self.COMPACT_TO)
+        kept = []
+        total = 0
+        for key in reversed(self.index):
+            record_size = self.RECORD_HEADER.size + 4 * self.index[key][1]
+            if total + record_size > budget:
+                break
+            kept.append(key)
+            total += record_size
+        kept.reverse()
+        
+        directory, name = os.path.split(self.path)
+        fd, temp_path = tempfile.mkstemp(prefix=f"{name}.", suffix=".tmp", dir=directory or ".")
+        new_index = OrderedDict()
+        offset = 0
+        try:
+            with os.fdopen(fd, "wb") as out:
+                for key in kept:
+                    vector = self._read(key, touch=False)
+                    out.write(self.RECORD_HEADER.pack(key, len(vector)))
+                    out.write(vector.tobytes())
+                    new_index[key] = (offset, len(vector))
+                    offset += self.RECORD_HEADER.size + 4 * len(vector)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        
+        self.evictions += len(self.index) - len(kept)
+        self._file.close()
+        os.replace(temp_path, self.path)
+        self._file = open(self.path, "a+b")
+        self._size = offset
+        self.index = new_index
+        for key in [key for key in self._memory if key not in new_index]:
+            del self._memory[key]
+
+class ChunkingEngine:
+    """
+    Splits documents into retrieval chunks.
+    
+    Chunks are produced as a document's paragraphs stream in, each as its
+    start and end offsets in the document text (the paragraphs joined by
+    blank lines) plus its text. Only the paragraphs an unfinished chunk
+    can still use are kept, so chunking never needs the whole document.
+    Three strategies are available:
+    
+    - "paragraph": one chunk per paragraph
+    - "token_window": fixed windows of chunk_tokens tokens that overlap by
+      overlap_tokens, ignoring document structure
+    - "structure": paragraphs are grouped up to chunk_tokens; a heading always
+      starts a new chunk together with the content under it, list items stay
+      with their neighbours, and paragraphs longer than chunk_tokens are split
+      into windows. Consecutive chunks within a section share up to
+      overlap_tokens worth of trailing paragraphs.
+    
+    Token counts are estimated from word counts.
+    """
+    
+    STRATEGIES = ("paragraph", "token_window", "structure")
+    WORDS_PER_TOKEN = 0.75
+    
+    HEADING_PATTERN = re.compile(r"^(#{1,6}\s+\S.*|\d+(\.\d+)*\.?\s+[A-Z].{0,80}|[A-Z][A-Z0-9 ,:&'-]{2,80})$")
+    LIST_PATTERN = re.compile(r"^\s*([-*•]|\d+[.)]|[a-z][.)])\s+")
+    
+    def __init__(self, strategy="structure", chunk_tokens=200, overlap_tokens=40):
+        """
+        Initialize the chunking engine.
+        
+        Args:
+            strategy (str): One of STRATEGIES
+            chunk_tokens (int): Target maximum chunk size in tokens
+            overlap_tokens (int): Tokens shared between consecutive chunks
+        """
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown chunking strategy: {strategy}")
+        if overlap_tokens >= chunk_tokens:
+            raise ValueError("overlap_tokens must be smaller than chunk_tokens")
+        self.strategy = strategy
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+    
+    def iter_chunks(self, paragraphs):
+        """
+        Yield a document's chunks as its paragraphs stream in.
+        
+        Args:
+            paragraphs: Iterable of document paragraphs, consumed lazily
+        
+        Yields:
+            tuple: (start, end, text) of each chunk, in document order
+        """
+        positioned = self._positions(paragraphs)
+        if self.strategy == "paragraph":
+            for start, paragraph in positioned:
+                yield start, start + len(paragraph), paragraph
+        elif self.strategy == "token_window":
+            yield from self._window_chunks(positioned)
+        else:
+            yield from self._structure_chunks(positioned)
+    
+    def chunk(self, paragraphs):
+        """
+        Compute chunk boundaries for a document.
+        
+        Args:
+            paragraphs: Iterable of document paragraphs
+        
+        Returns:
+            tuple: (starts, ends) arrays of chunk offsets
+        """
+        starts = array('I')
+        ends = array('I')
+        for start, end, _ in self.iter_chunks(paragraphs):
+            starts.append(start)
+            ends.append(end)
+        return starts, ends
+    
+    def count_tokens(self, text):
+        """Estimate the number of tokens in text."""
+        return math.ceil(len(text.split()) / self.WORDS_PER_TOKEN)
+    
+    def is_heading(self, paragraph):
+        """Check whether a paragraph looks like a heading."""
+        stripped = paragraph.strip()
+        return (
+            bool(stripped)
+            and "\n" not in stripped
+            and len(stripped) <= 100
+            and not stripped.endswith(('.', ',', ';', '?', '!'))
+            and bool(self.HEADING_PATTERN.match(stripped))
+        )
+    
+    def is_list(self, paragraph):
+        """Check whether a paragraph starts with a list item marker."""
+        return bool(self.LIST_PATTERN.match(paragraph))
+    
+    @staticmethod
+    def _positions(paragraphs):
+        """Yield (start offset, paragraph) for paragraphs joined by blank lines."""
+        position = 0
+        for idx, paragraph in enumerate(paragraphs):
+            if idx:
+                position += 2
+            yield position, paragraph
+            position += len(paragraph)
+    
+    @staticmethod
+    def _slice(pending, start, end):
+        """
+        Get the document text between two offsets.
+        
+        Args:
+            pending (deque): (start, paragraph) pairs covering the range
+            start (int): Start offset in the document text
+            end (int): End offset in the document text
+        """
+        parts = []
+        for para_start, paragraph in pending:
+            if para_start >= end:
+                break
+            if para_start + len(paragraph) < start:
+                continue
+            parts.append(paragraph[max(0, start - para_start):end - para_start])
+        return "\n\n".join(parts)
+    
+    def _window_chunks(self, positioned):
+        """Yield overlapping fixed-size word windows over (start, paragraph) pairs."""
+        window = max(1, int(self.chunk_tokens * self.WORDS_PER_TOKEN))
+        step = max(1, window - int(self.overlap_tokens * self.WORDS_PER_TOKEN))
+        words = deque()  # (start, end) of words not yet stepped past
+        pending = deque()  # (start, paragraph) covering those words
+        emitted = True  # Whether every word seen is in an emitted window
+        
+        for para_start, paragraph in positioned:
+            pending.append((para_start, paragraph))
+            for match in re.finditer(r"\S+", paragraph):
+                words.append((para_start + match.start(), para_start + match.end()))
+                emitted = False
+                if len(words) < window:
+                    continue
+                start, end = words[0][0], words[window - 1][1]
+                yield start, end, self._slice(pending, start, end)
+                emitted = True
+                for _ in range(step):
+                    words.popleft()
+            
+            # Drop paragraphs that end before the first word still needed
+            keep_from = words[0][0] if words else para_start + len(paragraph)
+            while pending and pending[0][0] + len(pending[0][1]) < keep_from:
+                pending.popleft()
+        
+        if words and not emitted:
+            start, end = words[0][0], words[-1][1]
+            yield start, end, self._slice(pending, start, end)
+    
+    def _structure_chunks(self, positioned):
+        """Group paragraphs into chunks on heading, list and size boundaries."""
+        current = []  # (start, paragraph, tokens, is heading) in the open chunk
+        current_tokens = 0
+        pending = deque()  # (start, paragraph) from the open chunk's first paragraph on
+        
+        def close():
+            start = current[0][0]
+            end = current[-1][0] + len(current[-1][1])
+            return start, end, self._slice(pending, start, end)
+        
+        for para_start, paragraph in positioned:
+            if not paragraph.strip():
+                if current:
+                    pending.append((para_start, paragraph))
+                continue
+            tokens = self.count_tokens(paragraph)
+            heading = self.is_heading(paragraph)
+            
+            if tokens > self.chunk_tokens:
+                # Oversized paragraph: flush, then window it on its own
+                if current:
+                    yield close()
+                yield from self._window_chunks([(para_start, paragraph)])
+                current, current_tokens = [], 0
+                pending.clear()
+                continue
+            
+            only_headings = all(item[3] for item in current)
+            keeps_list = self.is_list(paragraph) and current and self.is_list(current[-1][1])
+            
+            if current and heading and not only_headings:
+                # A new section starts: no overlap across headings
+                yield close()
+                current, current_tokens = [], 0
+            elif current and current_tokens + tokens > self.chunk_tokens and not only_headings:
+                # Let a list run slightly long rather than split it
+                list_runs_on = keeps_list and current_tokens + tokens <= self.chunk_tokens * 1.5
+                if not list_runs_on:
+                    yield close()
+                    current, current_tokens = self._overlap_tail(current, tokens)
+            
+            keep_from = current[0][0] if current else para_start
+            while pending and pending[0][0] < keep_from:
+                pending.popleft()
+            current.append((para_start, paragraph, tokens, heading))
+            current_tokens += tokens
+            pending.append((para_start, paragraph))
+        
+        if current:
+            yield close()
+    
+    def _overlap_tail(self, previous, next_tokens):
+        """Pick trailing paragraphs of a closed chunk to repeat in the next one."""
+        tail = []
+        tail_tokens = 0
+        for item in reversed(previous):
+            tokens = item[2]
+            if tail_tokens + tokens > self.overlap_tokens or tail_tokens + tokens + next_tokens > self.chunk_tokens:
+                break
+            if item[3]:
+                break
+            tail.insert(0, item)
+            tail_tokens += tokens
+        return tail, tail_tokens
+
+class InMemoryDocumentBackend:
+    """
+    Default DocumentManager storage backend, held entirely in process memory.
+    
+    Document text is split into content-defined blocks held in a shared
+    ContentStore, so unchanged blocks are stored once across document versions.
+    Chunks are indexed incrementally in a SegmentedIndex and document metadata
+    in a FacetIndex.
+    
+    With a memory budget, the least recently used documents beyond it have
+    their text blocks and embeddings spilled to files in spill_dir and are
+    reloaded transparently when their text is read. Embeddings go to a
+    separate file, so dense search reads them without the text. Records,
+    chunk offsets, facets and index postings stay resident, so spilled
+    documents are still listed, filtered and searched. Spill files are
+    deleted with their document, and the rest when the backend is closed or
+    garbage collected, or at interpreter exit.
+    
+    A backend provides: has_document, begin_document, add_documents,
+    merge_metadata, remove_document, get_document, list_documents,
+    get_content, get_chunk, get_chunk_bounds, lexical_search,
+    filter_documents, iter_embeddings, get_resident_bytes, get_generation
+    and close.
+    """
+    
+    name = "memory"
+    
+    # Block boundaries fall on paragraph breaks chosen from the paragraph text
+    # itself, so an edit only changes the blocks around it
+    BLOCK_MIN_SIZE = 1024
+    BLOCK_MAX_SIZE = 8192
+    BLOCK_BOUNDARY_MASK = 0x3
+    
+    # Record fields moved to disk when a document is spilled
+    SPILLED_FIELDS = ("blocks", "block_offsets")
+    
+    def __init__(self, memory_budget=None, spill_dir=None):
+        """
+        Initialize empty in-memory storage.
+        
+        Args:
+            memory_budget (int, optional): Bytes of document data to keep
+                resident; None keeps everything in memory
+            spill_dir (str, optional): Directory for spilled documents;
+                defaults to a temporary directory removed on close
+        """
+        self.documents = {}  # Dictionary to store document records by ID
+        self.document_embeddings = {}  # Dictionary to store chunk embeddings by ID
+        self.content_store = ContentStore()  # Shared, deduplicated, compressed document text
+        self.index = SegmentedIndex()  # Incremental inverted index over chunks
+        self.facets = FacetIndex()  # Category, grade, curriculum and topic filters
+        self.generation = 0  # Bumped whenever the document set changes
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self._owns_spill_dir = False
+        self.resident = OrderedDict()  # Resident doc ID -> bytes of its own, least recently used first
+        self.resident_blocks = {}  # Block hash -> number of resident documents using it
+        self.resident_total = 0  # Resident bytes, counting each shared block once
+        self.spilled = {}  # Spilled doc ID -> spill file path
+        self.spill_stats = {"spills": 0, "reloads": 0}
+        self._spill_files = set()  # Every spill file written, for cleanup
+        self._spill_cleanup = None  # weakref.finalize removing the spill files
+        self._lock = threading.RLock()
+    
+    def has_document(self, doc_id):
+        """Check whether a document is stored."""
+        return doc_id in self.documents
+    
+    def begin_document(self, doc_id, record):
+        """
+        Start storing a document whose text and chunks arrive in pieces.
+        
+        Text blocks go to the content store as they fill, so a writer holds
+        at most one unfinished block plus the chunk offsets, embeddings and
+        index postings. The document stays invisible until add_documents.
+        
+        Args:
+            doc_id (str): Document ID
+            record (dict): Document record without size
+            
+        Returns:
+            _InMemoryDocumentWriter: Writer to feed, then pass to add_documents
+        """
+        return _InMemoryDocumentWriter(self, doc_id, record)
+    
+    def add_documents(self, writers):
+        """
+        Make documents written through begin_document visible.
+        
+        Args:
+            writers (list): Document writers; one whose document is already
+                stored is discarded instead
+        """
+        added = 0
+        for writer in writers:
+            writer.finish()
+            doc_id = writer.doc_id
+            with self._lock:
+                if doc_id in self.documents:
+                    # Stored meanwhile by a concurrent import; keep this upload's facets
+                    writer.discard()
+                    self.merge_metadata(doc_id, writer.record.get("metadata", {}))
+                    continue
+                record = dict(writer.record)
+                record.update({
+                    "size": writer.size,
+                    "blocks": writer.blocks,
+                    "block_offsets": writer.block_offsets,
+                    "chunk_starts": writer.chunk_starts,
+                    "chunk_ends": writer.chunk_ends
+                })
+                self.documents[doc_id] = record
+                if writer.vectors is not None:
+                    self.document_embeddings[doc_id] = writer.vectors
+                writer.committed = True
+                self._mark_resident(doc_id)
+            
+            self.facets.add_document(doc_id, record.get("metadata", {}))
+            self.index.add_segment(doc_id, writer.postings, len(writer.chunk_starts))
+            added += 1
+        
+        if added:
+            with self._lock:
+                self.generation += 1
+    
+    def merge_metadata(self, doc_id, metadata):
+        """
+        Merge metadata from a later upload of a stored document.
+        
+        Facet values the document doesn't have yet are added, so filters on
+        either upload's values find it.
+        
+        Returns:
+            bool: True if any facet value was added
+        """
+        with self._lock:
+            doc = self.documents.get(doc_id)
+            if doc is None:
+                return False
+            doc["metadata"], added = FacetIndex.merge_metadata(doc.get("metadata", {}), metadata)
+            if not added:
+                return False
+            self.facets.add_values(doc_id, added)
+            self.generation += 1
+        return True
+    
+    def remove_document(self, doc_id):
+        """
+        Remove a document by ID.
+        
+        The document's postings are tombstoned rather than deleted, so removal
+        doesn't rebuild the index or block concurrent queries.
+        
+        Returns:
+            bool: True if the document existed
+        """
+        with self._lock:
+            doc = self.documents.pop(doc_id, None)
+            if doc is None:
+                return False
+            if self.spilled.pop(doc_id, None) is None:
+                self._release_resident(doc_id, doc)
+                for block_hash in doc["blocks"]:
+                    self.content_store.release(block_hash)
+            self.document_embeddings.pop(doc_id, None)
+            # A resident document may still have files from an earlier spill
+            spill_paths = [self._spill_path(doc_id), self._vectors_path(doc_id)] if self.spill_dir else []
+            self._spill_files.difference_update(spill_paths)
+        
+        for spill_path in spill_paths:
+            if os.path.exists(spill_path):
+                os.remove(spill_path)
+        self.facets.remove_document(doc_id)
+        self.index.remove_document(doc_id)
+        with self._lock:
+            self.generation += 1
+        return True
+    
+    def get_document(self, doc_id):
+        """Get a document record by ID, or None."""
+        return self.documents.get(doc_id)
+    
+    def list_documents(self):
+        """Get (doc_id, record) pairs for all stored documents."""
+        return list(self.documents.items())
+    
+    def get_content(self, doc_id):
+        """Get the full text of a document."""
+        with self._lock:
+            doc = self._touch(doc_id)
+            if not doc:
+                return ""
+            return "".join(self.content_store.get(block_hash, cache=False) for block_hash in doc["blocks"])
+    
+    def get_chunk(self, doc_id, chunk_idx):
+        """
+        Get a chunk of a document.
+        
+        Returns:
+            tuple: (text, start, end), or None if the chunk doesn't exist
+        """
+        with self._lock:
+            doc = self._touch(doc_id)
+            if not doc or chunk_idx >= len(doc["chunk_starts"]):
+                return None
+            start, end = doc["chunk_starts"][chunk_idx], doc["chunk_ends"][chunk_idx]
+            return self._read_range(doc, start, end), start, end
+    
+    def get_chunk_bounds(self, doc_id, chunk_idx):
+        """
+        Get a chunk's offsets without reading its text.
+        
+        Chunk offsets stay resident, so this never reloads a spilled document.
+        
+        Returns:
+            tuple: (start, end), or None if the chunk doesn't exist
+        """
+        with self._lock:
+            doc = self.documents.get(doc_id)
+            if not doc or chunk_idx >= len(doc["chunk_starts"]):
+                return None
+            return doc["chunk_starts"][chunk_idx], doc["chunk_ends"][chunk_idx]
+    
+    def lexical_search(self, terms, doc_ids=None, limit=None):
+        """
+        Score chunks containing any of the query terms.
+        
+        Args:
+            terms (list): Query terms
+            doc_ids (set, optional): Restrict results to these documents
+            limit (int, optional): Keep only the top results
+            
+        Returns:
+            dict: (doc_id, chunk_idx) -> score
+        """
+        hits = self.index.search(terms, doc_ids=doc_ids)
+        if limit is not None and len(hits) > limit:
+            hits = dict(heapq.nlargest(limit, hits.items(), key=lambda item: item[1]))
+        return hits
+    
+    def filter_documents(self, filters):
+        """Get the IDs of documents matching facet filters."""
+        return self.facets.filter(filters)
+    
+    def iter_embeddings(self, doc_ids=None):
+        """
+        Yield (doc_id, chunk_idx, vector) for stored chunk embeddings.
+        
+        Spilled documents' vectors are read from their vectors file without
+        loading their text or making them resident, so a full scan doesn't
+        evict the hot set.
+        """
+        if doc_ids is None:
+            doc_ids = list(self.document_embeddings) + list(self.spilled)
+        for doc_id in doc_ids:
+            vectors = self.document_embeddings.get(doc_id)
+            if vectors is None:
+                if doc_id not in self.spilled:
+                    continue
+                try:
+                    vectors = self._load_spill(self._vectors_path(doc_id))
+                except OSError:
+                    continue
+            for chunk_idx, vector in enumerate(vectors or ()):
+                yield doc_id, chunk_idx, vector
+    
+    def get_resident_bytes(self):
+        """
+        Get the memory held by each document's text and embeddings.
+        
+        A text block shared by several resident documents is split evenly
+        between them, so the values add up to the memory actually held.
+        Spilled documents are reported as 0.
+        
+        Returns:
+            dict: Doc ID -> resident bytes
+        """
+        with self._lock:
+            usage = {doc_id: 0 for doc_id in self.documents}
+            for doc_id, size in self.resident.items():
+                for block_hash in set(self.documents[doc_id]["blocks"]):
+                    size += len(self.content_store.blocks[block_hash]) / self.resident_blocks[block_hash]
+                usage[doc_id] = round(size)
+            return usage
+    
+    def get_generation(self):
+        """Get a counter that changes whenever the document set changes."""
+        return self.generation
+    
+    def close(self):
+        """Remove the spill files, and the spill directory if this backend created it."""
+        with self._lock:
+            if self._spill_cleanup is not None:
+                self._spill_cleanup()
+                self._spill_cleanup = None
+            if self._owns_spill_dir:
+                self.spill_dir = None
+                self._owns_spill_dir = False
+    
+    def _touch(self, doc_id):
+        """
+        Get a document record for reading, reloading it if spilled.
+        
+        Must be called with the lock held.
+        """
+        doc = self.documents.get(doc_id)
+        if doc is None:
+            return None
+        if doc_id in self.spilled:
+            payload = self._load_spill(self.spilled.pop(doc_id))
+            for block_hash, data, size in payload["blocks"]:
+                self.content_store.put_compressed(block_hash, data, size)
+            doc.update({field: payload[field] for field in self.SPILLED_FIELDS if field != "blocks"})
+            doc["blocks"] = [block_hash for block_hash, _, _ in payload["blocks"]]
+            if os.path.exists(self._vectors_path(doc_id)):
+                self.document_embeddings[doc_id] = self._load_spill(self._vectors_path(doc_id))
+            self.spill_stats["reloads"] += 1
+            self._mark_resident(doc_id)
+        elif doc_id in self.resident:
+            self.resident.move_to_end(doc_id)
+        return doc
+    
+    def _mark_resident(self, doc_id):
+        """Account for a resident document and spill others to stay in budget."""
+        doc = self.documents[doc_id]
+        size = doc["block_offsets"].itemsize * len(doc["block_offsets"])
+        for vector in self.document_embeddings.get(doc_id) or ():
+            size += vector.itemsize * len(vector)
+        self.resident[doc_id] = size
+        self.resident_total += size
+        # A block shared with another resident document is already counted
+        for block_hash in set(doc["blocks"]):
+            users = self.resident_blocks.get(block_hash, 0)
+            if not users:
+                self.resident_total += len(self.content_store.blocks[block_hash])
+            self.resident_blocks[block_hash] = users + 1
+        
+        if self.memory_budget is None:
+            return
+        # The document just added or read stays resident even if it alone
+        # exceeds the budget
+        while self.resident_total > self.memory_budget and len(self.resident) > 1:
+            victim = next(iter(self.resident))
+            if victim == doc_id:
+                self.resident.move_to_end(victim)
+                continue
+            self._spill(victim)
+    
+    def _release_resident(self, doc_id, doc):
+        """Stop accounting for a resident document; call before releasing its blocks."""
+        self.resident_total -= self.resident.pop(doc_id)
+        for block_hash in set(doc["blocks"]):
+            users = self.resident_blocks[block_hash] - 1
+            if users:
+                self.resident_blocks[block_hash] = users
+            else:
+                del self.resident_blocks[block_hash]
+                self.resident_total -= len(self.content_store.blocks[block_hash])
+    
+    def _spill(self, doc_id):
+        """
+        Move a document's text blocks and embeddings to disk.
+        
+        Text blocks and block offsets go to "<doc_id>.spill" and embeddings,
+        if any, to "<doc_id>.vectors". Documents are immutable, so files
+        written once are reused if the document is reloaded and spilled
+        again. Must be called with the lock held.
+        """
+        doc = self.documents[doc_id]
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix="documents-spill-")
+            self._owns_spill_dir = True
+        if self._spill_cleanup is None:
+            self._spill_cleanup = weakref.finalize(
+                self, self._remove_spill_files, self.spill_dir if self._owns_spill_dir else None, self._spill_files
+            )
+        spill_path = self._spill_path(doc_id)
+        
+        if not os.path.exists(spill_path):
+            payload = {field: doc[field] for field in self.SPILLED_FIELDS if field != "blocks"}
+            payload["blocks"] = [
+                (block_hash, *self.content_store.get_compressed(block_hash)) for block_hash in doc["blocks"]
+            ]
+            self._write_spill(spill_path, payload)
+        vectors = self.document_embeddings.pop(doc_id, None)
+        if vectors is not None and not os.path.exists(self._vectors_path(doc_id)):
+            self._write_spill(self._vectors_path(doc_id), vectors)
+        
+        self._release_resident(doc_id, doc)
+        for block_hash in doc["blocks"]:
+            self.content_store.release(block_hash)
+        for field in self.SPILLED_FIELDS:
+            del doc[field]
+        self.spilled[doc_id] = spill_path
+        self.spill_stats["spills"] += 1
+    
+    def _spill_path(self, doc_id):
+        return os.path.join(self.spill_dir, f"{doc_id}.spill")
+    
+    def _vectors_path(self, doc_id):
+        return os.path.join(self.spill_dir, f"{doc_id}.vectors")
+    
+    def _write_spill(self, spill_path, payload):
+        """Write a spill file atomically and remember it for cleanup."""
+        temp_path = f"{spill_path}.tmp"
+        with open(temp_path, "wb") as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, spill_path)
+        self._spill_files.add(spill_path)
+    
+    @staticmethod
+    def _load_spill(spill_path):
+        """Read a spill file written by _spill."""
+        with open(spill_path, "rb") as f:
+            return pickle.load(f)
+    
+    @staticmethod
+    def _remove_spill_files(owned_dir, spill_files):
+        """Delete spill files, or the whole directory if the backend created it."""
+        if owned_dir is not None:
+            shutil.rmtree(owned_dir, ignore_errors=True)
+            return
+        for spill_path in list(spill_files):
+            try:
+                os.remove(spill_path)
+            except OSError:
+                pass
+        spill_files.clear()
+    
+    def _read_range(self, doc, start, end):
+        """
+        Read a range of a document's text from its stored blocks.
+        
+        Args:
+            doc (dict): Document record
+            start (int): Start offset in the document text
+            end (int): End offset in the document text
+            
+        Returns:
+            str: Text between the offsets
+        """
+        offsets = doc["block_offsets"]
+        first = bisect.bisect_right(offsets, start) - 1
+        parts = []
+        for block_idx in range(first, len(doc["blocks"])):
+            block_start = offsets[block_idx]
+            if block_start >= end:
+                break
+            text = self.content_store.get(doc["blocks"][block_idx])
+            parts.append(text[max(0, start - block_start):end - block_start])
+        return "".join(parts)
+    
+
+
+class _InMemoryDocumentWriter:
+    """Collects one document for InMemoryDocumentBackend as it streams in."""
+    
+    def __init__(self, backend, doc_id, record):
+        self.backend = backend
+        self.doc_id = doc_id
+        self.record = dict(record)
+        self.size = 0
+        self.blocks = []  # Content store hashes of the finished blocks
+        self.block_offsets = array('Q', [0])
+        self.chunk_starts = array('I')
+        self.chunk_ends = array('I')
+        self.vectors = []  # None once a batch arrives without embeddings
+        self.postings = {}
+        self.committed = False
+        self._block = []
+        self._block_size = 0
+    
+    def add_paragraph(self, paragraph):
+        """
+        Append a paragraph to the document text.
+        
+        Block boundaries fall on paragraph breaks chosen from the paragraph
+        text itself, so an edit only changes the blocks around it.
+        """
+        at_boundary = (zlib.crc32(paragraph.encode("utf-8")) & self.backend.BLOCK_BOUNDARY_MASK) == 0
+        if self.size:
+            paragraph = '\n\n' + paragraph
+        self._block.append(paragraph)
+        self._block_size += len(paragraph)
+        self.size += len(paragraph)
+        if self._block_size >= self.backend.BLOCK_MAX_SIZE or (
+                self._block_size >= self.backend.BLOCK_MIN_SIZE and at_boundary):
+            self._store_block()
+    
+    def add_chunks(self, chunks, vectors):
+        """
+        Add a batch of chunks.
+        
+        Args:
+            chunks (list): (start, end, text) tuples in document order
+            vectors (list or None): One embedding per chunk, or None if the
+                batch couldn't be embedded
+        """
+        first_idx = len(self.chunk_starts)
+        for start, end, _ in chunks:
+            self.chunk_starts.append(start)
+            self.chunk_ends.append(end)
+        SegmentedIndex.collect_postings(self.postings, self.doc_id, first_idx, [text for _, _, text in chunks])
+        if vectors is None:
+            self.vectors = None
+        elif self.vectors is not None:
+            self.vectors.extend(vectors)
+    
+    def finish(self):
+        """Store the last, unfinished block."""
+        if self._block:
+            self._store_block()
+    
+    def discard(self):
+        """Release the blocks stored so far unless the document was added."""
+        if self.committed:
+            return
+        with self.backend._lock:
+            for block_hash in self.blocks:
+                self.backend.content_store.release(block_hash)
+        self.blocks = []
+        self._block = []
+    
+    def _store_block(self):
+        block = "".join(self._block)
+        with self.backend._lock:
+            self.blocks.append(self.backend.content_store.put(block))
+        self.block_offsets.append(self.block_offsets[-1] + len(block))
+        self._block = []
+        self._block_size = 0
+
+class SQLiteDocumentBackend:
+    """
+    DocumentManager storage backend on SQLite, shared between processes.
+    
+    The database runs in WAL mode so several worker processes can read while
+    one writes. Document text is stored in fixed-size blocks and each chunk
+    keeps its own text, indexed through an external-content FTS5 table over
+    the chunks. Facets are indexed columns on the documents table, with
+    further values added by later uploads of a document in document_facets,
+    and embeddings are float32 blobs on the chunks. A document being imported
+    is staged batch by batch in temporary tables and copied over when it is
+    added, so neither side holds the whole document in Python. Each thread
+    gets its own connection; the fixed SQL strings below are compiled once
+    per connection by sqlite3's statement cache. The generation counter
+    only moves when a write actually changes rows.
+    """
+    
+    name = "sqlite"
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS documents (
+            doc_id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            path TEXT,
+            type TEXT,
+            size INTEGER NOT NULL,
+            content_hash TEXT,
+            category TEXT,
+            grade TEXT,
+            curriculum TEXT,
+            topic TEXT,
+            metadata TEXT
+        );
+        CREATE INDEX IF NOT EXISTS documents_category ON documents(category);
+        CREATE INDEX IF NOT EXISTS documents_grade ON documents(grade);
+        CREATE INDEX IF NOT EXISTS documents_curriculum ON documents(curriculum);
+        CREATE INDEX IF NOT EXISTS documents_topic ON documents(topic);
+        CREATE TABLE IF NOT EXISTS document_facets (
+            doc_id TEXT NOT NULL REFERENCES documents(doc_id),
+            facet TEXT NOT NULL,
+            value TEXT NOT NULL,
+            PRIMARY KEY (doc_id, facet, value)
+        );
+        CREATE INDEX IF NOT EXISTS document_facets_value ON document_facets(facet, value);
+        CREATE TABLE IF NOT EXISTS document_blocks (
+            doc_id TEXT NOT NULL REFERENCES documents(doc_id),
+            block_idx INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            PRIMARY KEY (doc_id, block_idx)
+        );
+        CREATE TABLE IF NOT EXISTS chunks (
+            id INTEGER PRIMARY KEY,
+            doc_id TEXT NOT NULL REFERENCES documents(doc_id),
+            chunk_idx INTEGER NOT NULL,
+            start INTEGER NOT NULL,
+            end INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            embedding BLOB
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS chunks_doc ON chunks(doc_id, chunk_idx);
+        CREATE VIRTUAL TABLE IF NOT EXISTS chunk_fts USING fts5(
+            text, content='chunks', content_rowid='id'
+        );
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+        INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0);
+        PRAGMA user_version = 2;
+    """
+    SCHEMA_VERSION = 2
+    
+    # Per-connection staging for documents being imported; spilled to a
+    # temporary file rather than memory
+    STAGING_SCHEMA = """
+        PRAGMA temp_store = FILE;
+        CREATE TEMP TABLE IF NOT EXISTS staged_blocks (
+            stage_id INTEGER NOT NULL,
+            block_idx INTEGER NOT NULL,
+            text TEXT NOT NULL
+        );
+        CREATE TEMP TABLE IF NOT EXISTS staged_chunks (
+            stage_id INTEGER NOT NULL,
+            chunk_idx INTEGER NOT NULL,
+            start INTEGER NOT NULL,
+            end INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            embedding BLOB
+        );
+    """
+    
+    # Characters of document text per stored block
+    BLOCK_SIZE = 64 * 1024
+    
+    SQL_HAS_DOCUMENT = "SELECT 1 FROM documents WHERE doc_id = ?"
+    SQL_INSERT_DOCUMENT = (
+        "INSERT OR IGNORE INTO documents (doc_id, name, path, type, size, content_hash, "
+        "category, grade, curriculum, topic, metadata) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+    )
+    SQL_GET_METADATA = "SELECT metadata FROM documents WHERE doc_id = ?"
+    SQL_SET_METADATA = "UPDATE documents SET metadata = ? WHERE doc_id = ?"
+    SQL_ADD_FACET = "INSERT OR IGNORE INTO document_facets (doc_id, facet, value) VALUES (?, ?, ?)"
+    SQL_DELETE_FACETS = "DELETE FROM document_facets WHERE doc_id = ?"
+    SQL_STAGE_BLOCK = "INSERT INTO staged_blocks (stage_id, block_idx, text) VALUES (?, ?, ?)"
+    SQL_STAGE_CHUNK = (
+        "INSERT INTO staged_chunks (stage_id, chunk_idx, start, end, text, embedding) VALUES (?, ?, ?, ?, ?, ?)"
+    )
+    SQL_COPY_BLOCKS = (
+        "INSERT INTO document_blocks (doc_id, block_idx, text) "
+        "SELECT ?, block_idx, text FROM staged_blocks WHERE stage_id = ? ORDER BY block_idx"
+    )
+    # Embeddings are kept only if every batch of the document was embedded
+    SQL_COPY_CHUNKS = (
+        "INSERT INTO chunks (doc_id, chunk_idx, start, end, text, embedding) "
+        "SELECT ?, chunk_idx, start, end, text, CASE WHEN ? THEN embedding END "
+        "FROM staged_chunks WHERE stage_id = ? ORDER BY chunk_idx"
+    )
+    SQL_UNSTAGE_BLOCKS = "DELETE FROM staged_blocks WHERE stage_id = ?"
+    SQL_UNSTAGE_CHUNKS = "DELETE FROM staged_chunks WHERE stage_id = ?"
+    SQL_INDEX_CHUNKS = "INSERT INTO chunk_fts (rowid, text) SELECT id, text FROM chunks WHERE doc_id = ?"
+    SQL_UNINDEX_CHUNKS = (
+        "INSERT INTO chunk_fts (chunk_fts, rowid, text) "
+        "SELECT 'delete', id, text FROM chunks WHERE doc_id = ?"
+    )
+    SQL_DELETE_CHUNKS = "DELETE FROM chunks WHERE doc_id = ?"
+    SQL_DELETE_BLOCKS = "DELETE FROM document_blocks WHERE doc_id = ?"
+    SQL_DELETE_DOCUMENT = "DELETE FROM documents WHERE doc_id = ?"
+    SQL_GET_DOCUMENT = "SELECT name, path, type, size, content_hash, metadata FROM documents WHERE doc_id = ?"
+    SQL_LIST_DOCUMENTS = "SELECT doc_id, name, path, type, size, content_hash, metadata FROM documents ORDER BY rowid"
+    SQL_GET_CONTENT = "SELECT text FROM document_blocks WHERE doc_id = ? ORDER BY block_idx"
+    SQL_GET_CHUNK = "SELECT text, start, end FROM chunks WHERE doc_id = ? AND chunk_idx = ?"
+    SQL_GET_CHUNK_BOUNDS = "SELECT start, end FROM chunks WHERE doc_id = ? AND chunk_idx = ?"
+    SQL_SEARCH = (
+        "SELECT c.doc_id, c.chunk_idx, -bm25(chunk_fts) FROM chunk_fts "
+        "JOIN chunks c ON c.id = chunk_fts.rowid "
+        "WHERE chunk_fts MATCH ? ORDER BY bm25(chunk_fts) LIMIT ?"
+    )
+    SQL_SEARCH_IN = (
+        "SELECT c.doc_id, c.chunk_idx, -bm25(chunk_fts) FROM chunk_fts "
+        "JOIN chunks c ON c.id = chunk_fts.rowid "
+        "WHERE chunk_fts MATCH ? AND c.doc_id IN (SELECT value FROM json_each(?)) "
+        "ORDER BY bm25(chunk_fts) LIMIT ?"
+    )
+    SQL_EMBEDDINGS = "SELECT doc_id, chunk_idx, embedding FROM chunks WHERE embedding IS NOT NULL"
+    SQL_EMBEDDINGS_IN = (
+        "SELECT doc_id, chunk_idx, embedding FROM chunks "
+        "WHERE embedding IS NOT NULL AND doc_id IN (SELECT value FROM json_each(?))"
+    )
+    SQL_GENERATION = "SELECT value FROM meta WHERE key = 'generation'"
+    SQL_BUMP_GENERATION = "UPDATE meta SET value = value + 1 WHERE key = 'generation'"
+    
+    def __init__(self, db_path=None):
+        """
+        Open (or create) the database.
+        
+        Args:
+            db_path (str, optional): Path to the SQLite database file;
+                defaults to documents.db in the application data directory
+        """
+        self.db_path = db_path or app_data_path("documents.db")
+        self._local = threading.local()
+        self._connections = []  # Every thread's connection, closed by close()
+        self._connections_lock = threading.Lock()
+        self._stage_ids = itertools.count()
+        conn = self._connect()
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'documents'").fetchone()
+        if exists and version != self.SCHEMA_VERSION:
+            raise ValueError(f"{self.db_path} uses an older schema; remove it to rebuild the document store")
+        conn.executescript(self.SCHEMA)
+    
+    def _connect(self):
+        """Get this thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Connections are closed by close(), possibly from another thread
+            conn = sqlite3.connect(self.db_path, timeout=30, cached_statements=64, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.STAGING_SCHEMA)
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+    
+    def has_document(self, doc_id):
+        """Check whether a document is stored."""
+        return self._connect().execute(self.SQL_HAS_DOCUMENT, (doc_id,)).fetchone() is not None
+    
+    def begin_document(self, doc_id, record):
+        """
+        Start storing a document whose text and chunks arrive in pieces.
+        
+        Text blocks and chunk batches are staged in this thread's temporary
+        tables as they arrive; the document stays invisible until
+        add_documents is called from the same thread.
+        
+        Args:
+            doc_id (str): Document ID
+            record (dict): Document record without size
+            
+        Returns:
+            _SQLiteDocumentWriter: Writer to feed, then pass to add_documents
+        """
+        return _SQLiteDocumentWriter(self, doc_id, record)
+    
+    def add_documents(self, writers):
+        """
+        Move staged documents into the store in a single transaction.
+        
+        Args:
+            writers (list): Document writers from this thread; one whose
+                document is already stored is discarded instead
+        """
+        for writer in writers:
+            writer.finish()
+        conn = self._connect()
+        with conn:
+            added = 0
+            for writer in writers:
+                doc_id = writer.doc_id
+                record = writer.record
+                metadata = record.get("metadata", {})
+                facets = [FacetIndex.values(metadata, facet) for facet in FacetIndex.FACETS]
+                cursor = conn.execute(self.SQL_INSERT_DOCUMENT, (
+                    doc_id, record["name"], record.get("path"), record.get("type"), writer.size,
+                    record.get("content_hash"), *[values[0] if values else None for values in facets],
+                    json.dumps(metadata)
+                ))
+                if cursor.rowcount:
+                    conn.execute(self.SQL_COPY_BLOCKS, (doc_id, writer.stage_id))
+                    conn.execute(self.SQL_COPY_CHUNKS, (doc_id, writer.embedded, writer.stage_id))
+                    conn.execute(self.SQL_INDEX_CHUNKS, (doc_id,))
+                    for facet, values in zip(FacetIndex.FACETS, facets):
+                        for value in values[1:]:
+                            conn.execute(self.SQL_ADD_FACET, (doc_id, facet, value))
+                    added += 1
+                elif self._merge_metadata(conn, doc_id, metadata):
+                    # Stored by another import; this upload's facets were added
+                    added += 1
+                conn.execute(self.SQL_UNSTAGE_BLOCKS, (writer.stage_id,))
+                conn.execute(self.SQL_UNSTAGE_CHUNKS, (writer.stage_id,))
+            if added:
+                conn.execute(self.SQL_BUMP_GENERATION)
+        for writer in writers:
+            writer.committed = True
+    
+    def merge_metadata(self, doc_id, metadata):
+        """
+        Merge metadata from a later upload of a stored document.
+        
+        Facet values the document doesn't have yet are added, so filters on
+        either upload's values find it.
+        
+        Returns:
+            bool: True if any facet value was added
+        """
+        conn = self._connect()
+        with conn:
+            merged = self._merge_metadata(conn, doc_id, metadata)
+            if merged:
+                conn.execute(self.SQL_BUMP_GENERATION)
+        return merged
+    
+    def remove_document(self, doc_id):
+        """
+        Remove a document by ID.
+        
+        Returns:
+            bool: True if the document existed
+        """
+        conn = self._connect()
+        with conn:
+            conn.execute(self.SQL_UNINDEX_CHUNKS, (doc_id,))
+            conn.execute(self.SQL_DELETE_CHUNKS, (doc_id,))
+            conn.execute(self.SQL_DELETE_BLOCKS, (doc_id,))
+            conn.execute(self.SQL_DELETE_FACETS, (doc_id,))
+            removed = conn.execute(self.SQL_DELETE_DOCUMENT, (doc_id,)).rowcount > 0
+            if removed:
+                conn.execute(self.SQL_BUMP_GENERATION)
+        return removed
+    
+    def get_document(self, doc_id):
+        """Get a document record by ID, or None."""
+        row = self._connect().execute(self.SQL_GET_DOCUMENT, (doc_id,)).fetchone()
+        return self._record(*row) if row else None
+    
+    def list_documents(self):
+        """Get (doc_id, record) pairs for all stored documents."""
+        return [
+            (row[0], self._record(*row[1:]))
+            for row in self._connect().execute(self.SQL_LIST_DOCUMENTS)
+        ]
+    
+    def get_content(self, doc_id):
+        """Get the full text of a document."""
+        return "".join(row[0] for row in self._connect().execute(self.SQL_GET_CONTENT, (doc_id,)))
+    
+    def get_chunk(self, doc_id, chunk_idx):
+        """
+        Get a chunk of a document.
+        
+        Returns:
+            tuple: (text, start, end), or None if the chunk doesn't exist
+        """
+        return self._connect().execute(self.SQL_GET_CHUNK, (doc_id, chunk_idx)).fetchone()
+    
+    def get_chunk_bounds(self, doc_id, chunk_idx):
+        """
+        Get a chunk's offsets without reading its text.
+        
+        Returns:
+            tuple: (start, end), or None if the chunk doesn't exist
+        """
+        return self._connect().execute(self.SQL_GET_CHUNK_BOUNDS, (doc_id, chunk_idx)).fetchone()
+    
+    def lexical_search(self, terms, doc_ids=None, limit=None):
+        """
+        Score chunks containing any of the query terms with FTS5 BM25.
+        
+        Args:
+            terms (list): Query terms
+            doc_ids (set, optional): Restrict results to these documents
+            limit (int, optional): Keep only the top results
+            
+        Returns:
+            dict: (doc_id, chunk_idx) -> score
+        """
+        if not terms:
+            return {}
+        match = " OR ".join(f'"{term}"' for term in set(terms))
+        limit = -1 if limit is None else limit
+        conn = self._connect()
+        if doc_ids is None:
+            rows = conn.execute(self.SQL_SEARCH, (match, limit))
+        else:
+            rows = conn.execute(self.SQL_SEARCH_IN, (match, json.dumps(list(doc_ids)), limit))
+        return {(doc_id, chunk_idx): score for doc_id, chunk_idx, score in rows}
+    
+    def filter_documents(self, filters):
+        """Get the IDs of documents matching facet filters."""
+        clauses = []
+        params = []
+        for facet, values in filters.items():
+            if facet not in FacetIndex.FACETS or values in (None, ""):
+                continue
+            if isinstance(values, (str, int)):
+                values = [values]
+            clauses.append(
+                f"({facet} IN (SELECT value FROM json_each(?)) OR doc_id IN ("
+                f"SELECT doc_id FROM document_facets WHERE facet = '{facet}' "
+                f"AND value IN (SELECT value FROM json_each(?))))"
+            )
+            normalized = json.dumps([FacetIndex.normalize(value) for value in values])
+            params.extend([normalized, normalized])
+        sql = "SELECT doc_id FROM documents"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        return {row[0] for row in self._connect().execute(sql, params)}
+    
+    def iter_embeddings(self, doc_ids=None):
+        """Yield (doc_id, chunk_idx, vector) for stored chunk embeddings."""
+        conn = self._connect()
+        if doc_ids is None:
+            rows = conn.execute(self.SQL_EMBEDDINGS)
+        else:
+            rows = conn.execute(self.SQL_EMBEDDINGS_IN, (json.dumps(list(doc_ids)),))
+        for doc_id, chunk_idx, blob in rows:
+            vector = array('f')
+            vector.frombytes(blob)
+            yield doc_id, chunk_idx, vector
+    
+    def get_resident_bytes(self):
+        """Get resident bytes per document; documents live in the database file, not in memory."""
+        return {doc_id: 0 for doc_id, _ in self.list_documents()}
+    
+    def get_generation(self):
+        """Get a counter that changes whenever any process changes the document set."""
+        return self._connect().execute(self.SQL_GENERATION).fetchone()[0]
+    
+    def close(self):
+        """Close every thread's connection; threads reconnect on next use."""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+    
+    def _merge_metadata(self, conn, doc_id, metadata):
+        """Merge an upload's metadata into a stored document inside a transaction."""
+        row = conn.execute(self.SQL_GET_METADATA, (doc_id,)).fetchone()
+        if row is None:
+            return False
+        merged, added = FacetIndex.merge_metadata(json.loads(row[0]) if row[0] else {}, metadata)
+        if not added:
+            return False
+        conn.execute(self.SQL_SET_METADATA, (json.dumps(merged), doc_id))
+        for facet, value in added:
+            conn.execute(self.SQL_ADD_FACET, (doc_id, facet, value))
+        return True
+    
+    @staticmethod
+    def _record(name, path, doc_type, size, content_hash, metadata):
+        """Build a document record from a documents row."""
+        return {
+            "name": name,
+            "path": path,
+            "type": doc_type,
+            "size": size,
+            "content_hash": content_hash,
+            "metadata": json.loads(metadata) if metadata else {}
+        }
+
+class _SQLiteDocumentWriter:
+    """Stages one document for SQLiteDocumentBackend as it streams in."""
+    
+    def __init__(self, backend, doc_id, record):
+        self.backend = backend
+        self.doc_id = doc_id
+        self.record = dict(record)
+        self.stage_id = next(backend._stage_ids)
+        self.size = 0
+        self.chunk_count = 0
+        self.embedded = 1  # Cleared once a batch arrives without embeddings
+        self.committed = False
+        self._block = []
+        self._block_size = 0
+        self._block_count = 0
+    
+    def add_paragraph(self, paragraph):
+        """Append a paragraph to the document text."""
+        if self.size:
+            paragraph = '\n\n' + paragraph
+        self._block.append(paragraph)
+        self._block_size += len(paragraph)
+        self.size += len(paragraph)
+        if self._block_size >= self.backend.BLOCK_SIZE:
+            self._stage_block()
+    
+    def add_chunks(self, chunks, vectors):
+        """
+        Stage a batch of chunks.
+        
+        Args:
+            chunks (list): (start, end, text) tuples in document order
+            vectors (list or None): One embedding per chunk, or None if the
+                batch couldn't be embedded
+        """
+        if vectors is None:
+            self.embedded = 0
+            vectors = [None] * len(chunks)
+        conn = self.backend._connect()
+        with conn:
+            conn.executemany(self.backend.SQL_STAGE_CHUNK, (
+                (self.stage_id, self.chunk_count + offset, start, end, text,
+                 vector.tobytes() if vector is not None else None)
+                for offset, ((start, end, text), vector) in enumerate(zip(chunks, vectors))
+            ))
+        self.chunk_count += len(chunks)
+    
+    def finish(self):
+        """Stage the last, unfinished block."""
+        if self._block:
+            self._stage_block()
+    
+    def discard(self):
+        """Drop the staged rows unless the document was added."""
+        if self.committed:
+            return
+        self._block = []
+        conn = self.backend._connect()
+        with conn:
+            conn.execute(self.backend.SQL_UNSTAGE_BLOCKS, (self.stage_id,))
+            conn.execute(self.backend.SQL_UNSTAGE_CHUNKS, (self.stage_id,))
+    
+    def _stage_block(self):
+        conn = self.backend._connect()
+        with conn:
+            conn.execute(self.backend.SQL_STAGE_BLOCK, (self.stage_id, self._block_count, "".join(self._block)))
+        self._block_count += 1
+        self._block = []
+        self._block_size = 0
+
+class DocumentManager:
+    """
+    Manages document importing, parsing, and embedding for reference during content generation.
+    
+    Documents are identified by a hash of their file contents, so uploading the
+    same file twice returns the existing document instead of parsing it again.
+    Documents are split into retrieval chunks by a ChunkingEngine, which
+    records chunk boundaries as offsets into the stored document text.
+    Imports stream: paragraphs are chunked, embedded and handed to the
+    backend in batches of EMBED_BATCH_CHUNKS chunks as the text is
+    extracted, so a large document is never held in memory at once.
+    Storage and indexing are delegated to a backend: InMemoryDocumentBackend
+    by default, or SQLiteDocumentBackend for a store that survives restarts
+    and is shared between processes. Retrieval results are cached until the
+    backend reports that the document set changed, and can be limited by
+    metadata facets such as grade and curriculum before any scoring happens.
+    
+    Retrieval runs in one of three modes: "lexical" (inverted index),
+    "dense" (embedding similarity) or "hybrid", which runs both retrievers
+    in parallel and fuses their rankings with reciprocal rank fusion.
+    Chunks are clustered into near-duplicates at import, and each cluster
+    contributes at most one chunk to a query's results. Documents already
+    in a persistent backend when the manager starts are not clustered.
+    """
+    
+    HASH_READ_SIZE = 1024 * 1024
+    
+    # Plain text is only imported under these extensions (or none), so
+    # other text-like files such as scripts or markup are rejected
+    TEXT_EXTENSIONS = ("", ".txt", ".text", ".md")
+    EMBED_BATCH_CHUNKS = 64  # Chunks embedded and written together during an import
+    
+    # Large PDFs are split into page ranges extracted by a process pool
+    PDF_PARALLEL_MIN_PAGES = 64
+    PDF_PAGES_PER_TASK = 16
+    MAX_EXTRACTION_REPORTS = 100
+    
+    RETRIEVAL_MODES = ("lexical", "dense", "hybrid")
+    RRF_K = 60  # Reciprocal rank fusion damping constant
+    RETRIEVAL_WORKERS = 4
+    MAX_PENDING_RETRIEVALS = 8  # Retriever tasks queued or running on the pool
+    # Retrievers fetch this many times candidate_pool_size so near-duplicate
+    # clusters can be collapsed before the pool is cut to size
+    DUPLICATE_OVERFETCH = 4
+    
+    def __init__(self, config_manager, embedder=None, retrieval_mode="lexical",
+                 candidate_pool_size=50, retriever_timeout=0.5, backend=None, pdf_workers=None,
+                 chunker=None, duplicate_threshold=0.8, embedding_cache=None, memory_budget=None):
+        """
+        Initialize with configuration.
+        
+        Args:
+            config_manager: ConfigManager instance for API access
+            embedder (optional): Embedder with `embedder_id` and `embed(texts)`;
+                defaults to a local HashingEmbedder
+            retrieval_mode (str): Default mode, one of RETRIEVAL_MODES
+            candidate_pool_size (int): Maximum candidates each retriever contributes
+            retriever_timeout (float): Seconds to wait for each retriever in hybrid mode
+            backend (optional): Storage backend; defaults to InMemoryDocumentBackend
+            pdf_workers (int, optional): Processes for extracting large PDFs;
+                defaults to the CPU count, 1 disables parallel extraction
+            chunker (optional): ChunkingEngine; defaults to structure-aware chunking
+            duplicate_threshold (float, optional): Similarity above which
+                chunks are treated as near-duplicates; None disables detection
+            embedding_cache (optional): EmbeddingCache reused across imports,
+                re-chunking and restarts so only new chunks are embedded
+            memory_budget (int, optional): Bytes of document data the default
+                in-memory backend keeps resident before spilling the least
+                recently used documents to disk
+        """
+        self.config = config_manager
+        self.backend = backend or InMemoryDocumentBackend(memory_budget=memory_budget)
+        self.chunker = chunker or ChunkingEngine()
+        self.embedder = embedder or HashingEmbedder()
+        self.embedding_cache = embedding_cache
+        self.retrieval_mode = retrieval_mode
+        self.candidate_pool_size = candidate_pool_size
+        self.retriever_timeout = retriever_timeout
+        self.retrieval_timings = {name: deque(maxlen=1000) for name in ("lexical", "dense")}
+        self._retrieval_pool = ThreadPoolExecutor(max_workers=self.RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+        self._retrieval_slots = threading.BoundedSemaphore(self.MAX_PENDING_RETRIEVALS)
+        self.packer = ContextPacker()
+        self.query_cache = QueryCache()
+        self.pdf_workers = pdf_workers or os.cpu_count() or 1
+        self.extraction_reports = OrderedDict()  # Doc ID -> extraction timings
+        self._reports_lock = threading.Lock()
+        self.import_names = {}  # Doc ID -> names it was imported under since startup
+        self._names_lock = threading.Lock()
+        self.near_duplicates = NearDuplicateIndex(duplicate_threshold) if duplicate_threshold else None
+        self.duplicate_stats = {"collapsed_chunks": 0, "collapsed_chars": 0}
+        self._stats_lock = threading.Lock()
+    
+    def import_document(self, file_path, metadata=None, claim=None):
+        """
+        Import a document from file path and prepare it for reference.
+        
+        The file is hashed in fixed-size reads before parsing. If a document
+        with the same contents is already imported, its ID is returned
+        without parsing or storing the file again.
+        
+        Args:
+            file_path (str): Path to the document file
+            metadata (dict, optional): Facets for filtering retrieval, any of
+                "category", "grade", "curriculum" and "topic"
+            claim (callable, optional): Called with the document ID as soon
+                as the file is hashed, before it is looked up or parsed
+            
+        Returns:
+            str: Document ID for future reference or error message
+        """
+        return self.import_documents([file_path], metadata, claim=claim)[0]
+    
+    def import_documents(self, file_paths, metadata=None, progress=None, cancelled=None, claim=None):
+        """
+        Import several documents, writing them to the backend in one batch.
+        
+        Args:
+            file_paths (list): Paths to the document files
+            metadata (dict, optional): Facets applied to every document
+            progress (callable, optional): Called with (path index, stage) as
+                each file is "parsed", "chunked", "embedded" (or
+                "embedding_failed") and "indexed"
+            cancelled (callable, optional): Checked between chunk batches;
+                once it returns True, unfinished files are abandoned
+            claim (callable, optional): Called with each file's document ID
+                as soon as it is hashed, before it is looked up or parsed
+            
+        Returns:
+            list: Document ID, error message or "Cancelled" for each path, in order
+        """
+        return self._import_sources(
+            [(file_path, os.path.basename(file_path), file_path, None) for file_path in file_paths],
+            metadata,
+            progress,
+            cancelled,
+            claim
+        )
+    
+    def import_bytes(self, data, name=None, metadata=None, claim=None):
+        """
+        Import a document from an in-memory buffer.
+        
+        The buffer is parsed in place through a memoryview, with no temporary
+        file and no copy. PDF and Word formats are detected from the content;
+        plain text must be named with one of TEXT_EXTENSIONS.
+        
+        Args:
+            data (bytes, bytearray or memoryview): Document file contents
+            name (str, optional): Display name, such as the uploaded file name
+            metadata (dict, optional): Facets for filtering retrieval
+            claim (callable, optional): Called with the document ID as soon
+                as the buffer is hashed, before it is looked up or parsed
+            
+        Returns:
+            str: Document ID for future reference or error message
+        """
+        try:
+            source = memoryview(data).cast('B')
+        except (TypeError, ValueError) as e:
+            return f"Error importing document: {str(e)}"
+        return self._import_sources([(source, name or "document", None, None)], metadata, claim=claim)[0]
+    
+    def import_stream(self, stream, name=None, metadata=None):
+        """
+        Import a document from a binary file-like object.
+        
+        The stream is read in fixed-size pieces into one buffer and hashed as
+        it is read, then parsed in place like import_bytes.
+        
+        Args:
+            stream: Readable binary file-like object
+            name (str, optional): Display name, defaults to the stream's name
+            metadata (dict, optional): Facets for filtering retrieval
+            
+        Returns:
+            str: Document ID for future reference or error message
+        """
+        try:
+            hasher = hashlib.sha256()
+            buffer = bytearray()
+            for data in iter(lambda: stream.read(self.HASH_READ_SIZE), b''):
+                hasher.update(data)
+                buffer += data
+        except Exception as e:
+            return f"Error importing document: {str(e)}"
+        
+        name = name or os.path.basename(getattr(stream, "name", "") or "") or "document"
+        source = memoryview(buffer)
+        return self._import_sources([(source, name, None, hasher.hexdigest())], metadata)[0]
+    
+    def _import_sources(self, sources, metadata=None, progress=None, cancelled=None, claim=None):
+        """
+        Prepare documents and write the new ones to the backend in one batch.
+        
+        Args:
+            sources (list): (source, name, path, content_hash) tuples, where
+                source is a file path or a memoryview and content_hash may be
+                None to compute it
+            metadata (dict, optional): Facets applied to every document
+            progress (callable, optional): Called with (source index, stage)
+            cancelled (callable, optional): Returns True to abandon
+                unfinished sources
+            claim (callable, optional): Called with each source's document
+                ID once it is hashed
+            
+        Returns:
+            list: Document ID, error message or "Cancelled" for each source, in order
+        """
+        results = []
+        entries = []
+        for position, (source, name, path, content_hash) in enumerate(sources):
+            stage_callback = None
+            if progress:
+                stage_callback = lambda stage, position=position: progress(position, stage)
+            try:
+                entry = self._prepare_document(
+                    source, name, path, metadata, content_hash, stage_callback, cancelled, claim
+                )
+            except Exception as e:
+                results.append(f"Error importing document: {str(e)}")
+                continue
+            if isinstance(entry, str):
+                results.append(entry)
+                continue
+            results.append(entry["doc_id"])
+            if any(queued["doc_id"] == entry["doc_id"] for queued in entries):
+                entry["writer"].discard()
+            else:
+                entries.append(entry)
+        
+        if entries:
+            try:
+                self.backend.add_documents([entry["writer"] for entry in entries])
+            except Exception as e:
+                for entry in entries:
+                    entry["writer"].discard()
+                failed = {entry["doc_id"] for entry in entries}
+                results = [f"Error importing document: {str(e)}" if r in failed else r for r in results]
+            else:
+                if self.near_duplicates is not None:
+                    for entry in entries:
+                        self.near_duplicates.add_signatures(entry["doc_id"], entry["signatures"])
+        with self._names_lock:
+            for (_, name, _, _), result in zip(sources, results):
+                if result.startswith("doc_"):
+                    self.import_names.setdefault(result, set()).add(name)
+        if progress:
+            for position, result in enumerate(results):
+                if result.startswith("doc_"):
+                    progress(position, "indexed")
+        return results
+    
+    def _prepare_document(self, source, name, path=None, metadata=None, content_hash=None,
+                          progress=None, cancelled=None, claim=None):
+        """
+        Parse, chunk and embed a document into a backend writer.
+        
+        Text is extracted, chunked, embedded and written in batches as it
+        streams, so the stages overlap; progress reports them together once
+        the document is done, with "embedding_failed" in place of "embedded"
+        if the document couldn't be embedded.
+        
+        Args:
+            source (str or memoryview): File path or in-memory file contents
+            name (str): Display name
+            path (str, optional): File path to record
+            metadata (dict, optional): Facets for filtering retrieval
+            content_hash (str, optional): Precomputed SHA-256 of the contents
+            progress (callable, optional): Called with each completed stage
+            cancelled (callable, optional): Checked before each chunk batch;
+                returning True abandons the document
+            claim (callable, optional): Called with the document ID once the
+                contents are hashed, before the re-upload check
+        
+        Returns:
+            dict or str: Entry with "doc_id", the backend "writer" and the
+                near-duplicate "signatures", the existing document ID for a
+                re-upload, "Cancelled", or an error message
+        """
+        doc_type = self._sniff_type(source, name)
+        if doc_type is None:
+            file_ext = os.path.splitext(name)[1].lower() or "unknown"
+            return f"Error: Unsupported file format {file_ext}"
+        
+        content_hash = content_hash or self._hash_source(source)
+        doc_id = f"doc_{content_hash[:16]}"
+        if claim:
+            claim(doc_id)
+        
+        # Re-upload of a known file: nothing to parse or store, but its
+        # facets are added so filters on them find the document
+        if self.backend.has_document(doc_id):
+            if metadata:
+                self.backend.merge_metadata(doc_id, metadata)
+            return doc_id
+        
+        writer = self.backend.begin_document(doc_id, {
+            "content_hash": content_hash,
+            "path": path,
+            "name": name,
+            "type": doc_type,
+            "metadata": dict(metadata or {})
+        })
+        report = {"file": name, "page_seconds": [], "total_seconds": 0.0}
+        signatures = []  # (chunk_idx, signature, length) for near-duplicate clustering
+        embedded = True
+        try:
+            paragraphs = self._stream_paragraphs(source, doc_type, report, writer)
+            batch = []
+            chunk_count = 0
+            for chunk in self.chunker.iter_chunks(paragraphs):
+                batch.append(chunk)
+                if len(batch) == self.EMBED_BATCH_CHUNKS:
+                    if cancelled and cancelled():
+                        writer.discard()
+                        return "Cancelled"
+                    embedded = self._write_chunks(writer, batch, chunk_count, embedded, signatures)
+                    chunk_count += len(batch)
+                    batch = []
+            if cancelled and cancelled():
+                writer.discard()
+                return "Cancelled"
+            if batch:
+                embedded = self._write_chunks(writer, batch, chunk_count, embedded, signatures)
+        except Exception:
+            writer.discard()
+            raise
+        
+        self._record_extraction(doc_id, report)
+        if progress:
+            for stage in ("parsed", "chunked", "embedded" if embedded else "embedding_failed"):
+                progress(stage)
+        return {"doc_id": doc_id, "writer": writer, "signatures": signatures}
+    
+    def _stream_paragraphs(self, source, doc_type, report, writer):
+        """
+        Yield a document's paragraphs as its text is extracted.
+        
+        Each paragraph is also appended to the writer, and extraction time
+        is added to report["total_seconds"].
+        """
+        pieces = iter(self._iter_text(source, doc_type, report))
+        while True:
+            start_time = time.perf_counter()
+            piece = next(pieces, None)
+            report["total_seconds"] += time.perf_counter() - start_time
+            if piece is None:
+                return
+            for paragraph in piece.split('\n\n'):
+                writer.add_paragraph(paragraph)
+                yield paragraph
+    
+    def _write_chunks(self, writer, batch, first_idx, embedded, signatures):
+        """
+        Embed a batch of chunks and add it to a document writer.
+        
+        Args:
+            writer: Backend document writer
+            batch (list): (start, end, text) chunk tuples
+            first_idx (int): Index of the batch's first chunk
+            embedded (bool): Whether every earlier batch was embedded; once
+                one fails, the rest aren't embedded
+            signatures (list): Near-duplicate signatures to extend
+            
+        Returns:
+            bool: Whether this and every earlier batch was embedded
+        """
+        texts = [text for _, _, text in batch]
+        vectors = self._create_embeddings(writer.doc_id, texts) if embedded else None
+        writer.add_chunks(batch, vectors)
+        if self.near_duplicates is not None:
+            for chunk_idx, text in enumerate(texts, start=first_idx):
+                signature = self.near_duplicates.signature(text)
+                if signature is not None:
+                    signatures.append((chunk_idx, signature, len(text)))
+        return vectors is not None
+    
+    def has_document(self, doc_id):
+        """Check whether a document is stored."""
+        return self.backend.has_document(doc_id)
+    
+    def get_import_names(self, doc_id):
+        """
+        Get the names a document has been imported under.
+        
+        Documents are identified by content, so uploads of the same file
+        under different names (or a file and a web page with the same text)
+        share one document.
+        
+        Returns:
+            set: The stored record's name plus every name used since startup
+        """
+        record = self.backend.get_document(doc_id)
+        with self._names_lock:
+            names = set(self.import_names.get(doc_id, ()))
+        if record is not None:
+            names.add(record["name"])
+        return names
+    
+    def get_document_content(self, doc_id):
+        """Get document content by ID."""
+        return self.backend.get_content(doc_id)
+    
+    def get_chunk_text(self, doc_id, chunk_idx):
+        """Get the text of a single indexed chunk of a document."""
+        chunk = self.backend.get_chunk(doc_id, chunk_idx)
+        return chunk[0] if chunk else ""
+    
+    def get_relevant_context(self, query, doc_ids=None, max_tokens=1000, filters=None, mode=None):
+        """
+        Use RAG to retrieve the most relevant portions of imported documents.
+        
+        Matching chunks are ranked by score and packed best-first into
+        the max_tokens budget, each with a header naming its source document.
+        Only the text of chunks that may be selected is fetched.
+        Results are served from the query cache while the document set is
+        unchanged. A hybrid result missing a retriever (timed out or failed)
+        is returned but not cached, so the next query retries in full.
+        
+        Args:
+            query (str): Retrieval query
+            doc_ids (list, optional): Restrict retrieval to these documents
+            max_tokens (int): Token budget for the returned context
+            filters (dict, optional): Facet filters such as
+                {"grade": 3, "curriculum": "Common Core"}; a list of values
+                matches any of them
+            mode (str, optional): "lexical", "dense" or "hybrid"; defaults
+                to the manager's retrieval_mode
+            
+        Returns:
+            str: Packed context, or an empty string if nothing matches
+        """
+        mode = mode or self.retrieval_mode
+        if mode not in self.RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {mode}")
+        
+        generation = self.backend.get_generation()
+        cache_key = (
+            " ".join(query.lower().split()),
+            tuple(sorted(doc_ids)) if doc_ids else None,
+            max_tokens,
+            self._filters_key(filters),
+            mode
+        )
+        cached = self.query_cache.get(cache_key, generation)
+        if cached is not None:
+            return cached
+            
+        # None means every document, which backends can search without a filter
+        candidates = set(doc_ids) if doc_ids else None
+        if filters:
+            matches = self.backend.filter_documents(filters)
+            candidates = matches if candidates is None else candidates & matches
+        if candidates is not None and not candidates:
+            self.query_cache.put(cache_key, generation, "")
+            return ""
+        
+        degraded = False
+        if mode == "lexical":
+            hits, collapsed = self._ranked_search(self._lexical_search, query, candidates)
+        elif mode == "dense":
+            hits, collapsed = self._ranked_search(self._dense_search, query, candidates)
+        else:
+            hits, collapsed, degraded = self._hybrid_search(query, candidates)
+        self._record_collapsed(collapsed - hits.keys())
+        
+        ranked_chunks = []
+        names = {}
+        for (doc_id, chunk_idx), score in hits.items():
+            if doc_id not in names:
+                doc = self.backend.get_document(doc_id)
+                names[doc_id] = doc["name"] if doc else None
+            bounds = self.backend.get_chunk_bounds(doc_id, chunk_idx)
+            if names[doc_id] is None or bounds is None:
+                continue
+            start, end = bounds
+            ranked_chunks.append({
+                "doc_id": doc_id,
+                "source": names[doc_id],
+                "load_text": lambda doc_id=doc_id, chunk_idx=chunk_idx: self.get_chunk_text(doc_id, chunk_idx),
+                "start": start,
+                "end": end,
+                "score": score
+            })
+        
+        context = self.packer.pack(ranked_chunks, max_tokens)
+        if not degraded:
+            self.query_cache.put(cache_key, generation, context)
+        return context
+    
+    def get_retrieval_stats(self):
+        """Get per-retriever latency percentiles in milliseconds."""
+        stats = {}
+        for name, timings in self.retrieval_timings.items():
+            samples = sorted(timings)
+            if not samples:
+                stats[name] = {"count": 0}
+                continue
+            stats[name] = {
+                "count": len(samples),
+                "p50_ms": samples[len(samples) // 2] * 1000,
+                "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000
+            }
+        return stats
+    
+    def _lexical_search(self, query, candidates, limit=None):
+        """
+        Rank chunks with the inverted index.
+        
+        Args:
+            query (str): Retrieval query
+            candidates (set): Document IDs to search, or None for all
+            limit (int, optional): Keep only the top results
+            
+        Returns:
+            dict: (doc_id, chunk_idx) -> score
+        """
+        start = time.perf_counter()
+        keywords = [k for k in SegmentedIndex.tokenize(query) if len(k) > 3]
+        hits = self.backend.lexical_search(keywords, doc_ids=candidates, limit=limit)
+        self.retrieval_timings["lexical"].append(time.perf_counter() - start)
+        return hits
+    
+    def _dense_search(self, query, candidates, limit=None):
+        """
+        Rank chunks by cosine similarity between query and chunk embeddings.
+        
+        Args:
+            query (str): Retrieval query
+            candidates (set): Document IDs to search, or None for all
+            limit (int, optional): Keep only the top results
+            
+        Returns:
+            dict: (doc_id, chunk_idx) -> similarity
+        """
+        start = time.perf_counter()
+        query_vector = self.embedder.embed([query])[0]
+        limit = limit or self.candidate_pool_size
+        
+        top = []  # Min-heap of (similarity, doc_id, chunk_idx)
+        for doc_id, chunk_idx, vector in self.backend.iter_embeddings(candidates):
+            similarity = sum(q * v for q, v in zip(query_vector, vector))
+            if similarity <= 0:
+                continue
+            if len(top) < limit:
+                heapq.heappush(top, (similarity, doc_id, chunk_idx))
+            elif similarity > top[0][0]:
+                heapq.heapreplace(top, (similarity, doc_id, chunk_idx))
+        
+        self.retrieval_timings["dense"].append(time.perf_counter() - start)
+        return {(doc_id, chunk_idx): similarity for similarity, doc_id, chunk_idx in top}
+    
+    def _ranked_search(self, search, query, candidates):
+        """
+        Run one retriever and keep its top candidate_pool_size results.
+        
+        With near-duplicate detection, the retriever over-fetches by
+        DUPLICATE_OVERFETCH and each cluster is collapsed to its best chunk
+        before the results are cut to size, so duplicates don't crowd out
+        distinct chunks.
+        
+        Args:
+            search (callable): _lexical_search or _dense_search
+            query (str): Retrieval query
+            candidates (set): Document IDs to search, or None for all
+            
+        Returns:
+            tuple: (hits, collapsed) where collapsed is the set of chunk
+                keys dropped as near-duplicates
+        """
+        limit = self.candidate_pool_size
+        collapsed = set()
+        if self.near_duplicates is None:
+            return search(query, candidates, limit), collapsed
+        hits = self._collapse_near_duplicates(search(query, candidates, limit * self.DUPLICATE_OVERFETCH), collapsed)
+        if len(hits) > limit:
+            hits = dict(heapq.nlargest(limit, hits.items(), key=lambda item: item[1]))
+        return hits, collapsed
+    
+    def _hybrid_search(self, query, candidates):
+        """
+        Run lexical and dense retrieval in parallel and fuse their rankings.
+        
+        Each retriever contributes at most candidate_pool_size results,
+        collapsed to one chunk per near-duplicate cluster; clusters found by
+        both retrievers are collapsed again after fusion. A
+        retriever that misses retriever_timeout or raises is left out of the
+        fusion, so one slow or failing retriever can't hold up or break the
+        query; the result is then marked degraded. At most
+        MAX_PENDING_RETRIEVALS retriever tasks wait on the pool; beyond that
+        a retriever runs on the calling thread instead of queueing.
+        
+        Args:
+            query (str): Retrieval query
+            candidates (set): Document IDs to search, or None for all
+            
+        Returns:
+            tuple: (hits, collapsed, degraded) where hits maps (doc_id,
+                chunk_idx) to a reciprocal rank fusion score, collapsed is
+                the set of chunk keys dropped as near-duplicates and degraded
+                is True if a retriever's results are missing
+        """
+        retrievers = (("lexical", self._lexical_search), ("dense", self._dense_search))
+        futures = [
+            (name, self._submit_retrieval(self._ranked_search, search, query, candidates))
+            for name, search in retrievers
+        ]
+        
+        deadline = time.perf_counter() + self.retriever_timeout
+        fused = {}
+        collapsed = set()
+        degraded = False
+        for name, future in futures:
+            try:
+                hits, dropped = future.result(timeout=max(0, deadline - time.perf_counter()))
+            except FutureTimeoutError:
+                # Drop it from the queue if it hasn't started yet
+                future.cancel()
+                degraded = True
+                continue
+            except Exception as e:
+                print(f"Warning: {name} retrieval failed: {e}")
+                degraded = True
+                continue
+            collapsed |= dropped
+            ranked = sorted(hits.items(), key=lambda item: item[1], reverse=True)
+            for rank, (key, _) in enumerate(ranked, start=1):
+                fused[key] = fused.get(key, 0.0) + 1.0 / (self.RRF_K + rank)
+        return self._collapse_near_duplicates(fused, collapsed), collapsed, degraded
+    
+    def _submit_retrieval(self, search, *args):
+        """
+        Run a retriever on the retrieval pool, or inline if the pool is full.
+        
+        Returns:
+            Future: Resolves to the retriever's hits
+        """
+        if self._retrieval_slots.acquire(blocking=False):
+            future = self._retrieval_pool.submit(search, *args)
+            future.add_done_callback(lambda _: self._retrieval_slots.release())
+            return future
+        future = Future()
+        try:
+            future.set_result(search(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    
+    def _collapse_near_duplicates(self, hits, collapsed):
+        """
+        Keep only the best-scoring chunk of each near-duplicate cluster.
+        
+        Args:
+            hits (dict): (doc_id, chunk_idx) -> score
+            collapsed (set): Receives the keys of the chunks dropped
+            
+        Returns:
+            dict: Hits with at most one chunk per cluster
+        """
+        if self.near_duplicates is None or len(hits) < 2:
+            return hits
+        
+        best = {}  # Representative -> (score, key)
+        for key, score in hits.items():
+            representative = self.near_duplicates.representative_of(key)
+            if representative not in best or score > best[representative][0]:
+                best[representative] = (score, key)
+        if len(best) == len(hits):
+            return hits
+        
+        kept = {key: score for score, key in best.values()}
+        collapsed.update(key for key in hits if key not in kept)
+        return kept
+    
+    def _record_collapsed(self, collapsed):
+        """Add a query's collapsed near-duplicate chunks to the statistics."""
+        if not collapsed:
+            return
+        chars = sum(self.near_duplicates.lengths.get(key, 0) for key in collapsed)
+        with self._stats_lock:
+            self.duplicate_stats["collapsed_chunks"] += len(collapsed)
+            self.duplicate_stats["collapsed_chars"] += chars
+    
+    def get_duplicate_stats(self):
+        """
+        Get near-duplicate statistics.
+        
+        Returns:
+            dict: Index clustering stats plus the chunks and characters kept
+                out of retrieval results, or None if detection is disabled
+        """
+        if self.near_duplicates is None:
+            return None
+        with self._stats_lock:
+            return {**self.near_duplicates.get_stats(), **self.duplicate_stats}
+    
+    def _create_embeddings(self, doc_id, chunks):
+        """
+        Create embeddings for a document's chunks for dense retrieval.
+        
+        Failures are logged and leave the document out of dense retrieval
+        rather than failing the import.
+        
+        Returns:
+            list or None: One vector per chunk, or None on failure
+        """
+        try:
+            if self.embedding_cache is not None:
+                return self.embedding_cache.embed(self.embedder, chunks)
+            return self.embedder.embed(chunks)
+        except Exception as e:
+            print(f"Warning: Could not create embeddings for {doc_id}: {e}")
+            return None
+    
+    def _filters_key(self, filters):
+        """Build a hashable, order-independent key for facet filters."""
+        if not filters:
+            return None
+        key = []
+        for facet, values in sorted(filters.items()):
+            if values in (None, ""):
+                continue
+            if isinstance(values, (str, int)):
+                values = [values]
+            key.append((facet, tuple(sorted(FacetIndex.normalize(value) for value in values))))
+        return tuple(key) or None
+    
+    def get_cache_stats(self):
+        """Get hit-rate and size statistics for the retrieval cache."""
+        return self.query_cache.get_stats()
+    
+    def get_document_list(self):
+        """Get a list of all imported documents."""
+        return [
+            {
+                "doc_id": doc_id,
+                "name": doc_info["name"],
+                "type": doc_info.get("type", "unknown"),
+                "size": doc_info["size"],
+                "metadata": doc_info.get("metadata", {})
+            }
+            for doc_id, doc_info in self.backend.list_documents()
+        ]
+    
+    def get_memory_usage(self):
+        """
+        Get resident memory per document, largest first.
+        
+        Returns:
+            list: Dicts with "doc_id", "name" and "resident_bytes"
+        """
+        usage = self.backend.get_resident_bytes()
+        names = {doc_id: record["name"] for doc_id, record in self.backend.list_documents()}
+        return sorted(
+            ({"doc_id": doc_id, "name": names.get(doc_id), "resident_bytes": size} for doc_id, size in usage.items()),
+            key=lambda item: item["resident_bytes"],
+            reverse=True
+        )
+    
+    def remove_document(self, doc_id):
+        """Remove a document by ID."""
+        if self.near_duplicates is not None:
+            self.near_duplicates.remove_document(doc_id)
+        with self._names_lock:
+            self.import_names.pop(doc_id, None)
+        return self.backend.remove_document(doc_id)
+    
+    def _hash_source(self, source):
+        """
+        Compute the SHA-256 hash of a file or buffer.
+        
+        Files are hashed in fixed-size reads rather than loaded at once;
+        buffers are hashed in place.
+        
+        Args:
+            source (str or memoryview): File path or in-memory file contents
+            
+        Returns:
+            str: Hex digest of the contents
+        """
+        if isinstance(source, memoryview):
+            return hashlib.sha256(source).hexdigest()
+        hasher = hashlib.sha256()
+        with open(source, 'rb') as f:
+            for data in iter(lambda: f.read(self.HASH_READ_SIZE), b''):
+                hasher.update(data)
+        return hasher.hexdigest()
+    
+    def _sniff_type(self, source, name):
+        """
+        Detect a document's format from its leading bytes.
+        
+        PDF and Word documents are recognized by content whatever their
+        name. Text is accepted only if the name has one of TEXT_EXTENSIONS
+        or is the URL of a web page.
+        
+        Args:
+            source (str or memoryview): File path or in-memory file contents
+            name (str): Display name, such as the uploaded file name
+            
+        Returns:
+            str or None: "pdf", "docx" or "txt", or None if unsupported
+        """
+        with _open_binary(source) as f:
+            head = f.read(4096)
+        
+        if b"%PDF-" in head[:1024]:
+            return "pdf"
+        if head.startswith(b"PK\x03\x04"):
+            try:
+                with _open_binary(source) as f, zipfile.ZipFile(f) as archive:
+                    return "docx" if "word/document.xml" in archive.namelist() else None
+            except zipfile.BadZipFile:
+                return None
+        if b"\x00" in head:
+            return None
+        if urlsplit(name).scheme not in ("http", "https"):
+            if os.path.splitext(name)[1].lower() not in self.TEXT_EXTENSIONS:
+                return None
+        try:
+            head.decode("utf-8")
+        except UnicodeDecodeError as e:
+            # A multi-byte character cut off by the read is still valid text
+            if e.start < len(head) - 3:
+                return None
+        return "txt"
+    
+    def get_extraction_report(self, doc_id):
+        """
+        Get text extraction timings for a recently imported document.
+        
+        Returns:
+            dict or None: File name, per-page extraction seconds (PDFs only),
+                total seconds and whether pages were extracted in parallel
+        """
+        return self.extraction_reports.get(doc_id)
+    
+    def _record_extraction(self, doc_id, report):
+        """Keep an extraction report, dropping the oldest beyond the limit."""
+        with self._reports_lock:
+            self.extraction_reports[doc_id] = report
+            while len(self.extraction_reports) > self.MAX_EXTRACTION_REPORTS:
+                self.extraction_reports.popitem(last=False)
+    
+    def _iter_text(self, source, doc_type, report):
+        """Yield a document's text in pieces, by detected format."""
+        if doc_type == "txt":
+            return self._iter_text_file(source)
+        if doc_type == "pdf":
+            return self._extract_text_from_pdf(source, report)
+        return self._extract_text_from_docx(source)
+    
+    def _iter_text_file(self, source):
+        """
+        Yield the paragraphs of UTF-8 text using fixed-size reads.
+        
+        Newlines are normalized as in text-mode reads.
+        """
+        with io.TextIOWrapper(_open_binary(source), encoding='utf-8') as f:
+            pending = ""
+            for data in iter(lambda: f.read(self.HASH_READ_SIZE), ''):
+                pending += data
+                pieces = pending.split('\n\n')
+                pending = pieces.pop()
+                yield from pieces
+            yield pending
+    
+    def _extract_text_from_pdf(self, source, report):
+        """
+        Yield the text of a PDF page by page.
+        
+        Pages are read one at a time rather than building the whole
+        document's text first. PDF files with at least PDF_PARALLEL_MIN_PAGES
+        pages are split into page ranges that worker processes extract
+        concurrently; results are still yielded in page order, with a bounded
+        number of ranges in flight. In-memory PDFs are extracted in this
+        process to avoid copying the buffer to workers. Per-page timings are
+        added to `report`.
+        """
+        if PdfReader is None:
+            raise ImportError("PDF import requires the pypdf package (pip install pypdf)")
+        
+        with _open_binary(source) as f:
+            num_pages = len(PdfReader(f).pages)
+        report["pages"] = num_pages
+        report["parallel"] = (
+            isinstance(source, str)
+            and self.pdf_workers > 1
+            and num_pages >= self.PDF_PARALLEL_MIN_PAGES
+        )
+        
+        if not report["parallel"]:
+            for start in range(0, num_pages, self.PDF_PAGES_PER_TASK):
+                for text, seconds in _extract_pdf_pages(source, start, min(num_pages, start + self.PDF_PAGES_PER_TASK)):
+                    report["page_seconds"].append(seconds)
+                    yield text
+            return
+        
+        ranges = deque(
+            (start, min(num_pages, start + self.PDF_PAGES_PER_TASK))
+            for start in range(0, num_pages, self.PDF_PAGES_PER_TASK)
+        )
+        with ProcessPoolExecutor(max_workers=self.pdf_workers) as pool:
+            in_flight = deque()
+            while ranges or in_flight:
+                while ranges and len(in_flight) < self.pdf_workers * 2:
+                    in_flight.append(pool.submit(_extract_pdf_pages, source, *ranges.popleft()))
+                for text, seconds in in_flight.popleft().result():
+                    report["page_seconds"].append(seconds)
+                    yield text
+    
+    def _extract_text_from_docx(self, source):
+        """
+        Yield the paragraphs of a Word (.docx) document.
+        
+        word/document.xml is parsed incrementally; each paragraph is cleared
+        once its text is yielded and each finished child of the body is
+        detached, so the full XML tree is never built.
+        """
+        paragraph_tag = f"{{{WORD_NAMESPACE}}}p"
+        text_tag = f"{{{WORD_NAMESPACE}}}t"
+        tab_tag = f"{{{WORD_NAMESPACE}}}tab"
+        break_tag = f"{{{WORD_NAMESPACE}}}br"
+        
+        with _open_binary(source) as f, zipfile.ZipFile(f) as archive:
+            with archive.open("word/document.xml") as xml_file:
+                parts = []
+                # Open elements from the root; finished children of <w:body>
+                # are detached so the parsed tree doesn't grow with the document
+                open_elements = []
+                for event, element in ElementTree.iterparse(xml_file, events=("start", "end")):
+                    if event == "start":
+                        open_elements.append(element)
+                        if element.tag == paragraph_tag:
+                            parts = []
+                        continue
+                    open_elements.pop()
+                    if len(open_elements) == 2:
+                        open_elements[-1].remove(element)
+                    if element.tag == text_tag:
+                        parts.append(element.text or "")
+                    elif element.tag == tab_tag:
+                        parts.append("\t")
+                    elif element.tag == break_tag:
+                        parts.append("\n")
+                    elif element.tag == paragraph_tag:
+                        text = "".join(parts).strip()
+                        if text:
+                            yield text
+                        element.clear()
+
+class _BufferReader(io.RawIOBase):
+    """Seekable, read-only file object over a memoryview that never copies the buffer."""
+    
+    def __init__(self, buffer):
+        self._view = buffer
+        self._position = 0
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def readinto(self, target):
+        count = max(0, min(len(target), len(self._view) - self._position))
+        target[:count] = self._view[self._position:self._position + count]
+        self._position += count
+        return count
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._position = max(0, offset)
+        return self._position
+    
+    def tell(self):
+        return self._position
+
+def _open_binary(source):
+    """Open a file path, or wrap a memoryview, as a binary file object."""
+    if isinstance(source, memoryview):
+        return io.BufferedReader(_BufferReader(source))
+    return open(source, 'rb')
+
+def _extract_pdf_pages(source, start, stop):
+    """
+    Extract text from a range of PDF pages.
+    
+    Runs in worker processes for large files, so it opens its own reader and
+    only resolves the objects of the pages it extracts.
+    
+    Args:
+        source (str or memoryview): Path to the PDF file or its contents
+        start (int): First page index
+        stop (int): Page index to stop before
+        
+    Returns:
+        list: (page text, extraction seconds) for each page
+    """
+    results = []
+    with _open_binary(source) as f:
+        reader = PdfReader(f)
+        for page_no in range(start, stop):
+            page_start = time.perf_counter()
+            text = reader.pages[page_no].extract_text() or ""
+            results.append((text.strip(), time.perf_counter() - page_start))
+    return results
+
+class SharedDocumentLibrary:
+    """
+    Process-wide document library shared by every user session.
+    
+    All sessions import into one DocumentManager, so a file uploaded by many
+    sessions is stored once (documents are identified by content hash) and
+    later uploads skip parsing. Documents are reference counted: each session view holding a
+    document counts once, published documents are held by the library
+    itself, and a document is removed when its last reference is released.
+    
+    Imports run concurrently; the lock only guards the reference counts. An
+    import takes its reference as soon as the file is hashed, before the
+    content-hash lookup and parsing, so a concurrent release can't remove
+    the document mid-import. An import of a document that is being removed
+    waits for the removal to finish, then imports it again.
+    """
+    
+    def __init__(self, document_manager):
+        """
+        Initialize the library.
+        
+        Args:
+            document_manager: DocumentManager that stores the documents
+        """
+        self.manager = document_manager
+        self.refcounts = {}  # Doc ID -> number of holders
+        self.published = set()  # Doc IDs visible to every session
+        self._removing = {}  # Doc ID -> Event set once its removal finishes
+        self._lock = threading.Lock()  # Guards refcounts, published and _removing
+    
+    def publish(self, file_path, metadata=None):
+        """
+        Import a document into the shared corpus visible to every session.
+        
+        Returns:
+            str: Document ID or error message
+        """
+        doc_id = self.import_document(file_path, metadata)
+        if doc_id.startswith("Error"):
+            return doc_id
+        with self._lock:
+            republished = doc_id in self.published
+            self.published.add(doc_id)
+        if republished:
+            # The library holds one reference however often it publishes
+            self.release(doc_id)
+        return doc_id
+    
+    def unpublish(self, doc_id):
+        """Remove a document from the shared corpus and drop the library's reference."""
+        with self._lock:
+            if doc_id not in self.published:
+                return False
+            self.published.discard(doc_id)
+        self.release(doc_id)
+        return True
+    
+    def import_document(self, file_path, metadata=None):
+        """
+        Import a document and take a reference to it.
+        
+        Returns:
+            str: Document ID or error message
+        """
+        return self._import(lambda claim: [self.manager.import_document(file_path, metadata, claim=claim)])[0]
+    
+    def import_documents(self, file_paths, metadata=None, progress=None, cancelled=None):
+        """
+        Import several documents and take a reference to each.
+        
+        Returns:
+            list: Document ID, error message or "Cancelled" for each path, in order
+        """
+        return self._import(
+            lambda claim: self.manager.import_documents(file_paths, metadata, progress, cancelled, claim=claim)
+        )
+    
+    def import_bytes(self, data, name=None, metadata=None):
+        """
+        Import a document from an in-memory buffer and take a reference to it.
+        
+        Returns:
+            str: Document ID or error message
+        """
+        return self._import(lambda claim: [self.manager.import_bytes(data, name, metadata, claim=claim)])[0]
+    
+    def release(self, doc_id):
+        """Drop one reference to a document, removing it when unused."""
+        with self._lock:
+            if doc_id not in self.refcounts:
+                return
+            self.refcounts[doc_id] -= 1
+            if self.refcounts[doc_id] > 0:
+                return
+            del self.refcounts[doc_id]
+            removed = self._removing[doc_id] = threading.Event()
+        try:
+            self.manager.remove_document(doc_id)
+        finally:
+            with self._lock:
+                del self._removing[doc_id]
+            removed.set()
+    
+    def get_published_ids(self):
+        """Get the IDs of documents in the shared corpus."""
+        with self._lock:
+            return set(self.published)
+    
+    def get_stats(self):
+        """Get the number of unique documents and the references held to them."""
+        with self._lock:
+            return {
+                "documents": len(self.refcounts),
+                "references": sum(self.refcounts.values()),
+                "published": len(self.published)
+            }
+    
+    def _import(self, run):
+        """
+        Run a manager import, holding a reference to each document from the
+        moment it is hashed.
+        
+        Args:
+            run (callable): Runs the import given a claim callback and
+                returns its results as a list
+            
+        Returns:
+            list: The import's results; references claimed for documents
+                that failed or were cancelled are released
+        """
+        claimed = []
+        
+        def claim(doc_id):
+            self._add_reference(doc_id)
+            claimed.append(doc_id)
+        
+        results = []
+        try:
+            results = run(claim)
+        finally:
+            imported = Counter(result for result in results if result.startswith("doc_"))
+            for doc_id in claimed:
+                if imported[doc_id]:
+                    imported[doc_id] -= 1
+                else:
+                    self.release(doc_id)
+        return results
+    
+    def _add_reference(self, doc_id):
+        """Count a reference to a document, waiting out a removal in progress."""
+        while True:
+            with self._lock:
+                removing = self._removing.get(doc_id)
+                if removing is None:
+                    self.refcounts[doc_id] = self.refcounts.get(doc_id, 0) + 1
+                    return
+            removing.wait()
+
+class DocumentLibraryView:
+    """
+    One session's view of a SharedDocumentLibrary.
+    
+    Offers the DocumentManager methods the UI layers use. The session sees the
+    library's published documents plus its own uploads, and its uploads stay
+    invisible to other sessions even when the underlying document is shared.
+    References are released when the view is closed or garbage collected.
+    """
+    
+    def __init__(self, library):
+        """
+        Initialize a view on a shared library.
+        
+        Args:
+            library: SharedDocumentLibrary instance
+        """
+        self.library = library
+        self.private_doc_ids = set()
+        self._finalizer = weakref.finalize(self, _release_documents, library, self.private_doc_ids)
+    
+    def import_document(self, file_path, metadata=None):
+        """Import a private document for this session."""
+        return self._track(self.library.import_document(file_path, metadata))
+    
+    def import_documents(self, file_paths, metadata=None, progress=None, cancelled=None):
+        """Import several private documents for this session."""
+        return [
+            self._track(doc_id)
+            for doc_id in self.library.import_documents(file_paths, metadata, progress, cancelled)
+        ]
+    
+    def import_bytes(self, data, name=None, metadata=None):
+        """Import a private document for this session from an in-memory buffer."""
+        return self._track(self.library.import_bytes(data, name, metadata))
+    
+    @property
+    def backend(self):
+        """The shared manager's storage backend."""
+        return self.library.manager.backend
+    
+    def visible_doc_ids(self):
+        """Get the IDs of all documents this session can see."""
+        return self.library.get_published_ids() | self.private_doc_ids
+    
+    def get_relevant_context(self, query, doc_ids=None, max_tokens=1000, filters=None, mode=None):
+        """Retrieve context from the documents visible to this session."""
+        visible = self.visible_doc_ids()
+        if doc_ids:
+            visible &= set(doc_ids)
+        if not visible:
+            return ""
+        return self.library.manager.get_relevant_context(
+            query, doc_ids=sorted(visible), max_tokens=max_tokens, filters=filters, mode=mode
+        )
+    
+    def has_document(self, doc_id):
+        """Check whether a document is visible to this session."""
+        return doc_id in self.visible_doc_ids()
+    
+    def get_import_names(self, doc_id):
+        """Get the names a document has been imported under, by any session."""
+        return self.library.manager.get_import_names(doc_id)
+    
+    def get_document_content(self, doc_id):
+        """Get document content by ID if visible to this session."""
+        if doc_id not in self.visible_doc_ids():
+            return ""
+        return self.library.manager.get_document_content(doc_id)
+    
+    def get_document_list(self):
+        """Get a list of the documents visible to this session."""
+        visible = self.visible_doc_ids()
+        return [doc for doc in self.library.manager.get_document_list() if doc["doc_id"] in visible]
+    
+    def remove_document(self, doc_id):
+        """Remove one of this session's uploads from its view."""
+        if doc_id not in self.private_doc_ids:
+            return False
+        self.private_doc_ids.discard(doc_id)
+        self.library.release(doc_id)
+        return True
+    
+    def close(self):
+        """Release all of this session's document references."""
+        self._finalizer()
+    
+    def _track(self, doc_id):
+        """Record an imported document, keeping one reference per session."""
+        if not doc_id.startswith("doc_"):
+            return doc_id
+        if doc_id in self.private_doc_ids:
+            self.library.release(doc_id)
+        else:
+            self.private_doc_ids.add(doc_id)
+        return doc_id
+
+def _release_documents(library, doc_ids):
+    """Release a closed view's references (kept outside the class for weakref.finalize)."""
+    for doc_id in list(doc_ids):
+        library.release(doc_id)
+    doc_ids.clear()
+
+class IngestionBatch:
+    """
+    Handle for a set of files submitted to an IngestionService.
+    
+    Results are filled in as files finish. Cancelling skips files that have
+    not started yet and abandons files being imported at their next chunk
+    batch.
+    """
+    
+    def __init__(self, file_paths, metadata=None):
+        """
+        Initialize a batch.
+        
+        Args:
+            file_paths (list): Paths to the document files
+            metadata (dict, optional): Facets applied to every document
+        """
+        self.file_paths = list(file_paths)
+        self.metadata = metadata
+        self.results = {}  # Path -> document ID, error message or "Cancelled"
+        self.completed = 0
+        self._cancelled = threading.Event()
+        self._finished = threading.Event()
+        self._lock = threading.Lock()
+        if not self.file_paths:
+            self._finished.set()
+    
+    def cancel(self):
+        """Stop importing the batch's unfinished files."""
+        self._cancelled.set()
+    
+    def is_cancelled(self):
+        """Check whether the batch was cancelled."""
+        return self._cancelled.is_set()
+    
+    def is_done(self):
+        """Check whether every file has finished or been cancelled."""
+        return self._finished.is_set()
+    
+    def wait(self, timeout=None):
+        """
+        Wait for every file to finish or be cancelled.
+        
+        Returns:
+            bool: True if the batch finished within the timeout
+        """
+        return self._finished.wait(timeout)
+    
+    def get_progress(self):
+        """Get (finished files, total files)."""
+        with self._lock:
+            return self.completed, len(self.file_paths)
+    
+    def _finish(self, file_path, result):
+        """Record one file's result; returns the number of finished files."""
+        with self._lock:
+            self.results[file_path] = result
+            self.completed += 1
+            completed = self.completed
+        if completed == len(self.file_paths):
+            self._finished.set()
+        return completed
+
+class IngestionService:
+    """
+    Imports documents on background threads so the UI stays responsive.
+    
+    Files wait in a bounded work queue, fed by a background thread per
+    batch so submitting hundreds of files never blocks the caller, and a
+    pool of worker threads imports them one file at a time. Each file
+    reports "parsed", "chunked", "embedded" (or "embedding_failed", when
+    the document is imported without dense retrieval) and "indexed"
+    progress events, followed by "done", "failed" or "cancelled".
+    
+    Events are queued rather than delivered on worker threads, in a bounded
+    queue that drops its oldest events when nobody polls; each batch keeps
+    its files' final results regardless. Tk widgets
+    must only be touched from the UI thread, so a Tk window polls with
+    `root.after` and passes each event's status text to its status bar:
+    
+        def poll_ingestion():
+            for event in service.poll_events():
+                status_var.set(IngestionService.format_event(event))
+            root.after(100, poll_ingestion)
+    """
+    
+    def __init__(self, document_manager, workers=4, max_queue=64, max_events=1000):
+        """
+        Initialize the service and start its worker threads.
+        
+        Args:
+            document_manager: DocumentManager (or DocumentLibraryView) that
+                imports the files
+            workers (int): Number of worker threads
+            max_queue (int): Maximum files waiting in the work queue
+            max_events (int): Maximum progress events waiting to be polled
+        """
+        self.manager = document_manager
+        self.tasks = queue.Queue(maxsize=max_queue)
+        self.events = queue.Queue(maxsize=max_events)
+        self.dropped_events = 0
+        self._lock = threading.Lock()
+        self._feeders = []  # Feed threads still moving files into the work queue
+        self._closed = False
+        self._workers = [
+            threading.Thread(target=self._work, name=f"ingestion-{n}", daemon=True)
+            for n in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+    
+    def submit(self, file_paths, metadata=None):
+        """
+        Queue files for import.
+        
+        Args:
+            file_paths (list): Paths to the document files
+            metadata (dict, optional): Facets applied to every document
+            
+        Returns:
+            IngestionBatch: Handle for tracking or cancelling the batch
+            
+        Raises:
+            RuntimeError: If the service has been shut down
+        """
+        batch = IngestionBatch(file_paths, metadata)
+        feeder = threading.Thread(target=self._feed, args=(batch,), name="ingestion-feed", daemon=True)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Cannot submit files after shutdown")
+            self._feeders.append(feeder)
+            feeder.start()
+        return batch
+    
+    def poll_events(self, limit=100):
+        """
+        Take pending progress events without blocking.
+        
+        Args:
+            limit (int): Maximum events to return
+            
+        Returns:
+            list: Event dicts with "path", "stage", "completed" and "total",
+                plus "result" once a file has finished
+        """
+        events = []
+        while len(events) < limit:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                break
+        return events
+    
+    @staticmethod
+    def format_event(event):
+        """Describe a progress event for a status bar."""
+        name = os.path.basename(event["path"])
+        counter = f"[{event['completed']}/{event['total']}]"
+        if event["stage"] == "failed":
+            return f"{counter} {name}: {event['result']}"
+        if event["stage"] == "embedding_failed":
+            return f"{counter} {name}: embedding failed, lexical search only"
+        return f"{counter} {name}: {event['stage']}"
+    
+    def shutdown(self, wait=True):
+        """
+        Stop the worker threads once every submitted file is handled.
+        
+        The shutdown sentinels are queued only after every batch's feed
+        thread has queued all of its files, so no file is left behind them.
+        
+        Args:
+            wait (bool): Whether to wait for the workers to exit
+        """
+        with self._lock:
+            closed, self._closed = self._closed, True
+            feeders = list(self._feeders)
+        if not closed:
+            if wait:
+                self._stop_workers(feeders)
+            else:
+                threading.Thread(
+                    target=self._stop_workers, args=(feeders,), name="ingestion-shutdown", daemon=True
+                ).start()
+        if wait:
+            for worker in self._workers:
+                worker.join()
+    
+    def _stop_workers(self, feeders):
+        """Queue a shutdown sentinel per worker once the feed threads are done."""
+        for feeder in feeders:
+            feeder.join()
+        for _ in self._workers:
+            self.tasks.put(None)
+    
+    def _feed(self, batch):
+        """Move a batch's files into the bounded work queue."""
+        try:
+            for file_path in batch.file_paths:
+                self.tasks.put((batch, file_path))
+        finally:
+            with self._lock:
+                self._feeders.remove(threading.current_thread())
+    
+    def _work(self):
+        """Import queued files until a shutdown sentinel arrives."""
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+            batch, file_path = task
+            
+            if batch.is_cancelled():
+                completed = batch._finish(file_path, "Cancelled")
+                self._emit(batch, file_path, "cancelled", completed, "Cancelled")
+                continue
+            
+            completed = batch.completed
+            progress = lambda position, stage: self._emit(batch, file_path, stage, completed)
+            try:
+                result = self.manager.import_documents(
+                    [file_path], batch.metadata, progress, batch.is_cancelled
+                )[0]
+            except Exception as e:
+                result = f"Error importing document: {str(e)}"
+            
+            completed = batch._finish(file_path, result)
+            if result == "Cancelled":
+                stage = "cancelled"
+            else:
+                stage = "failed" if result.startswith("Error") else "done"
+            self._emit(batch, file_path, stage, completed, result)
+    
+    def _emit(self, batch, file_path, stage, completed, result=None):
+        """Queue a progress event, dropping the oldest one if the queue is full."""
+        event = {"path": file_path, "stage": stage, "completed": completed, "total": len(batch.file_paths)}
+        if result is not None:
+            event["result"] = result
+        while True:
+            try:
+                self.events.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self.events.get_nowait()
+                except queue.Empty:
+                    continue
+                with self._lock:
+                    self.dropped_events += 1
+
+class _HTMLTextExtractor(HTMLParser):
+    """Collects the visible text of an HTML page as paragraphs."""
+    
+    BLOCK_TAGS = {"p", "div", "br", "li", "tr", "section", "article", "h1", "h2", "h3", "h4", "h5", "h6"}
+    SKIP_TAGS = {"script", "style", "noscript", "head"}
+    
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.paragraphs = []
+        self._words = []
+        self._skip_depth = 0
+    
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in self.BLOCK_TAGS:
+            self._end_paragraph()
+    
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in self.BLOCK_TAGS:
+            self._end_paragraph()
+    
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self._words.extend(data.split())
+    
+    def close(self):
+        super().close()
+        self._end_paragraph()
+    
+    def _end_paragraph(self):
+        if self._words:
+            self.paragraphs.append(" ".join(self._words))
+            self._words = []
+
+class URLIngester:
+    """
+    Fetches web pages concurrently and keeps them in sync with the documents.
+    
+    Requests share keep-alive connections from a pool per host, and a
+    semaphore per host caps how many requests are in flight to any one
+    server. Each page's ETag and Last-Modified headers are stored, so a
+    re-sync sends conditional requests: pages answering 304 Not Modified
+    are skipped without downloading or parsing, and only changed pages are
+    imported again, replacing their previous document. Responses larger
+    than MAX_RESPONSE_BYTES are rejected.
+    
+    Works with a DocumentManager or a DocumentLibraryView.
+    """
+    
+    MAX_REDIRECTS = 5
+    READ_SIZE = 64 * 1024
+    MAX_RESPONSE_BYTES = 32 * 1024 * 1024
+    USER_AGENT = "LessonPlanGenerator/1.0"
+    
+    def __init__(self, document_manager, max_workers=16, max_per_host=4, timeout=10.0, state_path=None):
+        """
+        Initialize the ingester.
+        
+        Args:
+            document_manager: DocumentManager or DocumentLibraryView that
+                imports the pages
+            max_workers (int): Maximum pages fetched at once
+            max_per_host (int): Maximum requests in flight to one host
+            timeout (float): Socket timeout in seconds
+            state_path (str, optional): JSON file keeping validators across runs
+        """
+        self.manager = document_manager
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.state_path = state_path
+        self.pages = {}  # URL -> {"doc_id", "etag", "last_modified"}
+        self.stats = {"requests": 0, "not_modified": 0, "connections_opened": 0}
+        self._idle = {}  # (scheme, host, port) -> idle connections
+        self._host_limits = {}  # (scheme, host, port) -> BoundedSemaphore
+        self._lock = threading.Lock()
+        
+        if state_path and os.path.exists(state_path):
+            with open(state_path, 'r') as f:
+                self.pages = json.load(f)
+    
+    def sync(self, urls, metadata=None):
+        """
+        Fetch URLs concurrently, importing new and changed pages.
+        
+        Args:
+            urls (list): Page URLs
+            metadata (dict, optional): Facets applied to every imported page
+            
+        Returns:
+            dict: URL -> {"status", "doc_id"} where status is "new",
+                "changed", "unchanged" or an error message; a page that
+                fails doesn't stop the others
+        """
+        urls = list(dict.fromkeys(urls))
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="url-ingest") as pool:
+                results = dict(zip(urls, pool.map(lambda url: self._sync_page_or_error(url, metadata), urls)))
+        finally:
+            self._save_state()
+        return results
+    
+    def forget(self, url):
+        """
+        Stop tracking a URL and remove its document.
+        
+        Returns:
+            bool: True if the URL was tracked
+        """
+        with self._lock:
+            page = self.pages.pop(url, None)
+        if page is None:
+            return False
+        self._remove_if_unused(page.get("doc_id"))
+        self._save_state()
+        return True
+    
+    def close(self):
+        """Close all pooled connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+    
+    def _sync_page_or_error(self, url, metadata):
+        """Sync one page, reporting an unexpected failure as its status."""
+        try:
+            return self._sync_page(url, metadata)
+        except Exception as e:
+            with self._lock:
+                page = self.pages.get(url) or {}
+            return {"status": f"Error syncing page: {str(e)}", "doc_id": page.get("doc_id")}
+    
+    def _sync_page(self, url, metadata):
+        """Fetch one page conditionally and import it if it changed."""
+        with self._lock:
+            page = dict(self.pages.get(url) or {})
+        
+        headers = {}
+        if page.get("doc_id") and self.manager.has_document(page["doc_id"]):
+            if page.get("etag"):
+                headers["If-None-Match"] = page["etag"]
+            if page.get("last_modified"):
+                headers["If-Modified-Since"] = page["last_modified"]
+        
+        try:
+            status, response_headers, body = self._fetch(url, headers)
+        except Exception as e:
+            return {"status": f"Error fetching page: {str(e)}", "doc_id": page.get("doc_id")}
+        
+        if status == 304:
+            return {"status": "unchanged", "doc_id": page["doc_id"]}
+        if status != 200:
+            return {"status": f"Error fetching page: HTTP {status}", "doc_id": page.get("doc_id")}
+        
+        data = self._page_text(response_headers, body)
+        doc_id = self.manager.import_bytes(data, url, metadata)
+        if doc_id.startswith("Error"):
+            return {"status": doc_id, "doc_id": page.get("doc_id")}
+        
+        previous = page.get("doc_id")
+        with self._lock:
+            self.pages[url] = {
+                "doc_id": doc_id,
+                "etag": response_headers.get("etag"),
+                "last_modified": response_headers.get("last-modified")
+            }
+        if previous and previous != doc_id:
+            self._remove_if_unused(previous)
+        
+        if previous is None:
+            return {"status": "new", "doc_id": doc_id}
+        return {"status": "changed" if previous != doc_id else "unchanged", "doc_id": doc_id}
+    
+    def _fetch(self, url, headers):
+        """
+        GET a URL over a pooled connection, following redirects.
+        
+        Returns:
+            tuple: (status code, lower-cased response headers, body bytes)
+        """
+        for _ in range(self.MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            if parts.scheme not in ("http", "https"):
+                raise ValueError(f"Unsupported URL scheme {parts.scheme!r}")
+            key = (parts.scheme, parts.hostname, parts.port)
+            target = parts.path or "/"
+            if parts.query:
+                target += "?" + parts.query
+            request_headers = {"User-Agent": self.USER_AGENT, "Accept-Encoding": "identity", **headers}
+            
+            with self._host_limit(key):
+                status, response_headers, body = self._request(key, target, request_headers)
+            
+            if status in (301, 302, 303, 307, 308) and "location" in response_headers:
+                url = urljoin(url, response_headers["location"])
+                continue
+            return status, response_headers, body
+        raise ValueError("Too many redirects")
+    
+    def _request(self, key, target, headers):
+        """Send one request, retrying once if a reused connection was dropped."""
+        with self._lock:
+            self.stats["requests"] += 1
+        for attempt in range(2):
+            connection, reused = self._acquire(key)
+            try:
+                connection.request("GET", target, headers=headers)
+                response = connection.getresponse()
+                length = response.getheader("content-length")
+                if length and length.isdigit() and int(length) > self.MAX_RESPONSE_BYTES:
+                    raise ValueError(f"Response larger than {self.MAX_RESPONSE_BYTES} bytes")
+                body = bytearray()
+                for data in iter(lambda: response.read(self.READ_SIZE), b''):
+                    body += data
+                    if len(body) > self.MAX_RESPONSE_BYTES:
+                        raise ValueError(f"Response larger than {self.MAX_RESPONSE_BYTES} bytes")
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            except Exception:
+                connection.close()
+                raise
+            
+            response_headers = {name.lower(): value for name, value in response.getheaders()}
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(key, connection)
+            if response.status == 304:
+                with self._lock:
+                    self.stats["not_modified"] += 1
+            return response.status, response_headers, body
+    
+    def _host_limit(self, key):
+        """Get the semaphore capping requests to one host."""
+        with self._lock:
+            if key not in self._host_limits:
+                self._host_limits[key] = threading.BoundedSemaphore(self.max_per_host)
+            return self._host_limits[key]
+    
+    def _acquire(self, key):
+        """
+        Take an idle connection for a host, or open a new one.
+        
+        Returns:
+            tuple: (connection, whether it was reused)
+        """
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+            self.stats["connections_opened"] += 1
+        scheme, host, port = key
+        connection_class = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        return connection_class(host, port, timeout=self.timeout), False
+    
+    def _release(self, key, connection):
+        """Return a connection to its host's idle pool."""
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_per_host:
+                idle.append(connection)
+                return
+        connection.close()
+    
+    def _page_text(self, headers, body):
+        """Convert an HTML response to plain text paragraphs; pass other content through."""
+        content_type = headers.get("content-type", "")
+        if "html" not in content_type.lower():
+            return body
+        
+        charset = "utf-8"
+        match = re.search(r'charset=([\w-]+)', content_type, re.IGNORECASE)
+        if match:
+            charset = match.group(1)
+        try:
+            text = body.decode(charset, errors='replace')
+        except LookupError:
+            # Unknown charset declared; most such pages are UTF-8 anyway
+            text = body.decode('utf-8', errors='replace')
+        extractor = _HTMLTextExtractor()
+        extractor.feed(text)
+        extractor.close()
+        return "\n\n".join(extractor.paragraphs).encode('utf-8')
+    
+    def _remove_if_unused(self, doc_id):
+        """
+        Remove a page's old document unless something else still uses it.
+        
+        The document is kept if another tracked URL points to it, or if it
+        was also imported under a name that isn't a web page URL, such as a
+        file upload with the same content.
+        """
+        with self._lock:
+            if any(page.get("doc_id") == doc_id for page in self.pages.values()):
+                return
+        names = self.manager.get_import_names(doc_id)
+        if any(urlsplit(name).scheme not in ("http", "https") for name in names):
+            return
+        self.manager.remove_document(doc_id)
+    
+    def _save_state(self):
+        """Write the page validators to the state file, if configured."""
+        if not self.state_path:
+            return
+        with self._lock:
+            state = json.dumps(self.pages)
+        with open(self.state_path, 'w') as f:
+            f.write(state)
+
+#########################
+# PDF RENDERING MODULE
+#########################
+
+def _draw_section(c, content, title):
+    """
+    Draw a title and wrapped plain text from the top of the current page.
+    
+    Args:
+        c (canvas.Canvas): Canvas to draw on; left on the last page drawn
+        content (str): Plain text content
+        title (str): Heading above the content
+    """
+    width, height = letter
+    x_margin = 50
+    y_position = height - 50
+    
+    # Add title
+    c.setFont("Helvetica-Bold", 16)
+    c.drawString(x_margin, y_position, title)
+    y_position -= 30
+    
+    # Add content line by line with pagination, wrapped at word
+    # boundaries to the width between the margins
+    c.setFont("Helvetica", 12)
+    layout = TextLayout("Helvetica", 12, width - 2 * x_margin)
+    for line in layout.wrap(content):
+        # Start a new page if we're near the bottom
+        if y_position < 50:
+            c.showPage()
+            c.setFont("Helvetica", 12)
+            y_position = height - 50
+        c.drawString(x_margin, y_position, line)
+        y_position -= 15
+
+def draw_pdf(target, content, title="Educational Content"):
+    """
+    Draw plain text content onto a letter-size PDF with compressed page streams.
+    
+    Args:
+        target (str or file-like): File path or binary buffer to write to
+        content (str): Plain text content
+        title (str): Heading on the first page
+    
+    Returns:
+        int: Number of pages
+    """
+    # Create a canvas object for the PDF
+    c = canvas.Canvas(target, pagesize=letter, pageCompression=1)
+    c.setTitle(title)
+    _draw_section(c, content, title)
+    
+    # Save the PDF
+    pages = c.getPageNumber()
+    c.save()
+    return pages
+
+def draw_pdf_bundle(target, sections, title="Lesson Bundle"):
+    """
+    Draw several plain text documents into one bookmarked PDF.
+    
+    Each section starts on a new page and gets a top-level bookmark. All
+    sections share one document, so the font resources and document
+    overhead are written once rather than per section, and page content
+    streams are compressed as in draw_pdf. Sections are drawn as they are
+    read from the iterable, but reportlab keeps the whole document in
+    memory until it is saved, so memory grows with the bundle's length.
+    
+    Args:
+        target (str or file-like): File path or binary buffer to write to
+        sections: Iterable of (title, content) pairs, consumed lazily
+        title (str): Document title shown by PDF viewers
+    
+    Returns:
+        int: Number of pages
+    """
+    c = canvas.Canvas(target, pagesize=letter, pageCompression=1)
+    c.setTitle(title)
+    
+    drawn = 0
+    for section_title, content in sections:
+        if drawn:
+            c.showPage()
+        key = f"section-{drawn}"
+        c.bookmarkPage(key)
+        c.addOutlineEntry(section_title, key, level=0)
+        _draw_section(c, content, section_title)
+        drawn += 1
+    if drawn:
+        c.showOutline()
+    
+    pages = c.getPageNumber()
+    c.save()
+    return pages
+
+class PDFRenderCache:
+    """
+    Bounded cache of rendered PDF bytes keyed by a hash of their content.
+    
+    Small PDFs are kept in memory and large ones in a disk directory, each
+    tier evicting its least recently used entries past its byte limit.
+    Concurrent requests for the same missing key render it once; the other
+    callers wait for that render. One cache can be shared by every
+    controller in a process, so unchanged content is rendered once however
+    many reruns, sessions or downloads ask for it.
+    
+    The lock only guards the in-memory indexes: disk files are read, written
+    and deleted outside it. Each stored PDF gets its own uniquely named
+    file, so deleting an evicted file never touches a newer copy.
+    """
+    
+    def __init__(self, max_memory_bytes=32 * 1024 * 1024, disk_threshold=1024 * 1024,
+                 max_disk_bytes=512 * 1024 * 1024, disk_dir=None):
+        """
+        Initialize the cache.
+        
+        Args:
+            max_memory_bytes (int): Total size of PDFs kept in memory
+            disk_threshold (int): PDFs at least this large go to the disk tier
+            max_disk_bytes (int): Total size of PDFs kept on disk
+            disk_dir (str, optional): Disk tier directory; defaults to a
+                temporary directory created on first use
+        """
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_threshold = disk_threshold
+        self.max_disk_bytes = max_disk_bytes
+        self.disk_dir = disk_dir
+        self.memory = OrderedDict()  # Key -> PDF bytes, least recently used first
+        self.memory_bytes = 0
+        self.disk = OrderedDict()  # Key -> (file size, file path), least recently used first
+        self.disk_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._pending = {}  # Key -> Event set when its render finishes
+    
+    @staticmethod
+    def make_key(*parts):
+        """Build a cache key from strings such as the content and render options."""
+        hasher = hashlib.sha256()
+        for part in parts:
+            data = str(part).encode("utf-8")
+            hasher.update(len(data).to_bytes(8, "little"))
+            hasher.update(data)
+        return hasher.hexdigest()
+    
+    def get_or_render(self, key, render):
+        """
+        Get cached PDF bytes, rendering and storing them on a miss.
+        
+        Args:
+            key (str): Cache key from make_key
+            render (callable): Returns the PDF bytes
+            
+        Returns:
+            bytes: PDF file contents
+        """
+        while True:
+            with self._lock:
+                data = self.memory.get(key)
+                if data is not None:
+                    self.memory.move_to_end(key)
+                    self.hits += 1
+                    return data
+                entry = self.disk.get(key)
+                if entry is not None:
+                    self.disk.move_to_end(key)
+                else:
+                    pending = self._pending.get(key)
+                    if pending is None:
+                        self.misses += 1
+                        pending = self._pending[key] = threading.Event()
+                        break
+            
+            if entry is None:
+                # Another caller is rendering this key; use its result
+                pending.wait()
+                continue
+            try:
+                with open(entry[1], "rb") as f:
+                    data = f.read()
+            except OSError:
+                # Evicted or deleted meanwhile; drop the entry and look again
+                with self._lock:
+                    if self.disk.get(key) == entry:
+                        self.disk_bytes -= self.disk.pop(key)[0]
+                continue
+            with self._lock:
+                self.hits += 1
+            return data
+        
+        try:
+            data = bytes(render())
+            path = self._write_file(key, data) if self._disk_tier(data) else None
+            with self._lock:
+                stale = self._store(key, data, path)
+            for stale_path in stale:
+                self._remove_file(stale_path)
+            return data
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.set()
+    
+    def get_stats(self):
+        """Get hit rate, size and eviction statistics."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "memory_entries": len(self.memory),
+                "memory_bytes": self.memory_bytes,
+                "disk_entries": len(self.disk),
+                "disk_bytes": self.disk_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions
+            }
+    
+    def clear(self):
+        """Remove every cached PDF."""
+        with self._lock:
+            paths = [path for _, path in self.disk.values()]
+            self.memory.clear()
+            self.disk.clear()
+            self.memory_bytes = self.disk_bytes = 0
+        for path in paths:
+            self._remove_file(path)
+    
+    def _disk_tier(self, data):
+        """Check whether rendered bytes belong in the disk tier rather than memory."""
+        return self.disk_threshold <= len(data) <= self.max_disk_bytes
+    
+    def _write_file(self, key, data):
+        """Write PDF bytes to a new uniquely named file in the disk tier."""
+        with self._lock:
+            if self.disk_dir is None:
+                self.disk_dir = tempfile.mkdtemp(prefix="pdf-cache-")
+            disk_dir = self.disk_dir
+        fd, path = tempfile.mkstemp(prefix=f"{key}.", suffix=".pdf", dir=disk_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+        except BaseException:
+            self._remove_file(path)
+            raise
+        return path
+    
+    def _store(self, key, data, path):
+        """
+        Index rendered bytes in the right tier. Must be called with the lock held.
+        
+        Args:
+            key (str): Cache key
+            data (bytes): PDF file contents
+            path (str or None): File already holding data for the disk tier,
+                or None to keep data in memory
+            
+        Returns:
+            list: Files of replaced or evicted entries, to delete after
+                releasing the lock
+        """
+        if path is None:
+            if len(data) > self.max_memory_bytes or len(data) >= self.disk_threshold:
+                return []
+            if key in self.memory:
+                self.memory_bytes -= len(self.memory.pop(key))
+            self.memory[key] = data
+            self.memory_bytes += len(data)
+            while self.memory_bytes > self.max_memory_bytes:
+                _, evicted = self.memory.popitem(last=False)
+                self.memory_bytes -= len(evicted)
+                self.evictions += 1
+            return []
+        
+        stale = []
+        if key in self.disk:
+            size, old_path = self.disk.pop(key)
+            self.disk_bytes -= size
+            stale.append(old_path)
+        self.disk[key] = (len(data), path)
+        self.disk_bytes += len(data)
+        while self.disk_bytes > self.max_disk_bytes:
+            _, (size, evicted_path) = self.disk.popitem(last=False)
+            self.disk_bytes -= size
+            stale.append(evicted_path)
+            self.evictions += 1
+        return stale
+    
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def _render_pdf_job(content, title):
+    """
+    Render one PDF in a worker process.
+    
+    Returns:
+        tuple: (PDF bytes, page count)
+    """
+    buffer = io.BytesIO()
+    pages = draw_pdf(buffer, content, title)
+    return buffer.getvalue(), pages
+
+class BulkPDFExporter:
+    """
+    Renders many PDFs across a process pool.
+    
+    Items are handed to worker processes a bounded number at a time, and
+    each finished PDF is written to a directory or appended to a zip
+    archive as soon as it completes, so memory holds only the PDFs in
+    flight regardless of how many are exported. Rendering is CPU-bound,
+    so throughput scales with the number of worker processes.
+    
+    Filenames keep their relative directories, with absolute prefixes and
+    ".." parts removed so nothing is written outside the output. A name
+    already used in the export gets a " (2)", " (3)", ... suffix rather
+    than overwriting the earlier PDF.
+    """
+    
+    def __init__(self, workers=None, max_in_flight=None, title="Educational Content"):
+        """
+        Initialize the exporter.
+        
+        Args:
+            workers (int, optional): Worker processes; defaults to the CPU
+                count, and 1 renders in this process
+            max_in_flight (int, optional): PDFs rendering or waiting to be
+                written at once; defaults to twice the worker count
+            title (str): Heading on the first page of each PDF
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.max_in_flight = max_in_flight or 2 * self.workers
+        self.title = title
+    
+    def export(self, items, output_dir=None, zip_path=None, progress=None):
+        """
+        Render (content, filename) items to files or a zip archive.
+        
+        Args:
+            items: Iterable of (content, filename) pairs, consumed lazily
+            output_dir (str, optional): Directory to write PDFs to
+            zip_path (str, optional): Zip archive to write PDFs into
+            progress (callable, optional): Called with (filename, pages)
+                as each PDF is written
+        
+        Returns:
+            dict: Files, pages, seconds, pages_per_second and errors
+                as (filename, message) pairs
+        """
+        if (output_dir is None) == (zip_path is None):
+            raise ValueError("Specify exactly one of output_dir or zip_path")
+        if output_dir is not None:
+            os.makedirs(output_dir, exist_ok=True)
+        
+        stats = {"files": 0, "pages": 0, "errors": []}
+        archive = zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) if zip_path else None
+        used_names = set()
+        
+        def write(filename, pdf_bytes, pages):
+            name = self._output_name(filename, used_names)
+            if archive is not None:
+                archive.writestr(name, pdf_bytes)
+            else:
+                path = os.path.join(output_dir, *name.split("/"))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "wb") as f:
+                    f.write(pdf_bytes)
+            stats["files"] += 1
+            stats["pages"] += pages
+            if progress:
+                progress(name, pages)
+        
+        start = time.perf_counter()
+        try:
+            if self.workers == 1:
+                for content, filename in items:
+                    try:
+                        write(filename, *_render_pdf_job(content, self.title))
+                    except Exception as e:
+                        stats["errors"].append((filename, str(e)))
+            else:
+                self._export_parallel(items, write, stats)
+        finally:
+            if archive is not None:
+                archive.close()
+        
+        stats["seconds"] = time.perf_counter() - start
+        stats["pages_per_second"] = stats["pages"] / stats["seconds"] if stats["seconds"] else 0.0
+        return stats
+    
+    @staticmethod
+    def _output_name(filename, used_names):
+        """
+        Turn a requested filename into a unique relative output name.
+        
+        Args:
+            filename (str): Requested filename, possibly with directories
+            used_names (set): Lowercased names already written; updated
+        
+        Returns:
+            str: "/"-separated name inside the output
+        """
+        parts = [
+            part for part in filename.replace("\\", "/").split("/")
+            if part not in ("", ".", "..") and not part.endswith(":")
+        ]
+        name = "/".join(parts) or "document.pdf"
+        stem, extension = os.path.splitext(name)
+        candidate = name
+        copy = 1
+        # Compared case-insensitively, as on Windows and macOS filesystems
+        while candidate.lower() in used_names:
+            copy += 1
+            candidate = f"{stem} ({copy}){extension}"
+        used_names.add(candidate.lower())
+        return candidate
+    
+    def _export_parallel(self, items, write, stats):
+        """Render items on a process pool, writing each as it completes."""
+        items = iter(items)
+        in_flight = {}  # Future -> filename
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            while True:
+                while len(in_flight) < self.max_in_flight:
+                    item = next(items, None)
+                    if item is None:
+                        break
+                    content, filename = item
+                    in_flight[pool.submit(_render_pdf_job, content, self.title)] = filename
+                if not in_flight:
+                    return
+                
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    filename = in_flight.pop(future)
+                    try:
+                        write(filename, *future.result())
+                    except Exception as e:
+                        stats["errors"].append((filename, str(e)))
+
+#########################
+# APPLICATION CONTROLLER
+#########################
+
+class LessonPlanController:
+    """
+    Central controller to coordinate operations and provide an API for UI layers.
+    
+    Lesson plans and worksheets are grounded in the session's uploaded
+    documents. Retrieval is prefetched in the background for every topic as
+    soon as a topic list is produced. Generating content joins the prefetch
+    for its learning outcome if it is already running and otherwise submits
+    the retrieval to a separate pool, so it never queues behind other
+    prefetches; the prompt is built while retrieval runs and generation
+    waits at most REFERENCE_TIMEOUT seconds for it. Retrieved context is
+    cached by the document manager per (query, visible documents, index
+    generation), so the lesson plan and its worksheet share one retrieval.
+    """
+    
+    REFERENCE_CONTEXT_TOKENS = 800  # Prompt budget for uploaded-document excerpts
+    REFERENCE_TIMEOUT = 2.0  # Seconds generation waits for pending retrieval
+    
+    # Prefetches from every controller share one small pool; beyond
+    # MAX_PENDING_PREFETCHES queued or running, further prefetches are skipped
+    PREFETCH_WORKERS = 2
+    MAX_PENDING_PREFETCHES = 8
+    _prefetch_pool = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="reference-prefetch")
+    _prefetch_slots = threading.BoundedSemaphore(MAX_PENDING_PREFETCHES)
+    
+    # Retrievals that generation is waiting for run on their own pool
+    RETRIEVAL_WORKERS = 4
+    _retrieval_pool = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="reference-retrieval")
+    
+    # Part of the PDF cache key; change it whenever PDF layout changes
+    PDF_RENDER_VERSION = "3"
+    
+    def __init__(self, api_key=None, document_manager=None, pdf_cache=None):
+        """
+        Initialize the controller with optional API key.
+        
+        Args:
+            api_key (str, optional): OpenAI API key
+            document_manager (optional): DocumentManager or DocumentLibraryView
+                to use; defaults to a private DocumentManager
+            pdf_cache (optional): PDFRenderCache, typically shared by every
+                controller in the process; defaults to a private cache
+        """
+        self.config = ConfigManager(api_key)
+        self.research = ResearchModule(self.config)
+        self.generator = LessonPlanGenerator(self.config)
+        self.worksheet_generator = WorksheetGenerator(self.config)
+        self.document_manager = document_manager or DocumentManager(self.config)
+        self._prefetches = {}  # Learning outcome -> Future of a pending prefetch
+        self._prefetches_lock = threading.Lock()
+        self.pdf_cache = pdf_cache or PDFRenderCache()
+        
+        self.model = "gpt-3.5-turbo"
+
+    # CRITICAL BUG: Missing add_feedback method called in app_streamlit.py
+    def add_feedback(self, content_id, feedback, content_type="lesson_plan"):
+        """
+        Store user feedback for a specific content.
+        
+        Args:
+            content_id (str): Unique ID for the content
+            feedback (str): User feedback text  
+            content_type (str): Type of content ("lesson_plan" or "worksheet")
+            
+        Returns:
+            bool: True if feedback was stored successfully
+        """
+        # In a full implementation this would store to a database
+        # For now we'll just log it
+        print(f"Feedback received for {content_type} {content_id}: {feedback[:50]}...")
+        return True
+
+    # CRITICAL BUG: _generate_pdf implementation doesn't match expected interface in app_streamlit.py
+    def _generate_pdf(self, content, filename="lesson_plan.pdf", save_to_desktop=False):
+        """Generate a PDF file from content."""
+        try:
+            # Determine the save location
+            if save_to_desktop:
+                desktop_path = os.path.join(os.path.expanduser("~"), "Desktop")
+                filename = os.path.join(desktop_path, filename)
+
+            self._draw_pdf(filename, content)
+            return filename
+        except Exception as e:
+            print(f"Error generating PDF: {str(e)}")
+            return f"Error generating PDF: {str(e)}"
+
+    def save_bundle_as_pdf(self, lesson_plan, worksheets, filename=None, use_dialog=False, save_to_desktop=False):
+        """
+        Save a lesson plan and its worksheets as one bookmarked PDF.
+
+        Args:
+            lesson_plan (str): Lesson plan content
+            worksheets (dict): Worksheet content keyed by difficulty, in
+                the order they should appear
+            filename (str, optional): Output file name
+            use_dialog (bool): Ask for the output path with a file dialog
+            save_to_desktop (bool): Save to the user's Desktop
+
+        Returns:
+            str: Path of the saved PDF, or an error message
+        """
+        try:
+            if use_dialog:
+                filename = self._show_save_dialog(filename or "lesson_bundle.pdf")
+                if not filename:
+                    return "Canceled by user"
+            else:
+                filename = filename or "lesson_bundle.pdf"
+                if save_to_desktop:
+                    filename = os.path.join(os.path.expanduser("~"), "Desktop", filename)
+
+            sections = [("Lesson Plan", lesson_plan)]
+            sections.extend(
+                (f"{difficulty.title()} Worksheet", worksheet)
+                for difficulty, worksheet in worksheets.items()
+            )
+            draw_pdf_bundle(filename, sections)
+            return filename
+        except Exception as e:
+            return f"Error saving PDF bundle: {str(e)}"
+
+    def render_pdf_bytes(self, content, title="Educational Content"):
+        """
+        Render content to a PDF in memory.
+        
+        Web handlers can send the result straight to the client without a
+        temporary file. Results are cached by a hash of the content and
+        title, so unchanged content is only rendered once.
+        
+        Args:
+            content (str): Plain text content
+            title (str): Heading on the first page
+            
+        Returns:
+            bytes: PDF file contents
+        """
+        def render():
+            buffer = io.BytesIO()
+            self._draw_pdf(buffer, content, title)
+            return buffer.getvalue()
+        
+        key = PDFRenderCache.make_key(self.PDF_RENDER_VERSION, title, content)
+        return self.pdf_cache.get_or_render(key, render)
+
+    def _draw_pdf(self, target, content, title="Educational Content"):
+        """
+        Draw content onto a PDF.
+        
+        Args:
+            target (str or file-like): File path or binary buffer to write to
+            content (str): Plain text content
+            title (str): Heading on the first page
+        """
+        draw_pdf(target, content, title)
+
+    def export_pdfs(self, items, output_dir=None, zip_path=None, workers=None):
+        """
+        Render many (content, filename) items to PDFs in parallel.
+        
+        Args:
+            items: Iterable of (content, filename) pairs
+            output_dir (str, optional): Directory to write PDFs to
+            zip_path (str, optional): Zip archive to write PDFs into
+            workers (int, optional): Worker processes; defaults to the CPU count
+            
+        Returns:
+            dict: Files, pages, seconds, pages_per_second and errors
+        """
+        return BulkPDFExporter(workers=workers).export(items, output_dir=output_dir, zip_path=zip_path)
+
+    def set_api_key(self, api_key):
+        """Set or update the API key."""
+        return self.config.set_api_key(api_key)
+
+    def validate_api_key(self):
+        """Check if API key is valid and configured."""
+        return self.config.check_api_key()
+
+    def get_research_data(self, grade, curriculum):
+        """Get research data for a specific grade and curriculum."""
+        try:
+            return self.research.conduct_research(grade, curriculum, model=self.model)
+        except Exception as e:
+            return {"error": str(e)}
+
+    def get_topics_list(self, research_data):
+        """Extract topics list from research data."""
+        if "error" in research_data:
+            return []
+        topics = []
+        for idx, topic in enumerate(research_data.get("topics", [])):
+            topics.append({
+                "id": idx,
+                "title": topic.get("title", ""),
+                "description": topic.get("description", "")
+            })
+            # Warm the retrieval cache while the user picks a topic
+            if topic.get("learning_outcome"):
+                self._prefetch_reference_context(topic["learning_outcome"])
+        return topics
+
+    def get_learning_outcome(self, research_data, topic_id):
+        """Get the learning outcome for a specific topic."""
+        if "error" in research_data or not research_data.get("topics"):
+            return {"error": "Invalid research data"}
+        if topic_id < 0 or topic_id >= len(research_data["topics"]):
+            return {"error": "Invalid topic ID"}
+        return research_data["topics"][topic_id]
+
+    def create_topic_context(self, topic_data):
+        """Create a context string from topic data."""
+        if "error" in topic_data:
+            return ""
+        context = f"""
+        KEY CONCEPTS:
+        {', '.join(topic_data.get('context', {}).get('key_concepts', []))}
+        
+        COMMON MISCONCEPTIONS:
+        {', '.join(topic_data.get('context', {}).get('misconceptions', []))}
+        
+        PREREQUISITES:
+        {', '.join(topic_data.get('context', {}).get('prerequisites', []))}
+        
+        TEACHING EXAMPLES:
+        {', '.join(topic_data.get('context', {}).get('examples', []))}
+        """
+        return context
+
+    def generate_lesson_plan(self, learning_outcome, grade, curriculum, duration, topic_context):
+        """Generate a lesson plan with the specified parameters."""
+        if not self.validate_api_key():
+            return "Error: API key is missing or invalid"
+        reference = self._reference_future(learning_outcome)
+        try:
+            lesson_plan = self.generator.generate_plan(
+                learning_outcome, grade, curriculum, duration, topic_context, model=self.model,
+                reference_context=reference
+            )
+            return lesson_plan
+        except Exception as e:
+            return f"Error generating lesson plan: {str(e)}"
+
+    def generate_worksheet(self, learning_outcome, topic_context, lesson_plan, difficulty="mixed"):
+        """Generate a worksheet based on a lesson plan."""
+        if not self.validate_api_key():
             return "Error: API key is missing or invalid"
+        reference = self._reference_future(learning_outcome)
         try:
             return self.worksheet_generator.generate_worksheet(
                 learning_outcome=learning_outcome,
                 context=topic_context,
                 lesson_plan=lesson_plan,
                 difficulty=difficulty,
-                model=self.model
+                model=self.model,
+                reference_context=reference
             )
         except Exception as e:
             return f"Error generating worksheet: {str(e)}"
 
+    def get_reference_context(self, learning_outcome):
+        """
+        Get the uploaded-document context used for a learning outcome.
+        
+        Returns:
+            str: Retrieved context, or an empty string if retrieval did not
+                finish within REFERENCE_TIMEOUT seconds
+        """
+        try:
+            return self._reference_future(learning_outcome).result(timeout=self.REFERENCE_TIMEOUT)
+        except Exception as e:
+            print(f"Warning: Reference context unavailable: {e}")
+            return ""
+    
+    def _reference_future(self, learning_outcome):
+        """
+        Get a Future for the uploaded-document context of a learning outcome.
+        
+        Joins a prefetch for the same outcome that is already running; one
+        still queued is cancelled and the retrieval is submitted to the
+        retrieval pool instead.
+        """
+        with self._prefetches_lock:
+            prefetch = self._prefetches.get(learning_outcome)
+        if prefetch is not None and not prefetch.cancel():
+            return prefetch
+        return self._retrieval_pool.submit(self._retrieve_reference_context, learning_outcome)
+
+    def _prefetch_reference_context(self, learning_outcome):
+        """Start warming the retrieval cache for a learning outcome, unless already pending."""
+        with self._prefetches_lock:
+            if learning_outcome in self._prefetches:
+                return
+            if not self._prefetch_slots.acquire(blocking=False):
+                return
+            prefetch = self._prefetch_pool.submit(self._retrieve_reference_context, learning_outcome)
+            self._prefetches[learning_outcome] = prefetch
+        prefetch.add_done_callback(lambda future: self._finish_prefetch(learning_outcome, future))
+
+    def _finish_prefetch(self, learning_outcome, future):
+        """Forget a finished or cancelled prefetch and free its slot."""
+        with self._prefetches_lock:
+            if self._prefetches.get(learning_outcome) is future:
+                del self._prefetches[learning_outcome]
+        self._prefetch_slots.release()
+
+    def _retrieve_reference_context(self, learning_outcome):
+        """Retrieve uploaded-document context for a learning outcome."""
+        try:
+            return self.document_manager.get_relevant_context(
+                learning_outcome, max_tokens=self.REFERENCE_CONTEXT_TOKENS
+            )
+        except Exception as e:
+            print(f"Warning: Could not retrieve reference context: {e}")
+            return ""
+
     def save_as_pdf(self, content, filename=None, use_dialog=False, save_to_desktop=False):
         """Save content as PDF with optional file dialog."""
         try:
@@ -802,20 +5784,6 @@ class LessonPlanController:
         except Exception:
             return None
 
-    def _create_embeddings(self, doc_id):
-        """Create embeddings for the document for future RAG use."""
-        try:
-            if doc_id not in self.documents:
-                return
-                
-            content = self.documents[doc_id]["content"]
-            
-            # In production, would use OpenAI embeddings API
-            # For placeholder implementation, just store document ID
-            self.document_embeddings[doc_id] = f"placeholder_embedding_{doc_id}"
-        except Exception as e:
-            print(f"Warning: Could not create embeddings for {doc_id}: {e}")
-
     def get_document_list(self):
         """Get a list of all imported documents."""
         return [
@@ -0,0 +1,53 @@
+import os
+import zipfile
+
+import pytest
+
+from content_generator import BulkPDFExporter
+
+ITEMS = [
+    ("Fractions worksheet", "grade3/worksheet.pdf"),
+    ("Decimals worksheet", "grade4/worksheet.pdf"),
+    ("Fractions again", "grade3/Worksheet.pdf"),
+    ("Escapes the folder", "../../etc/plan.pdf"),
+    ("Absolute path", "C:\\Users\\teacher\\plan.pdf"),
+    ("No name", ""),
+]
+EXPECTED = [
+    "grade3/worksheet.pdf",
+    "grade4/worksheet.pdf",
+    "grade3/Worksheet (2).pdf",
+    "etc/plan.pdf",
+    "Users/teacher/plan.pdf",
+    "document.pdf",
+]
+
+
+@pytest.fixture
+def exporter():
+    return BulkPDFExporter(workers=1)
+
+
+def test_zip_keeps_relative_paths_and_deduplicates(exporter, tmp_path):
+    zip_path = tmp_path / "export.zip"
+    written = []
+    stats = exporter.export(ITEMS, zip_path=str(zip_path), progress=lambda name, pages: written.append(name))
+
+    assert stats["files"] == len(ITEMS) and stats["errors"] == []
+    assert written == EXPECTED
+    with zipfile.ZipFile(zip_path) as archive:
+        assert archive.namelist() == EXPECTED
+        assert all(archive.read(name).startswith(b"%PDF") for name in EXPECTED)
+
+
+def test_directory_output_never_overwrites(exporter, tmp_path):
+    output_dir = tmp_path / "out"
+    stats = exporter.export(ITEMS, output_dir=str(output_dir))
+
+    assert stats["files"] == len(ITEMS)
+    written = sorted(
+        os.path.relpath(os.path.join(root, name), output_dir).replace(os.sep, "/")
+        for root, _, names in os.walk(output_dir) for name in names
+    )
+    assert written == sorted(EXPECTED)
+    assert not (tmp_path / "etc").exists()
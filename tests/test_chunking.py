@@ -0,0 +1,103 @@
+import pytest
+
+from content_generator import ChunkingEngine
+
+
+def words(count, word="word"):
+    return " ".join([word] * count)
+
+
+def chunk_all(engine, paragraphs):
+    document = "\n\n".join(paragraphs)
+    chunks = list(engine.iter_chunks(iter(paragraphs)))
+    for start, end, text in chunks:
+        assert document[start:end] == text
+    return chunks
+
+
+def test_rejects_bad_settings():
+    with pytest.raises(ValueError):
+        ChunkingEngine(strategy="sentences")
+    with pytest.raises(ValueError):
+        ChunkingEngine(chunk_tokens=40, overlap_tokens=40)
+
+
+def test_paragraph_strategy_offsets():
+    engine = ChunkingEngine(strategy="paragraph")
+    chunks = chunk_all(engine, ["alpha", "", "beta gamma"])
+
+    assert [(start, end) for start, end, _ in chunks] == [(0, 5), (7, 7), (9, 19)]
+    starts, ends = engine.chunk(["alpha", "", "beta gamma"])
+    assert list(starts) == [0, 7, 9] and list(ends) == [5, 7, 19]
+
+
+def test_token_window_overlaps_and_covers_the_tail():
+    # 8-token windows are 6 words; a 2-token overlap steps 5 words
+    engine = ChunkingEngine(strategy="token_window", chunk_tokens=8, overlap_tokens=2)
+    paragraphs = [" ".join(f"w{idx}" for idx in range(0, 7)), " ".join(f"w{idx}" for idx in range(7, 13))]
+    chunks = chunk_all(engine, paragraphs)
+
+    assert [text.split() for _, _, text in chunks] == [
+        [f"w{idx}" for idx in range(0, 6)],
+        [f"w{idx}" for idx in range(5, 11)],
+        [f"w{idx}" for idx in range(10, 13)],
+    ]
+    assert "\n\n" in chunks[1][2]
+
+
+def test_token_window_short_document():
+    engine = ChunkingEngine(strategy="token_window", chunk_tokens=8, overlap_tokens=2)
+    assert chunk_all(engine, ["one two"]) == [(0, 7, "one two")]
+    assert chunk_all(engine, ["", "  "]) == []
+
+
+def test_structure_starts_sections_at_headings():
+    engine = ChunkingEngine(chunk_tokens=40, overlap_tokens=8)
+    paragraphs = ["# Fractions", words(6), words(3), "# Decimals", words(6)]
+    chunks = chunk_all(engine, paragraphs)
+
+    assert [text.split("\n\n")[0] for _, _, text in chunks] == ["# Fractions", "# Decimals"]
+    assert chunks[0][2].count("\n\n") == 2
+
+
+def test_structure_overlaps_within_a_section():
+    engine = ChunkingEngine(chunk_tokens=20, overlap_tokens=8)
+    paragraphs = [words(6, "one"), words(6, "two"), words(6, "three"), words(6, "four")]
+    chunks = chunk_all(engine, paragraphs)
+
+    # Each chunk fits two 8-token paragraphs and repeats the previous one
+    assert [text.split()[0] for _, _, text in chunks] == ["one", "two", "three"]
+    assert chunks[1][2].startswith(paragraphs[1]) and chunks[1][2].endswith(paragraphs[2])
+
+
+def test_structure_keeps_lists_together_up_to_half_again():
+    engine = ChunkingEngine(chunk_tokens=20, overlap_tokens=4)
+    items = [f"- {words(5)}" for _ in range(4)]  # 8 tokens each
+    chunks = chunk_all(engine, items)
+
+    # Three items (24 tokens) run on past 20; a fourth would exceed 30
+    assert chunks[0][2].count("- ") == 3
+    assert chunks[-1][2].endswith(items[-1])
+
+
+def test_structure_windows_oversized_paragraphs():
+    engine = ChunkingEngine(chunk_tokens=16, overlap_tokens=4)
+    long_paragraph = " ".join(f"w{idx}" for idx in range(30))
+    chunks = chunk_all(engine, ["Intro text here.", long_paragraph, "Outro text here."])
+
+    assert chunks[0][2] == "Intro text here."
+    assert chunks[-1][2] == "Outro text here."
+    windows = chunks[1:-1]
+    assert len(windows) > 1
+    assert all(len(text.split()) <= 12 for _, _, text in windows)
+    assert windows[-1][2].endswith("w29")
+
+
+def test_heading_detection():
+    engine = ChunkingEngine()
+    assert engine.is_heading("## Place value")
+    assert engine.is_heading("2.1 Comparing Fractions")
+    assert engine.is_heading("COMMON MISCONCEPTIONS")
+    assert not engine.is_heading("Students compare fractions.")
+    assert not engine.is_heading("")
+    assert engine.is_list("1) First item") and engine.is_list("- bullet")
@@ -0,0 +1,56 @@
+import threading
+import zlib
+
+import content_generator
+from content_generator import ContentStore
+
+
+def test_block_round_trip_is_compressed_and_shared():
+    store = ContentStore()
+    text = "Place value charts show tens and ones. " * 200 + "café ½"
+    first = store.put(text)
+    second = store.put(text)
+
+    assert first == second
+    assert store.get(first) == text
+    assert store.refcounts[first] == 2
+    data, size = store.get_compressed(first)
+    assert size == len(text)
+    assert len(data) < len(text.encode("utf-8")) / 10
+    assert zlib.decompress(data).decode("utf-8") == text
+
+    copy = ContentStore()
+    copy.put_compressed(first, data, size)
+    assert copy.get(first) == text
+
+    store.release(first)
+    assert store.get(first) == text
+    store.release(first)
+    assert store.get(first) == ""
+    assert store.get_stats()["blocks"] == 0
+
+
+def test_release_during_read_leaves_no_cached_text(monkeypatch):
+    store = ContentStore()
+    block_hash = store.put("Number bonds to ten.")
+    decompressing = threading.Event()
+    released = threading.Event()
+    decompress = zlib.decompress
+
+    def slow_decompress(data):
+        decompressing.set()
+        released.wait(5)
+        return decompress(data)
+
+    monkeypatch.setattr(content_generator.zlib, "decompress", slow_decompress)
+    results = []
+    reader = threading.Thread(target=lambda: results.append(store.get(block_hash)))
+    reader.start()
+    assert decompressing.wait(5)
+    store.release(block_hash)
+    released.set()
+    reader.join(5)
+
+    assert results == ["Number bonds to ten."]
+    assert block_hash not in store._cache
+    assert store.get_stats()["cached_blocks"] == 0
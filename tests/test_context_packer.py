@@ -0,0 +1,49 @@
+from content_generator import ConfigManager, ContextPacker, DocumentManager
+
+
+def lazy_chunk(idx, length, score, loads):
+    text = " ".join([f"w{idx}"] * (length // 3))
+
+    def load_text():
+        loads.append(idx)
+        return text
+
+    return {"doc_id": "doc", "source": "notes.txt", "start": idx * 10000, "end": idx * 10000 + length,
+            "score": score, "load_text": load_text}
+
+
+def test_only_chunks_that_fit_are_loaded():
+    loads = []
+    # Ten ~450-token chunks into a 600 token budget: one fits, a second is truncated
+    chunks = [lazy_chunk(idx, 1000, 10 - idx, loads) for idx in range(10)]
+    context = ContextPacker().pack(chunks, 600)
+
+    assert loads == [0, 1]
+    assert context.count("From notes.txt:") == 2
+    assert context.endswith(" ...")
+
+
+def test_overlapping_and_duplicate_chunks_are_skipped():
+    loads = []
+    chunks = [
+        {"doc_id": "doc", "source": "a.txt", "start": 0, "end": 100, "score": 3, "text": "Fractions of shapes."},
+        lazy_chunk(0, 100, 2, loads),  # Same range as the first chunk
+        {"doc_id": "other", "source": "b.txt", "start": 0, "end": 20, "score": 1, "text": "fractions  of SHAPES."},
+    ]
+    assert ContextPacker().pack(chunks, 500) == "From a.txt:\nFractions of shapes."
+    assert loads == []
+
+
+def test_retrieval_reads_only_selected_chunk_text():
+    manager = DocumentManager(ConfigManager(), duplicate_threshold=None)
+    paragraphs = [f"Topic {idx}: " + " ".join(f"fractions{idx % 7} word{n}" for n in range(60)) for idx in range(40)]
+    doc_id = manager.import_bytes("\n\n".join(paragraphs).encode(), "fractions.txt")
+    reads = []
+    get_chunk = manager.backend.get_chunk
+    manager.backend.get_chunk = lambda *args: reads.append(args) or get_chunk(*args)
+
+    context = manager.get_relevant_context("fractions word1", max_tokens=400, mode="lexical")
+
+    assert context.startswith("From fractions.txt:")
+    assert 0 < len(reads) <= context.count("From fractions.txt:") + 1
+    assert all(read[0] == doc_id for read in reads)
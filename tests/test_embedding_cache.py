@@ -0,0 +1,94 @@
+import multiprocessing
+import os
+from array import array
+
+import pytest
+
+from content_generator import EmbeddingCache
+
+DIMENSIONS = 8
+RECORD_BYTES = EmbeddingCache.RECORD_HEADER.size + 4 * DIMENSIONS
+
+
+def key(idx):
+    return EmbeddingCache.key("test-embedder", f"chunk {idx}")
+
+
+def vector(idx):
+    return array('f', [float(idx)] * DIMENSIONS)
+
+
+def store(path, indices, max_bytes):
+    cache = EmbeddingCache(path, max_bytes=max_bytes, memory_vectors=0)
+    for idx in indices:
+        cache.put_many([(key(idx), vector(idx))])
+    cache.close()
+
+
+def assert_consistent(path, max_bytes=1 << 30):
+    """Every indexed record decodes to the vector stored under its key."""
+    cache = EmbeddingCache(path, max_bytes=max_bytes, memory_vectors=0)
+    expected = {key(idx): vector(idx) for idx in range(1000)}
+    for cached_key in list(cache.index):
+        assert cache.get_many([cached_key]) == [expected[cached_key]]
+    assert os.path.getsize(path) == cache.get_stats()["file_bytes"]
+    entries = len(cache.index)
+    cache.close()
+    return entries
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "embeddings.cache")
+
+
+def test_reopen_keeps_vectors(path):
+    store(path, range(5), max_bytes=1 << 20)
+    cache = EmbeddingCache(path)
+    assert cache.get_many([key(idx) for idx in range(6)]) == [vector(idx) for idx in range(5)] + [None]
+    cache.close()
+
+
+def test_sees_records_stored_by_another_instance(path):
+    reader = EmbeddingCache(path)
+    writer = EmbeddingCache(path)
+    writer.put_many([(key(1), vector(1))])
+
+    assert reader.get_many([key(1)]) == [vector(1)]
+    reader.close()
+    writer.close()
+
+
+def test_appends_after_another_instance_compacts(path):
+    max_bytes = 10 * RECORD_BYTES
+    stale = EmbeddingCache(path, max_bytes=max_bytes)
+    stale.put_many([(key(0), vector(0))])
+    store(path, range(1, 12), max_bytes)  # Compacts into a new file
+
+    stale.put_many([(key(100), vector(100))])
+    stale.close()
+
+    reopened = EmbeddingCache(path, max_bytes=max_bytes)
+    assert reopened.get_many([key(100), key(11)]) == [vector(100), vector(11)]
+    reopened.close()
+    assert_consistent(path)
+    assert sorted(os.listdir(os.path.dirname(path))) == ["embeddings.cache", "embeddings.cache.lock"]
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="needs fork")
+@pytest.mark.parametrize("max_bytes", [1 << 20, 40 * RECORD_BYTES])
+def test_concurrent_processes(path, max_bytes):
+    context = multiprocessing.get_context("fork")
+    workers = [
+        context.Process(target=store, args=(path, range(worker * 50, worker * 50 + 50), max_bytes))
+        for worker in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(30)
+        assert worker.exitcode == 0
+
+    entries = assert_consistent(path, max_bytes)
+    if max_bytes == 1 << 20:
+        assert entries == 200
@@ -0,0 +1,60 @@
+import pytest
+
+from content_generator import (
+    ConfigManager, DocumentManager, FacetIndex, InMemoryDocumentBackend, SQLiteDocumentBackend
+)
+
+FRACTIONS = b"Fractions\n\nStudents compare fractions with bar models and number lines."
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    backend = InMemoryDocumentBackend() if request.param == "memory" else SQLiteDocumentBackend(
+        str(tmp_path / "documents.db")
+    )
+    yield backend
+    backend.close()
+
+
+def test_reupload_adds_its_facets(backend):
+    manager = DocumentManager(ConfigManager(), backend=backend)
+    doc_id = manager.import_bytes(FRACTIONS, "fractions.txt", {"grade": 2, "topic": "Fractions"})
+    generation = backend.get_generation()
+    assert manager.import_bytes(FRACTIONS, "copy.txt", {"grade": 3, "curriculum": "Common Core"}) == doc_id
+
+    assert backend.get_generation() != generation
+    assert backend.filter_documents({"grade": 3}) == {doc_id}
+    assert backend.filter_documents({"grade": 2}) == {doc_id}
+    assert backend.filter_documents({"curriculum": "common core", "grade": 3}) == {doc_id}
+    assert "number lines" in manager.get_relevant_context("compare fractions", filters={"grade": 3})
+    assert backend.get_document(doc_id)["metadata"] == {
+        "grade": [2, 3], "topic": "Fractions", "curriculum": "Common Core"
+    }
+
+
+def test_reupload_with_known_facets_changes_nothing(backend):
+    manager = DocumentManager(ConfigManager(), backend=backend)
+    doc_id = manager.import_bytes(FRACTIONS, "fractions.txt", {"grade": 2})
+    generation = backend.get_generation()
+    manager.import_bytes(FRACTIONS, "copy.txt", {"grade": " 2 "})
+    manager.import_bytes(FRACTIONS, "again.txt")
+
+    assert backend.get_generation() == generation
+    assert backend.get_document(doc_id)["metadata"] == {"grade": 2}
+
+
+def test_removed_document_loses_merged_facets(backend):
+    manager = DocumentManager(ConfigManager(), backend=backend)
+    doc_id = manager.import_bytes(FRACTIONS, "fractions.txt", {"grade": 2})
+    manager.import_bytes(FRACTIONS, "copy.txt", {"grade": 3})
+    manager.remove_document(doc_id)
+
+    assert backend.filter_documents({"grade": 3}) == set()
+
+
+def test_merge_metadata_keeps_existing_values():
+    merged, added = FacetIndex.merge_metadata(
+        {"grade": 2, "source": "upload"}, {"grade": [2, "3"], "source": "url", "topic": ""}
+    )
+    assert merged == {"grade": [2, "3"], "source": "upload"}
+    assert added == [("grade", "3")]
@@ -0,0 +1,78 @@
+import threading
+
+from content_generator import ConfigManager, DocumentManager, HashingEmbedder
+
+
+class FailingEmbedder(HashingEmbedder):
+    """Embeds documents at import, then fails every query."""
+
+    def __init__(self):
+        super().__init__()
+        self.fail = False
+
+    def embed(self, texts):
+        if self.fail:
+            raise RuntimeError("embedding service unavailable")
+        return super().embed(texts)
+
+
+class SlowEmbedder(HashingEmbedder):
+    """Blocks query embeddings until released."""
+
+    def __init__(self):
+        super().__init__()
+        self.block = False
+        self.release = threading.Event()
+
+    def embed(self, texts):
+        if self.block:
+            self.release.wait(5)
+        return super().embed(texts)
+
+
+def make_manager(embedder, **kwargs):
+    manager = DocumentManager(ConfigManager(), embedder=embedder, retrieval_mode="hybrid", **kwargs)
+    data = b"Fractions name equal parts of a whole.\n\nStudents compare fractions on number lines."
+    assert manager.import_bytes(data, "fractions.txt").startswith("doc_")
+    return manager
+
+
+def test_failing_retriever_falls_back_and_is_not_cached():
+    embedder = FailingEmbedder()
+    manager = make_manager(embedder)
+    embedder.fail = True
+
+    context = manager.get_relevant_context("compare fractions")
+    assert "number lines" in context
+    assert manager.get_cache_stats()["entries"] == 0
+
+    embedder.fail = False
+    manager.get_relevant_context("compare fractions")
+    assert manager.get_cache_stats()["entries"] == 1
+
+
+def test_timed_out_retriever_is_dropped_and_not_cached():
+    embedder = SlowEmbedder()
+    manager = make_manager(embedder, retriever_timeout=0.05)
+    embedder.block = True
+    try:
+        hits, _, degraded = manager._hybrid_search("compare fractions", None)
+        assert degraded
+        assert hits
+
+        context = manager.get_relevant_context("compare fractions")
+        assert "number lines" in context
+        assert manager.get_cache_stats()["entries"] == 0
+    finally:
+        embedder.release.set()
+
+
+def test_saturated_pool_runs_retrievers_inline():
+    embedder = SlowEmbedder()
+    manager = make_manager(embedder)
+    for _ in range(manager.MAX_PENDING_RETRIEVALS):
+        assert manager._retrieval_slots.acquire(blocking=False)
+
+    hits, _, degraded = manager._hybrid_search("compare fractions", None)
+    assert not degraded
+    assert hits
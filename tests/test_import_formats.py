@@ -0,0 +1,50 @@
+import gc
+import io
+import warnings
+import zipfile
+
+import pytest
+
+from content_generator import ConfigManager, DocumentManager, WORD_NAMESPACE
+
+
+@pytest.fixture
+def manager():
+    return DocumentManager(ConfigManager())
+
+
+def docx_bytes(text):
+    xml = f'<w:document xmlns:w="{WORD_NAMESPACE}"><w:body><w:p><w:r><w:t>{text}</w:t></w:r></w:p></w:body></w:document>'
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("word/document.xml", xml)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("name", ["notes.txt", "notes.md", "notes", "https://example.org/lesson.php?id=3"])
+def test_text_is_imported_under_whitelisted_names(manager, name):
+    assert manager.import_bytes(b"Fractions of a whole.", name).startswith("doc_")
+
+
+@pytest.mark.parametrize("name", ["script.py", "page.html", "data.json"])
+def test_text_with_other_extensions_is_rejected(manager, name):
+    assert manager.import_bytes(b"Fractions of a whole.", name) == f"Error: Unsupported file format .{name.split('.')[-1]}"
+
+
+def test_formats_are_detected_from_content(manager):
+    doc_id = manager.import_bytes(docx_bytes("Equivalent fractions"), "upload.bin")
+    assert manager.get_document_content(doc_id) == "Equivalent fractions"
+    assert manager.import_bytes(b"PK\x03\x04not a zip", "upload.docx").startswith("Error")
+
+
+def test_bad_buffer_returns_an_error(manager):
+    assert manager.import_bytes("not bytes", "notes.txt").startswith("Error importing document")
+
+
+def test_docx_import_closes_its_files(manager, tmp_path):
+    path = tmp_path / "lesson.docx"
+    path.write_bytes(docx_bytes("Place value"))
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", ResourceWarning)
+        assert manager.import_document(str(path)).startswith("doc_")
+        gc.collect()
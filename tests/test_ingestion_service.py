@@ -0,0 +1,106 @@
+import threading
+
+import pytest
+
+from content_generator import ChunkingEngine, ConfigManager, DocumentManager, HashingEmbedder, IngestionService
+
+DOCUMENT = "\n\n".join(f"Paragraph {idx} about number bonds to ten." for idx in range(200))
+
+
+class GatedEmbedder(HashingEmbedder):
+    """Blocks the first batch until released, or fails every batch."""
+
+    def __init__(self, fail=False):
+        super().__init__()
+        self.fail = fail
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def embed(self, texts):
+        if self.fail:
+            raise RuntimeError("embedding service unavailable")
+        if not self.started.is_set():
+            self.started.set()
+            self.release.wait(5)
+        return super().embed(texts)
+
+
+def write_files(tmp_path, count):
+    paths = []
+    for idx in range(count):
+        path = tmp_path / f"doc{idx}.txt"
+        path.write_text(f"{DOCUMENT}\n\nDocument {idx}.")
+        paths.append(str(path))
+    return paths
+
+
+def run(manager, paths, **kwargs):
+    service = IngestionService(manager, workers=1, **kwargs)
+    try:
+        batch = service.submit(paths)
+        assert batch.wait(10)
+        return service, batch
+    finally:
+        service.shutdown()
+
+
+def test_event_queue_is_bounded(tmp_path):
+    manager = DocumentManager(ConfigManager())
+    service, batch = run(manager, write_files(tmp_path, 4), max_events=5)
+
+    events = service.poll_events()
+    assert len(events) == 5
+    assert service.dropped_events == 4 * 5 - 5
+    assert events[-1]["stage"] == "done" and events[-1]["completed"] == 4
+    assert all(result.startswith("doc_") for result in batch.results.values())
+
+
+def test_embedding_failure_is_reported(tmp_path):
+    manager = DocumentManager(ConfigManager(), embedder=GatedEmbedder(fail=True))
+    service, batch = run(manager, write_files(tmp_path, 1))
+
+    stages = [event["stage"] for event in service.poll_events()]
+    assert stages == ["parsed", "chunked", "embedding_failed", "indexed", "done"]
+    assert IngestionService.format_event({
+        "path": "doc0.txt", "stage": "embedding_failed", "completed": 0, "total": 1
+    }) == "[0/1] doc0.txt: embedding failed, lexical search only"
+
+
+def test_cancel_stops_a_file_in_progress(tmp_path):
+    embedder = GatedEmbedder()
+    chunker = ChunkingEngine(strategy="paragraph")
+    manager = DocumentManager(ConfigManager(), embedder=embedder, chunker=chunker)
+    paths = write_files(tmp_path, 2)
+
+    service = IngestionService(manager, workers=1)
+    try:
+        batch = service.submit(paths)
+        assert embedder.started.wait(5)
+        batch.cancel()
+        embedder.release.set()
+        assert batch.wait(5)
+    finally:
+        service.shutdown()
+
+    assert batch.results == {path: "Cancelled" for path in paths}
+    assert manager.get_document_list() == []
+    assert [event["stage"] for event in service.poll_events()] == ["cancelled", "cancelled"]
+
+
+def test_shutdown_handles_files_still_being_fed(tmp_path):
+    manager = DocumentManager(ConfigManager())
+    paths = write_files(tmp_path, 12)
+    service = IngestionService(manager, workers=2, max_queue=1)
+    batch = service.submit(paths)
+    service.shutdown()
+
+    assert batch.wait(10)
+    assert all(batch.results[path].startswith("doc_") for path in paths)
+
+
+def test_submit_after_shutdown_is_rejected(tmp_path):
+    service = IngestionService(DocumentManager(ConfigManager()), workers=1)
+    service.shutdown()
+    service.shutdown()
+    with pytest.raises(RuntimeError):
+        service.submit(write_files(tmp_path, 1))
@@ -0,0 +1,55 @@
+import threading
+
+import pytest
+
+from content_generator import ConfigManager, DocumentManager
+
+TEMPLATE = (
+    "Fractions fractions fractions: pupils compare fractions with the same denominator using "
+    "fraction walls, bar models and number lines, then order fractions and explain their reasoning "
+    "to a partner before recording it in their books for copy {copy}."
+)
+DISTINCT = [
+    "Geometry lesson where fractions of shapes are shaded on squared paper.",
+    "Measurement lesson reading fractions of a metre on a tape measure.",
+    "Money lesson finding fractions of amounts in pounds and pence.",
+]
+
+
+@pytest.fixture
+def manager():
+    manager = DocumentManager(ConfigManager(), candidate_pool_size=3)
+    for copy in range(6):
+        manager.import_bytes(TEMPLATE.format(copy=copy).encode(), f"copy{copy}.txt")
+    for idx, text in enumerate(DISTINCT):
+        manager.import_bytes(text.encode(), f"distinct{idx}.txt")
+    return manager
+
+
+@pytest.mark.parametrize("mode", ["lexical", "hybrid"])
+def test_duplicates_do_not_crowd_out_the_candidate_pool(manager, mode):
+    context = manager.get_relevant_context("fractions", max_tokens=2000, mode=mode)
+
+    assert context.count("From copy") == 1
+    assert context.count("From distinct") >= 2
+
+
+def test_collapsed_chunks_are_counted_once_per_query(manager):
+    manager.get_relevant_context("fractions", max_tokens=2000, mode="hybrid")
+    stats = manager.get_duplicate_stats()
+
+    assert stats["collapsed_chunks"] == 5
+    assert stats["collapsed_chars"] == sum(len(TEMPLATE.format(copy=copy)) for copy in range(1, 6))
+
+
+def test_stats_are_consistent_under_concurrent_queries(manager):
+    threads = [
+        threading.Thread(target=manager.get_relevant_context, args=(f"fractions {n}",), kwargs={"mode": "lexical"})
+        for n in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert manager.get_duplicate_stats()["collapsed_chunks"] == 8 * 5
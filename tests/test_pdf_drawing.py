@@ -0,0 +1,25 @@
+import io
+
+from pypdf import PdfReader
+
+from content_generator import draw_pdf, draw_pdf_bundle
+
+CONTENT = "\n".join(f"Step {idx}: compare the fractions on the number line." for idx in range(80))
+
+
+def read(draw, *args):
+    buffer = io.BytesIO()
+    pages = draw(buffer, *args)
+    reader = PdfReader(io.BytesIO(buffer.getvalue()))
+    assert len(reader.pages) == pages
+    return reader
+
+
+def test_single_pdf_and_bundle_both_compress_pages():
+    single = read(draw_pdf, CONTENT, "Fractions")
+    bundle = read(draw_pdf_bundle, [("Lesson plan", CONTENT), ("Worksheet", CONTENT)])
+
+    for reader in (single, bundle):
+        assert all("/FlateDecode" in page["/Contents"].get_object()["/Filter"] for page in reader.pages)
+    assert len(bundle.pages) == 2 * len(single.pages)
+    assert [entry.title for entry in bundle.outline] == ["Lesson plan", "Worksheet"]
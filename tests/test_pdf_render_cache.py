@@ -0,0 +1,98 @@
+import os
+import threading
+
+import content_generator
+from content_generator import PDFRenderCache
+
+
+def renderer(data, calls):
+    def render():
+        calls.append(data)
+        return data
+    return render
+
+
+def test_small_pdfs_stay_in_memory():
+    cache = PDFRenderCache(disk_threshold=100)
+    calls = []
+    key = PDFRenderCache.make_key("lesson", "A4")
+    assert cache.get_or_render(key, renderer(b"%PDF small", calls)) == b"%PDF small"
+    assert cache.get_or_render(key, renderer(b"%PDF small", calls)) == b"%PDF small"
+
+    assert calls == [b"%PDF small"]
+    assert cache.get_stats()["memory_entries"] == 1 and cache.disk_dir is None
+
+
+def test_disk_io_happens_outside_the_lock(tmp_path, monkeypatch):
+    cache = PDFRenderCache(disk_threshold=10, disk_dir=str(tmp_path))
+    opened = []
+    fdopen = os.fdopen
+
+    def checked_open(path, *args, **kwargs):
+        opened.append(os.path.basename(path))
+        assert not cache._lock.locked()
+        return open(path, *args, **kwargs)
+
+    def checked_fdopen(fd, *args, **kwargs):
+        assert not cache._lock.locked()
+        return fdopen(fd, *args, **kwargs)
+
+    monkeypatch.setattr(content_generator, "open", checked_open, raising=False)
+    monkeypatch.setattr(content_generator.os, "fdopen", checked_fdopen)
+    data = b"%PDF " + b"x" * 100
+    key = PDFRenderCache.make_key("worksheet")
+    calls = []
+    assert cache.get_or_render(key, renderer(data, calls)) == data
+    assert cache.get_or_render(key, renderer(data, calls)) == data
+
+    assert calls == [data]
+    assert len(opened) == 1 and opened[0].startswith(f"{key}.") and opened[0].endswith(".pdf")
+
+
+def test_evicted_files_are_deleted(tmp_path):
+    cache = PDFRenderCache(disk_threshold=10, max_disk_bytes=250, disk_dir=str(tmp_path))
+    for idx in range(3):
+        cache.get_or_render(PDFRenderCache.make_key(idx), lambda: b"%PDF " + b"x" * 100)
+
+    stats = cache.get_stats()
+    assert stats["disk_entries"] == 2 and stats["evictions"] == 1
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(path) for _, path in cache.disk.values())
+
+    cache.clear()
+    assert os.listdir(tmp_path) == []
+
+
+def test_deleted_file_is_rendered_again(tmp_path):
+    cache = PDFRenderCache(disk_threshold=10, disk_dir=str(tmp_path))
+    key = PDFRenderCache.make_key("plan")
+    calls = []
+    cache.get_or_render(key, renderer(b"%PDF " + b"x" * 100, calls))
+    for name in os.listdir(tmp_path):
+        os.remove(tmp_path / name)
+
+    assert cache.get_or_render(key, renderer(b"%PDF " + b"y" * 100, calls)) == b"%PDF " + b"y" * 100
+    assert len(calls) == 2 and cache.get_stats()["disk_entries"] == 1
+
+
+def test_concurrent_requests_render_once(tmp_path):
+    cache = PDFRenderCache(disk_threshold=10, disk_dir=str(tmp_path))
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow_render():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return b"%PDF " + b"z" * 100
+
+    key = PDFRenderCache.make_key("shared")
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_render(key, slow_render))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    assert started.wait(5)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert calls == [1] and len(results) == 4 and len(set(results)) == 1
@@ -0,0 +1,94 @@
+import threading
+
+from content_generator import ConfigManager, DocumentManager, LessonPlanController
+
+
+class GatedManager(DocumentManager):
+    """Counts retrievals per query; queries in `gated` block until released."""
+
+    def __init__(self, gated=()):
+        super().__init__(ConfigManager())
+        self.gated = set(gated)
+        self.release = threading.Event()
+        self.calls = []
+        self.calls_lock = threading.Lock()
+
+    def get_relevant_context(self, query, max_tokens=None, **kwargs):
+        with self.calls_lock:
+            self.calls.append(query)
+        if query in self.gated:
+            self.release.wait(5)
+        return f"context for {query}"
+
+
+def drain(controller):
+    for future in list(controller._prefetches.values()):
+        future.result(5)
+
+
+def test_prefetches_are_deduplicated():
+    manager = GatedManager(gated={"fractions"})
+    controller = LessonPlanController(document_manager=manager)
+    for _ in range(3):
+        controller._prefetch_reference_context("fractions")
+    manager.release.set()
+    drain(controller)
+
+    assert manager.calls == ["fractions"]
+    assert controller._prefetches == {}
+
+
+def test_retrieval_does_not_wait_behind_queued_prefetches():
+    workers = LessonPlanController.PREFETCH_WORKERS
+    blockers = [f"blocked {idx}" for idx in range(workers)]
+    manager = GatedManager(gated=blockers)
+    controller = LessonPlanController(document_manager=manager)
+    for outcome in blockers + ["decimals"]:
+        controller._prefetch_reference_context(outcome)
+
+    # Both workers are busy, so the queued prefetch is cancelled and run here
+    assert controller.get_reference_context("decimals") == "context for decimals"
+    manager.release.set()
+    drain(controller)
+
+    assert sorted(manager.calls) == sorted(blockers + ["decimals"])
+    assert controller._prefetches == {}
+
+
+def test_prefetches_are_bounded():
+    manager = GatedManager(gated={f"topic {idx}" for idx in range(20)})
+    controller = LessonPlanController(document_manager=manager)
+    for idx in range(20):
+        controller._prefetch_reference_context(f"topic {idx}")
+
+    assert len(controller._prefetches) == LessonPlanController.MAX_PENDING_PREFETCHES
+    manager.release.set()
+    drain(controller)
+
+
+def test_slow_retrieval_falls_back_to_no_context(monkeypatch):
+    manager = GatedManager(gated={"fractions"})
+    controller = LessonPlanController(document_manager=manager)
+    monkeypatch.setattr(controller, "REFERENCE_TIMEOUT", 0.05)
+
+    assert controller.get_reference_context("fractions") == ""
+    manager.release.set()
+
+
+def test_generation_waits_for_retrieval_after_building_the_prompt(monkeypatch):
+    manager = GatedManager(gated={"fractions"})
+    controller = LessonPlanController(document_manager=manager)
+    monkeypatch.setattr(controller, "validate_api_key", lambda: True)
+    seen = {}
+
+    def generate_plan(*args, reference_context=None, **kwargs):
+        # Retrieval is still blocked while the generator runs
+        seen["pending"] = not reference_context.done()
+        manager.release.set()
+        seen["context"] = reference_context.result(5)
+        return "plan"
+
+    monkeypatch.setattr(controller.generator, "generate_plan", generate_plan)
+
+    assert controller.generate_lesson_plan("fractions", "5", "CAPS", 60, {}) == "plan"
+    assert seen == {"pending": True, "context": "context for fractions"}
@@ -0,0 +1,47 @@
+import math
+import random
+
+from content_generator import SegmentedIndex
+
+
+def walked_counts(index):
+    """Count indexed and tombstoned chunks by walking every segment."""
+    total = dead = 0
+    for segment in index.segments:
+        for doc_id, count in segment["doc_chunks"].items():
+            total += count
+            if SegmentedIndex._is_dead(doc_id, segment["seq"], index.tombstones):
+                dead += count
+    return total, dead
+
+
+def test_running_totals_match_the_segments():
+    rng = random.Random(7)
+    index = SegmentedIndex(compaction_threshold=0.3, max_segments=8, background=False)
+    live = {}
+    for step in range(400):
+        doc_id = f"doc{rng.randrange(40)}"
+        if doc_id in live and rng.random() < 0.5:
+            index.remove_document(doc_id)
+            del live[doc_id]
+        else:
+            chunks = [f"chunk {idx} of {doc_id} step {step}" for idx in range(rng.randrange(1, 6))]
+            index.add_document(doc_id, chunks)
+            live[doc_id] = live.get(doc_id, 0) + len(chunks)
+        assert (index.total_chunks, index.dead_chunks) == walked_counts(index)
+
+    assert index.total_chunks - index.dead_chunks == sum(live.values())
+    index.compact()
+    assert (index.total_chunks, index.dead_chunks) == (sum(live.values()), 0)
+
+
+def test_search_idf_counts_only_live_chunks():
+    index = SegmentedIndex(background=False)
+    index.add_document("a", ["fractions halves", "decimals tenths"])
+    index.add_document("b", ["fractions quarters"])
+    index.remove_document("b")
+
+    hits = index.search(["fractions"])
+    assert list(hits) == [("a", 0)]
+    assert abs(hits[("a", 0)] - math.log(1 + 2 / 1)) < 1e-9
+
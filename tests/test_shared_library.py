@@ -0,0 +1,104 @@
+import threading
+
+from content_generator import (
+    ConfigManager, DocumentLibraryView, DocumentManager, IngestionService, SharedDocumentLibrary
+)
+
+FRACTIONS = b"Fractions\n\nStudents compare fractions with bar models and number lines."
+
+
+class PausingManager(DocumentManager):
+    """Pauses after an import returns, before the library takes its reference."""
+
+    def __init__(self):
+        super().__init__(ConfigManager())
+        self.pause = False
+        self.imported = threading.Event()
+        self.resume = threading.Event()
+
+    def import_bytes(self, data, name=None, metadata=None, claim=None):
+        doc_id = super().import_bytes(data, name, metadata, claim=claim)
+        if self.pause:
+            self.imported.set()
+            self.resume.wait(5)
+        return doc_id
+
+
+def test_views_share_documents_and_release_on_close():
+    library = SharedDocumentLibrary(DocumentManager(ConfigManager()))
+    first, second = DocumentLibraryView(library), DocumentLibraryView(library)
+
+    doc_id = first.import_bytes(FRACTIONS, "fractions.txt")
+    assert second.import_bytes(FRACTIONS, "copy.txt") == doc_id
+    assert first.import_bytes(FRACTIONS, "again.txt") == doc_id
+    assert library.get_stats() == {"documents": 1, "references": 2, "published": 0}
+
+    first.close()
+    assert library.manager.backend.has_document(doc_id)
+    second.close()
+    assert not library.manager.backend.has_document(doc_id)
+
+
+def test_release_during_reimport_keeps_the_document():
+    manager = PausingManager()
+    library = SharedDocumentLibrary(manager)
+    holder, importer = DocumentLibraryView(library), DocumentLibraryView(library)
+    doc_id = holder.import_bytes(FRACTIONS, "fractions.txt")
+
+    manager.pause = True
+    thread = threading.Thread(target=importer.import_bytes, args=(FRACTIONS, "fractions.txt"))
+    thread.start()
+    assert manager.imported.wait(5)
+    holder.close()  # The paused import already holds its reference
+    assert manager.backend.has_document(doc_id)
+    manager.resume.set()
+    thread.join(5)
+
+    assert library.refcounts == {doc_id: 1}
+    assert manager.backend.has_document(doc_id)
+
+
+def test_imports_and_releases_do_not_wait_for_other_imports():
+    manager = PausingManager()
+    library = SharedDocumentLibrary(manager)
+    first, second = DocumentLibraryView(library), DocumentLibraryView(library)
+    doc_id = first.import_bytes(FRACTIONS, "fractions.txt")
+
+    manager.pause = True
+    thread = threading.Thread(target=second.import_bytes, args=(b"Decimals\n\nTenths.", "decimals.txt"))
+    thread.start()
+    assert manager.imported.wait(5)
+    manager.pause = False
+    other = first.import_bytes(b"Angles\n\nRight angles.", "angles.txt")
+    first.close()  # Removes both documents while the paused import is still running
+    assert not manager.backend.has_document(doc_id) and not manager.backend.has_document(other)
+    manager.resume.set()
+    thread.join(5)
+
+    assert list(library.refcounts.values()) == [1]
+
+
+def test_failed_import_drops_its_claim():
+    library = SharedDocumentLibrary(DocumentManager(ConfigManager()))
+    assert library.import_bytes(b"print('hi')", "script.py").startswith("Error")
+    assert library.import_bytes(b"PK\x03\x04broken", "broken.docx").startswith("Error")
+    assert library.refcounts == {}
+
+
+def test_view_works_with_ingestion_service(tmp_path):
+    library = SharedDocumentLibrary(DocumentManager(ConfigManager()))
+    view = DocumentLibraryView(library)
+    path = tmp_path / "fractions.txt"
+    path.write_bytes(FRACTIONS)
+
+    service = IngestionService(view, workers=1)
+    try:
+        batch = service.submit([str(path)])
+        assert batch.wait(5)
+        doc_id = batch.results[str(path)]
+    finally:
+        service.shutdown()
+
+    assert view.backend is library.manager.backend
+    assert view.private_doc_ids == {doc_id}
+    assert library.refcounts == {doc_id: 1}
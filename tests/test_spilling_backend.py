@@ -0,0 +1,90 @@
+import gc
+import os
+
+import pytest
+
+from content_generator import ConfigManager, DocumentManager, InMemoryDocumentBackend
+
+FRACTIONS = "\n\n".join(f"Paragraph {idx} places fractions and decimals on a number line." for idx in range(300))
+SHAPES = "\n\n".join(f"Paragraph {idx} sorts shapes by their angles and sides." for idx in range(300))
+
+
+def import_text(manager, text, name):
+    doc_id = manager.import_bytes(text.encode(), name)
+    assert doc_id.startswith("doc_")
+    return doc_id
+
+
+@pytest.fixture
+def manager(tmp_path):
+    backend = InMemoryDocumentBackend(memory_budget=1, spill_dir=str(tmp_path))
+    return DocumentManager(ConfigManager(), backend=backend)
+
+
+def test_dense_scan_and_chunk_bounds_leave_text_on_disk(manager, monkeypatch):
+    backend = manager.backend
+    spilled = import_text(manager, FRACTIONS, "fractions.txt")
+    import_text(manager, SHAPES, "shapes.txt")
+    assert spilled in backend.spilled
+
+    loaded = []
+    load_spill = backend._load_spill
+    monkeypatch.setattr(backend, "_load_spill", lambda path: loaded.append(path) or load_spill(path))
+    vectors = [vector for doc_id, _, vector in backend.iter_embeddings() if doc_id == spilled]
+
+    assert vectors and [os.path.basename(path) for path in loaded] == [f"{spilled}.vectors"]
+    start, end = backend.get_chunk_bounds(spilled, 0)
+    assert start == 0 and FRACTIONS[start:end].startswith("Paragraph 0")
+    assert backend.spill_stats["reloads"] == 0 and spilled in backend.spilled
+
+
+def test_reloaded_document_keeps_its_embeddings(manager):
+    backend = manager.backend
+    spilled = import_text(manager, FRACTIONS, "fractions.txt")
+    import_text(manager, SHAPES, "shapes.txt")
+    before = [vector for doc_id, _, vector in backend.iter_embeddings([spilled])]
+
+    assert manager.get_document_content(spilled) == FRACTIONS
+    assert spilled not in backend.spilled
+    assert [vector for _, _, vector in backend.iter_embeddings([spilled])] == before
+
+
+def test_shared_blocks_are_counted_once():
+    manager = DocumentManager(ConfigManager())
+    backend = manager.backend
+    import_text(manager, FRACTIONS, "fractions.txt")
+    import_text(manager, FRACTIONS + "\n\nOne more paragraph.", "fractions-v2.txt")
+
+    shared = set.intersection(*(set(record["blocks"]) for _, record in backend.list_documents()))
+    assert shared
+    usage = backend.get_resident_bytes()
+    assert abs(sum(usage.values()) - backend.resident_total) <= len(usage)
+    text_bytes = sum(len(block) for block in backend.content_store.blocks.values())
+    assert backend.resident_total == text_bytes + sum(backend.resident.values())
+
+
+def test_spill_files_are_removed_with_documents_and_on_close(manager, tmp_path):
+    spilled = import_text(manager, FRACTIONS, "fractions.txt")
+    import_text(manager, SHAPES, "shapes.txt")
+    assert sorted(os.listdir(tmp_path)) == [f"{spilled}.spill", f"{spilled}.vectors"]
+
+    manager.remove_document(spilled)
+    assert os.listdir(tmp_path) == []
+
+    other = import_text(manager, FRACTIONS, "again.txt")
+    assert os.listdir(tmp_path)
+    manager.backend.close()
+    assert os.listdir(tmp_path) == []
+    assert other in manager.backend.documents
+
+
+def test_spill_files_are_removed_when_the_backend_is_collected(tmp_path):
+    manager = DocumentManager(ConfigManager(), backend=InMemoryDocumentBackend(memory_budget=1))
+    import_text(manager, FRACTIONS, "fractions.txt")
+    import_text(manager, SHAPES, "shapes.txt")
+    spill_dir = manager.backend.spill_dir
+    assert os.listdir(spill_dir)
+
+    del manager
+    gc.collect()
+    assert not os.path.exists(spill_dir)
@@ -0,0 +1,93 @@
+import sqlite3
+import threading
+
+import pytest
+
+from content_generator import ConfigManager, DocumentManager, SQLiteDocumentBackend
+
+FRACTIONS = b"Fractions\n\nStudents compare fractions with bar models and number lines."
+GEOMETRY = b"Geometry\n\nStudents classify triangles by their sides and angles."
+
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = SQLiteDocumentBackend(str(tmp_path / "documents.db"))
+    yield backend
+    backend.close()
+
+
+def make_manager(backend):
+    return DocumentManager(ConfigManager(), backend=backend, duplicate_threshold=None)
+
+
+def test_import_and_search_round_trip(backend):
+    manager = make_manager(backend)
+    doc_id = manager.import_bytes(FRACTIONS, "fractions.txt", {"grade": 3})
+
+    assert backend.has_document(doc_id)
+    assert manager.get_document_content(doc_id) == FRACTIONS.decode()
+    assert [doc["doc_id"] for doc in manager.get_document_list()] == [doc_id]
+    assert "number lines" in manager.get_relevant_context("compare fractions")
+
+
+def test_filter_by_facets(backend):
+    manager = make_manager(backend)
+    fractions = manager.import_bytes(FRACTIONS, "fractions.txt", {"grade": 3, "curriculum": "Common Core"})
+    geometry = manager.import_bytes(GEOMETRY, "geometry.txt", {"grade": 4, "curriculum": "Common Core"})
+
+    assert backend.filter_documents({"grade": 3}) == {fractions}
+    assert backend.filter_documents({"grade": [3, 4]}) == {fractions, geometry}
+    assert backend.filter_documents({"curriculum": "common core", "grade": "4"}) == {geometry}
+    assert manager.get_relevant_context("students", filters={"grade": 4}).startswith("From geometry.txt")
+
+
+def test_remove_and_reimport(backend):
+    manager = make_manager(backend)
+    doc_id = manager.import_bytes(FRACTIONS, "fractions.txt")
+
+    assert manager.remove_document(doc_id)
+    assert not backend.has_document(doc_id)
+    assert manager.get_relevant_context("compare fractions") == ""
+    assert not manager.remove_document(doc_id)
+
+    assert manager.import_bytes(FRACTIONS, "fractions.txt") == doc_id
+    assert "number lines" in manager.get_relevant_context("compare fractions")
+
+
+def test_generation_only_changes_when_rows_change(backend):
+    manager = make_manager(backend)
+    doc_id = manager.import_bytes(FRACTIONS, "fractions.txt")
+    generation = backend.get_generation()
+
+    # Re-importing the same content writes nothing
+    assert manager.import_bytes(FRACTIONS, "copy.txt") == doc_id
+    assert backend.get_generation() == generation
+    assert not backend.remove_document("doc_missing")
+    assert backend.get_generation() == generation
+
+    manager.import_bytes(GEOMETRY, "geometry.txt")
+    assert backend.get_generation() == generation + 1
+
+
+def test_close_closes_every_thread_connection(backend):
+    conn = backend._connect()
+    other = []
+    thread = threading.Thread(target=lambda: other.append(backend._connect()))
+    thread.start()
+    thread.join()
+
+    backend.close()
+    for connection in (conn, other[0]):
+        with pytest.raises(sqlite3.ProgrammingError):
+            connection.execute("SELECT 1")
+    # The backend reconnects on next use
+    assert backend.get_generation() == 0
+
+
+def test_default_path_is_in_app_data_directory(tmp_path, monkeypatch):
+    monkeypatch.setenv("LESSON_PLANNER_DATA_DIR", str(tmp_path / "data"))
+    backend = SQLiteDocumentBackend()
+    try:
+        assert backend.db_path == str(tmp_path / "data" / "documents.db")
+    finally:
+        backend.close()
@@ -0,0 +1,114 @@
+import io
+import sqlite3
+import zipfile
+
+import pytest
+
+from content_generator import (
+    ChunkingEngine, ConfigManager, DocumentManager, HashingEmbedder, InMemoryDocumentBackend,
+    SQLiteDocumentBackend, WORD_NAMESPACE
+)
+
+PARAGRAPHS = [
+    f"Paragraph {idx} explains place value with tens and ones using base ten blocks."
+    for idx in range(400)
+]
+DOCUMENT = "\n\n".join(PARAGRAPHS)
+
+
+class RecordingEmbedder(HashingEmbedder):
+    """Records batch sizes and can fail from a given call on."""
+
+    def __init__(self, fail_from=None):
+        super().__init__()
+        self.batches = []
+        self.fail_from = fail_from
+
+    def embed(self, texts):
+        self.batches.append(len(texts))
+        if self.fail_from is not None and len(self.batches) > self.fail_from:
+            raise RuntimeError("embedding service unavailable")
+        return super().embed(texts)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        backend = InMemoryDocumentBackend()
+    else:
+        backend = SQLiteDocumentBackend(str(tmp_path / "documents.db"))
+    yield backend
+    backend.close()
+
+
+def make_manager(backend, embedder):
+    chunker = ChunkingEngine(strategy="paragraph")
+    return DocumentManager(ConfigManager(), embedder=embedder, backend=backend, chunker=chunker)
+
+
+def test_chunks_are_embedded_in_bounded_batches(backend):
+    embedder = RecordingEmbedder()
+    manager = make_manager(backend, embedder)
+    doc_id = manager.import_bytes(DOCUMENT.encode(), "place_value.txt")
+
+    assert sum(embedder.batches) == len(PARAGRAPHS)
+    assert max(embedder.batches) == DocumentManager.EMBED_BATCH_CHUNKS
+    assert manager.get_document_content(doc_id) == DOCUMENT
+    assert backend.get_document(doc_id)["size"] == len(DOCUMENT)
+    for chunk_idx in (0, 63, 64, len(PARAGRAPHS) - 1):
+        text, start, end = backend.get_chunk(doc_id, chunk_idx)
+        assert text == PARAGRAPHS[chunk_idx] == DOCUMENT[start:end]
+    assert len(list(backend.iter_embeddings({doc_id}))) == len(PARAGRAPHS)
+
+
+def test_embedding_failure_drops_all_vectors(backend):
+    embedder = RecordingEmbedder(fail_from=2)
+    manager = make_manager(backend, embedder)
+    doc_id = manager.import_bytes(DOCUMENT.encode(), "place_value.txt")
+
+    assert doc_id.startswith("doc_")
+    assert len(embedder.batches) == 3
+    assert list(backend.iter_embeddings({doc_id})) == []
+    assert "place value" in manager.get_relevant_context("place value", mode="lexical")
+
+
+def test_sqlite_stores_text_per_chunk_and_block(tmp_path):
+    db_path = str(tmp_path / "documents.db")
+    backend = SQLiteDocumentBackend(db_path)
+    backend.BLOCK_SIZE = 4096
+    manager = make_manager(backend, HashingEmbedder())
+    doc_id = manager.import_bytes(DOCUMENT.encode(), "place_value.txt")
+    backend.close()
+
+    conn = sqlite3.connect(db_path)
+    blocks = conn.execute("SELECT count(*) FROM document_blocks WHERE doc_id = ?", (doc_id,)).fetchone()[0]
+    texts = [row[0] for row in conn.execute("SELECT text FROM chunks WHERE doc_id = ? ORDER BY chunk_idx", (doc_id,))]
+    conn.close()
+    assert blocks > 1
+    assert texts == PARAGRAPHS
+
+
+def test_duplicate_in_one_batch_is_stored_once(backend):
+    manager = make_manager(backend, HashingEmbedder())
+    first, second = manager._import_sources([
+        (memoryview(DOCUMENT.encode()), "a.txt", None, None),
+        (memoryview(DOCUMENT.encode()), "b.txt", None, None)
+    ])
+
+    assert first == second
+    assert manager.get_document_content(first) == DOCUMENT
+    assert [doc["name"] for doc in manager.get_document_list()] == ["a.txt"]
+
+
+def test_docx_paragraphs_stream_out_of_body_and_tables():
+    body = "".join(f"<w:p><w:r><w:t>Paragraph {idx}</w:t></w:r></w:p>" for idx in range(3))
+    body += "<w:tbl><w:tr><w:tc><w:p><w:r><w:t>Cell</w:t><w:tab/><w:t>text</w:t></w:r></w:p></w:tc></w:tr></w:tbl>"
+    xml = f'<w:document xmlns:w="{WORD_NAMESPACE}"><w:body>{body}</w:body></w:document>'
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("[Content_Types].xml", "<Types/>")
+        archive.writestr("word/document.xml", xml)
+
+    manager = DocumentManager(ConfigManager())
+    doc_id = manager.import_bytes(buffer.getvalue(), "lesson.docx")
+    assert manager.get_document_content(doc_id) == "Paragraph 0\n\nParagraph 1\n\nParagraph 2\n\nCell\ttext"
@@ -0,0 +1,53 @@
+from reportlab.pdfbase import pdfmetrics
+
+from text_layout import TextLayout
+
+
+def fits(layout, lines):
+    return all(pdfmetrics.stringWidth(line, layout.font_name, layout.font_size) <= layout.max_width + 1e-6
+               for line in lines)
+
+
+def test_fitting_lines_are_unchanged():
+    layout = TextLayout("Helvetica", 12, 300)
+    assert layout.wrap("Name:    ____\n\n  Total  =  42") == ["Name:    ____", "", "  Total  =  42"]
+
+
+def test_long_lines_wrap_at_words_and_keep_indentation():
+    layout = TextLayout("Helvetica", 12, 200)
+    line = "    " + " ".join(["fraction"] * 20)
+    lines = layout.wrap_line(line)
+
+    assert len(lines) > 1 and fits(layout, lines)
+    assert all(wrapped.startswith("    fraction") for wrapped in lines)
+    assert " ".join(" ".join(lines).split()) == " ".join(line.split())
+
+
+def test_tabs_expand_before_wrapping():
+    layout = TextLayout("Helvetica", 12, 500)
+    assert layout.wrap("\tItem") == ["    Item"]
+
+
+def test_overlong_words_are_split_between_characters():
+    layout = TextLayout("Helvetica", 12, 100)
+    word = "x" * 60
+    lines = layout.wrap_line(word)
+
+    assert len(lines) > 1 and fits(layout, lines)
+    assert "".join(lines) == word
+
+
+def test_wide_indentation_is_clamped():
+    layout = TextLayout("Helvetica", 12, 100)
+    lines = layout.wrap_line(" " * 80 + "one two three four five six")
+
+    assert len(lines) > 1 and fits(layout, lines)
+    indent_width = layout.string_width(lines[0][:len(lines[0]) - len(lines[0].lstrip())])
+    assert 0 < indent_width <= layout.max_width * TextLayout.MAX_INDENT_FRACTION
+    assert " ".join(" ".join(lines).split()) == "one two three four five six"
+
+
+def test_width_matches_font_metrics():
+    layout = TextLayout("Times-Roman", 10, 500)
+    text = "Équivalent fractions: ½ and 2/4"
+    assert abs(layout.string_width(text) - pdfmetrics.stringWidth(text, "Times-Roman", 10)) < 1e-6
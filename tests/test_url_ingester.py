@@ -0,0 +1,180 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from content_generator import (
+    ConfigManager, DocumentLibraryView, DocumentManager, SharedDocumentLibrary, URLIngester
+)
+
+
+class PageServer:
+    """Serves HTML pages with ETag and Last-Modified validators."""
+
+    def __init__(self):
+        self.pages = {}  # Path -> (html, etag)
+        self.content_types = {}  # Path -> Content-Type overriding the default
+        self.requests = []  # (path, If-None-Match, If-Modified-Since, status)
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                html, etag = server.pages[self.path]
+                if_none_match = self.headers.get("If-None-Match")
+                if_modified_since = self.headers.get("If-Modified-Since")
+                status = 304 if if_none_match == etag else 200
+                server.requests.append((self.path, if_none_match, if_modified_since, status))
+                body = html.encode() if status == 200 else b""
+                self.send_response(status)
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", "Mon, 05 Oct 2026 10:00:00 GMT")
+                self.send_header("Content-Type", server.content_types.get(self.path, "text/html; charset=utf-8"))
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.httpd.server_port}{path}"
+
+    def set_page(self, path, text, version=1):
+        self.pages[path] = (f"<html><body><h1>{path}</h1><p>{text}</p></body></html>", f'"{path}-{version}"')
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def server():
+    server = PageServer()
+    for idx in range(3):
+        server.set_page(f"/page{idx}", f"Lesson {idx} covers counting in steps of {idx + 2}.")
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def manager():
+    return DocumentManager(ConfigManager())
+
+
+def sync(ingester, server, paths):
+    return ingester.sync([server.url(path) for path in paths])
+
+
+def test_first_sync_imports_every_page(server, manager):
+    ingester = URLIngester(manager)
+    results = sync(ingester, server, server.pages)
+    ingester.close()
+
+    assert {result["status"] for result in results.values()} == {"new"}
+    assert len(manager.get_document_list()) == 3
+    assert all(if_none_match is None for _, if_none_match, _, _ in server.requests)
+    assert "steps of 3" in manager.get_document_content(results[server.url("/page1")]["doc_id"])
+
+
+def test_resync_sends_conditional_requests_and_skips_unchanged(server, manager):
+    ingester = URLIngester(manager)
+    first = sync(ingester, server, server.pages)
+    server.requests.clear()
+    second = sync(ingester, server, server.pages)
+    ingester.close()
+
+    assert {result["status"] for result in second.values()} == {"unchanged"}
+    assert {url: result["doc_id"] for url, result in second.items()} == {
+        url: result["doc_id"] for url, result in first.items()
+    }
+    assert sorted(server.requests) == [
+        (path, f'"{path}-1"', "Mon, 05 Oct 2026 10:00:00 GMT", 304) for path in sorted(server.pages)
+    ]
+    assert ingester.stats["not_modified"] == 3
+
+
+def test_edited_page_replaces_its_document(server, manager):
+    ingester = URLIngester(manager)
+    url = server.url("/page0")
+    old_doc = sync(ingester, server, server.pages)[url]["doc_id"]
+
+    server.set_page("/page0", "Lesson 0 now covers doubling.", version=2)
+    results = sync(ingester, server, server.pages)
+    ingester.close()
+
+    assert results[url]["status"] == "changed"
+    assert results[server.url("/page1")]["status"] == "unchanged"
+    assert not manager.has_document(old_doc)
+    assert "doubling" in manager.get_document_content(results[url]["doc_id"])
+    assert len(manager.get_document_list()) == 3
+
+
+def test_document_shared_with_an_upload_is_kept(server, manager):
+    ingester = URLIngester(manager)
+    url = server.url("/page2")
+    old_doc = sync(ingester, server, ["/page2"])[url]["doc_id"]
+    upload = manager.import_bytes(manager.get_document_content(old_doc).encode(), "notes.txt")
+    assert upload == old_doc
+
+    server.set_page("/page2", "Lesson 2 now covers halving.", version=2)
+    assert sync(ingester, server, ["/page2"])[url]["status"] == "changed"
+    ingester.close()
+
+    assert manager.has_document(old_doc)
+
+
+def test_oversized_response_is_rejected(server, manager):
+    ingester = URLIngester(manager)
+    ingester.MAX_RESPONSE_BYTES = 64
+    results = sync(ingester, server, ["/page0"])
+    ingester.close()
+
+    assert results[server.url("/page0")]["status"].startswith("Error fetching page: Response larger than 64 bytes")
+    assert manager.get_document_list() == []
+
+
+def test_works_through_a_library_view(server, manager):
+    view = DocumentLibraryView(SharedDocumentLibrary(manager))
+    ingester = URLIngester(view)
+    first = sync(ingester, server, ["/page0"])
+    second = sync(ingester, server, ["/page0"])
+    ingester.close()
+
+    assert second[server.url("/page0")] == {"status": "unchanged", "doc_id": first[server.url("/page0")]["doc_id"]}
+    assert view.private_doc_ids == {first[server.url("/page0")]["doc_id"]}
+
+
+def test_unknown_charset_falls_back_to_utf8(server, manager):
+    server.content_types["/page1"] = "text/html; charset=bogus-enc"
+    ingester = URLIngester(manager)
+    results = sync(ingester, server, ["/page1"])
+    ingester.close()
+
+    assert results[server.url("/page1")]["status"] == "new"
+    assert "steps of 3" in manager.get_document_content(results[server.url("/page1")]["doc_id"])
+
+
+def test_failing_page_does_not_abort_the_sync(server, manager, monkeypatch, tmp_path):
+    import_bytes = manager.import_bytes
+
+    def flaky_import(data, name=None, metadata=None):
+        if name.endswith("/page1"):
+            raise RuntimeError("disk full")
+        return import_bytes(data, name, metadata)
+
+    monkeypatch.setattr(manager, "import_bytes", flaky_import)
+    state_path = tmp_path / "pages.json"
+    ingester = URLIngester(manager, state_path=str(state_path))
+    results = sync(ingester, server, server.pages)
+    ingester.close()
+
+    assert results[server.url("/page1")] == {"status": "Error syncing page: disk full", "doc_id": None}
+    assert results[server.url("/page0")]["status"] == "new"
+    assert set(json.loads(state_path.read_text())) == {server.url("/page0"), server.url("/page2")}
@@ -0,0 +1,146 @@
+from reportlab.pdfbase import pdfmetrics
+
+#########################
+# TEXT LAYOUT MODULE
+#########################
+
+class TextLayout:
+    """
+    Wraps text into lines that fit a width, measured with font metrics.
+    
+    Lines that already fit are kept exactly as written. Longer lines break
+    greedily at word boundaries, and a word wider than the line is split
+    between characters. Continuation lines keep the line's indentation,
+    trimmed to at most MAX_INDENT_FRACTION of the width. Glyph widths come
+    from a table built once per font from its metrics, and word widths are
+    cached, so laying out a long document is a few dictionary lookups per
+    word.
+    """
+    
+    TAB_SIZE = 4
+    MAX_INDENT_FRACTION = 0.5  # Widest kept indent, as a fraction of max_width
+    WORD_CACHE_SIZE = 8192
+    _width_tables = {}  # Font name -> {character: width in 1/1000 em}
+    
+    def __init__(self, font_name="Helvetica", font_size=12, max_width=512):
+        """
+        Initialize a layout for one font and line width.
+        
+        Args:
+            font_name (str): Registered reportlab font name
+            font_size (float): Font size in points
+            max_width (float): Line width in points
+        """
+        self.font_name = font_name
+        self.font_size = font_size
+        self.max_width = max_width
+        self.char_widths = self._width_table(font_name)
+        self._scale = font_size / 1000.0
+        self._word_widths = {}  # Word -> width in points
+    
+    def wrap(self, text):
+        """
+        Lay out text, keeping its line breaks and wrapping long lines.
+        
+        Args:
+            text (str): Plain text
+            
+        Returns:
+            list: Lines that each fit within max_width
+        """
+        lines = []
+        for line in text.expandtabs(self.TAB_SIZE).split("\n"):
+            lines.extend(self.wrap_line(line))
+        return lines
+    
+    def wrap_line(self, line):
+        """
+        Wrap one line of text; continuation lines keep its indentation.
+        
+        Returns:
+            list: Lines that each fit within max_width; a line that already
+                fits is returned unchanged
+        """
+        words = line.split()
+        if not words:
+            return [""]
+        if self.string_width(line) <= self.max_width:
+            return [line]
+        indent = line[:len(line) - len(line.lstrip())]
+        indent_width = self.string_width(indent)
+        max_indent_width = self.max_width * self.MAX_INDENT_FRACTION
+        while indent and indent_width > max_indent_width:
+            indent = indent[:-1]
+            indent_width = self.string_width(indent)
+        available = self.max_width - indent_width
+        space_width = self.string_width(" ")
+        
+        lines = []
+        current = []
+        current_width = 0.0
+        for word in words:
+            width = self.word_width(word)
+            if current and current_width + space_width + width > available:
+                lines.append(indent + " ".join(current))
+                current = []
+            if not current:
+                if width > available:
+                    pieces = self._split_word(word, available)
+                    lines.extend(indent + piece for piece in pieces[:-1])
+                    word = pieces[-1]
+                    width = self.string_width(word)
+                current = [word]
+                current_width = width
+            else:
+                current.append(word)
+                current_width += space_width + width
+        lines.append(indent + " ".join(current))
+        return lines
+    
+    def word_width(self, word):
+        """Get a word's width in points, from the cache when possible."""
+        width = self._word_widths.get(word)
+        if width is None:
+            if len(self._word_widths) >= self.WORD_CACHE_SIZE:
+                self._word_widths.clear()
+            width = self._word_widths[word] = self.string_width(word)
+        return width
+    
+    def string_width(self, text):
+        """Get the width of a string in points."""
+        widths = self.char_widths
+        total = 0.0
+        for char in text:
+            width = widths.get(char)
+            if width is None:
+                width = pdfmetrics.stringWidth(char, self.font_name, 1000)
+                widths[char] = width
+            total += width
+        return total * self._scale
+    
+    def _split_word(self, word, available):
+        """Split a word too wide for a line into pieces that fit."""
+        pieces = []
+        current = ""
+        current_width = 0.0
+        for char in word:
+            width = self.string_width(char)
+            if current and current_width + width > available:
+                pieces.append(current)
+                current, current_width = "", 0.0
+            current += char
+            current_width += width
+        pieces.append(current)
+        return pieces
+    
+    @classmethod
+    def _width_table(cls, font_name):
+        """Get the glyph width table for a font, building it on first use."""
+        table = cls._width_tables.get(font_name)
+        if table is None:
+            table = {
+                chr(code): pdfmetrics.stringWidth(chr(code), font_name, 1000)
+                for code in list(range(32, 127)) + list(range(160, 256))
+            }
+            cls._width_tables[font_name] = table
+        return table